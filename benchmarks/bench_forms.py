@@ -0,0 +1,90 @@
+"""
+Compares creating forms by binding every field (the WTForms default) against copying the fields from a cached
+`jerboa.forms.FormPrototype`, for `UserForm` (with CSRF and reCAPTCHA) and a form built from `AddressMixin`. Each form
+is created for an empty GET request and for a submitted POST request.
+
+Run from the repository root:
+
+    python benchmarks/bench_forms.py
+"""
+import timeit
+import webapp2
+from jerboa.forms import BaseForm, UserForm, AddressMixin, BaseModelMixin, TEST_RECAPTCHA_SITE_KEY, \
+    TEST_RECAPTCHA_SITE_SECRET
+
+__author__ = 'Matt'
+
+FORM_COUNT = 200
+
+USER_FORM_CONFIG = {
+    'csrf_secret': 'benchmark-secret',
+    'recaptcha_site_key': TEST_RECAPTCHA_SITE_KEY,
+    'recaptcha_site_secret': TEST_RECAPTCHA_SITE_SECRET,
+}
+
+USER_POST = {
+    'uid': u'1',
+    'first_name': u'Matt',
+    'last_name': u'Badger',
+    'username': u'matt',
+    'email_address': u'matt@example.com',
+    'password': u'password',
+    'c_password': u'password',
+    'language_preference': u'en',
+}
+
+ADDRESS_POST = {
+    'uid': u'1',
+    'address_1': u'1 High Street',
+    'city': u'Bedford',
+    'county': u'Bedfordshire',
+    'post_code': u'MK40 1AA',
+    'country': u'GB',
+}
+
+
+class AddressForm(BaseForm, AddressMixin, BaseModelMixin):
+    class Meta:
+        csrf = False
+
+
+def unprototyped(form_class):
+    return type('Unprototyped' + form_class.__name__, (form_class,), {'use_prototype': False})
+
+
+def build_request(app, post=None):
+    request = webapp2.Request.blank('/', POST=post)
+    request.app = app
+    request.session = {}
+    app.set_globals(app=app, request=request)
+    return request
+
+
+def time_forms(form_class, request, form_config):
+    def run():
+        for _ in xrange(FORM_COUNT):
+            form_class(request=request, **form_config)
+
+    run()
+    return min(timeit.repeat(run, number=1, repeat=5)) / FORM_COUNT
+
+
+def main():
+    app = webapp2.WSGIApplication()
+    benchmarks = [
+        ('UserForm', UserForm, USER_FORM_CONFIG, USER_POST),
+        ('AddressForm', AddressForm, {}, ADDRESS_POST),
+    ]
+
+    print('{:>12} {:>6} {:>10} {:>16} {:>10}'.format('form', 'method', 'bind (us)', 'prototype (us)', 'speedup'))
+    for name, form_class, form_config, post in benchmarks:
+        for method, request in (('GET', build_request(app)), ('POST', build_request(app, post=post))):
+            bind_time = time_forms(unprototyped(form_class), request, form_config)
+            prototype_time = time_forms(form_class, request, form_config)
+            print('{:>12} {:>6} {:>10.1f} {:>16.1f} {:>9.1f}x'.format(name, method, bind_time * 1e6,
+                                                                      prototype_time * 1e6,
+                                                                      bind_time / prototype_time))
+
+
+if __name__ == '__main__':
+    main()
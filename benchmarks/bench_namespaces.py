@@ -0,0 +1,90 @@
+"""
+Compares resolving the request namespace with a request init receiver (a config lookup and a `set_namespace` call for
+every request) against `jerboa.namespaces.NamespaceResolver`. Uses `LocalNamespaceManager` so that it can run off
+App Engine.
+
+The stand in lookup scans the tenant config, so with only 10 tenants it is cheaper than the resolver's key handling
+(lower casing the host, validating the key and the locked LRU cache read) and the receiver comes out ahead. Real lookups read config from
+memcache or the datastore, which the resolver only does once per tenant.
+
+Run from the repository root:
+
+    python benchmarks/bench_namespaces.py
+"""
+import random
+import timeit
+import webapp2
+from jerboa.namespaces import NamespaceResolver, HostNamespaceStrategy, LocalNamespaceManager
+
+__author__ = 'Matt'
+
+TENANT_COUNTS = (10, 100, 1000)
+REQUEST_COUNT = 1000
+
+
+def build_tenant_config(tenant_count):
+    return dict(('tenant{}'.format(index), 'tenant{}_ns'.format(index)) for index in xrange(tenant_count))
+
+
+def build_requests(tenant_count):
+    randomizer = random.Random(tenant_count)
+    return [webapp2.Request.blank('/company/overview',
+                                  base_url='http://tenant{}.example.com'.format(randomizer.randrange(tenant_count)))
+            for _ in xrange(REQUEST_COUNT)]
+
+
+def slow_lookup(tenant_config):
+    def lookup(key):
+        # Stand in for a config/datastore read
+        for tenant, namespace in tenant_config.iteritems():
+            if tenant == key:
+                return namespace
+    return lookup
+
+
+def time_receiver(tenant_config, requests):
+    namespace_manager = LocalNamespaceManager()
+    lookup = slow_lookup(tenant_config)
+
+    def run():
+        for request in requests:
+            request.namespace = lookup(request.host.split(':', 1)[0].split('.', 1)[0])
+            current_namespace = namespace_manager.get_namespace()
+            namespace_manager.set_namespace(request.namespace)
+            namespace_manager.set_namespace(current_namespace)
+
+    run()
+    return min(timeit.repeat(run, number=1, repeat=5)) / len(requests)
+
+
+def time_resolver(tenant_config, requests):
+    namespace_manager = LocalNamespaceManager()
+    resolver = NamespaceResolver(strategy=HostNamespaceStrategy(subdomain=True), lookup=slow_lookup(tenant_config),
+                                 namespace_manager=namespace_manager)
+
+    def run():
+        for request in requests:
+            request.namespace = resolver.resolve(request)
+            current_namespace = namespace_manager.get_namespace()
+            if request.namespace != current_namespace:
+                namespace_manager.set_namespace(request.namespace)
+            if namespace_manager.get_namespace() != current_namespace:
+                namespace_manager.set_namespace(current_namespace)
+
+    run()
+    return min(timeit.repeat(run, number=1, repeat=5)) / len(requests)
+
+
+def main():
+    print('{:>10} {:>16} {:>16} {:>10}'.format('tenants', 'receiver (us)', 'resolver (us)', 'speedup'))
+    for tenant_count in TENANT_COUNTS:
+        tenant_config = build_tenant_config(tenant_count)
+        requests = build_requests(tenant_count)
+        receiver_time = time_receiver(tenant_config, requests)
+        resolver_time = time_resolver(tenant_config, requests)
+        print('{:>10} {:>16.2f} {:>16.2f} {:>9.1f}x'.format(tenant_count, receiver_time * 1e6, resolver_time * 1e6,
+                                                           receiver_time / resolver_time))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+"""
+Compares verifying reCAPTCHA responses with a new `urllib2.urlopen` connection for each call (how
+`Recaptcha2Validator` used to work) against the pooled `jerboa.recaptcha.RecaptchaVerifyClient`, using a
+`LocalRecaptchaVerifyServer` so that it runs offline. The stand in is plain HTTP on localhost, so the saving from
+reusing connections is a lower bound; against the real endpoint each new connection also needs a TLS handshake.
+
+Run from the repository root:
+
+    python benchmarks/bench_recaptcha.py
+"""
+import json
+import timeit
+import urllib
+import urllib2
+from jerboa.recaptcha import LocalRecaptchaVerifyServer, RecaptchaVerifyClient
+from jerboa.forms import TEST_RECAPTCHA_SITE_SECRET
+
+__author__ = 'Matt'
+
+VERIFY_COUNT = 200
+
+
+def tokens(prefix):
+    return [u'{}-{}'.format(prefix, i) for i in xrange(VERIFY_COUNT)]
+
+
+def verify_with_urlopen(url, token):
+    params = urllib.urlencode({'secret': TEST_RECAPTCHA_SITE_SECRET, 'response': token})
+    return json.load(urllib2.urlopen(urllib2.Request(url, params), timeout=5))
+
+
+def main():
+    all_tokens = tokens('urlopen') + tokens('pooled')
+    with LocalRecaptchaVerifyServer(valid_tokens=all_tokens) as server:
+        client = RecaptchaVerifyClient(verify_url=server.url)
+
+        def run_urlopen():
+            for token in tokens('urlopen'):
+                assert verify_with_urlopen(server.url, token)['success']
+
+        def run_pooled():
+            for token in tokens('pooled'):
+                assert client.verify(TEST_RECAPTCHA_SITE_SECRET, token)['success']
+
+        print('{:>10} {:>12} {:>12}'.format('client', 'verify (us)', 'connections'))
+        for name, run in (('urlopen', run_urlopen), ('pooled', run_pooled)):
+            connections = server.connections
+            verify_time = timeit.timeit(run, number=1) / VERIFY_COUNT
+            print('{:>10} {:>12.1f} {:>12}'.format(name, verify_time * 1e6, server.connections - connections))
+        client.pool.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+"""
+Compares rendering a page by expanding `response.raw.__dict__` into keyword arguments (the previous behaviour) with
+rendering the scratch space directly as a layered `RenderContext`.
+
+For each render we record the time taken and the context that Jinja creates. Expanding the scratch space allocates
+three dicts: the keyword arguments, the `vars` dict in `Template.render` and the parent context, which merges `vars`
+into a copy of the globals. The entry and byte counts below are measured from the last two of those (the keyword
+argument dict is the same size as `vars`). A layered context allocates a single fixed size object.
+
+Run from the repository root:
+
+    python benchmarks/bench_render_context.py
+"""
+import os
+import sys
+import shutil
+import timeit
+import tempfile
+import webapp2
+from jinja2 import Template
+from jerboa.app import ScratchSpace
+from jerboa.renderers import Jinja2Renderer
+
+__author__ = 'Matt'
+
+SCRATCH_SPACE_SIZES = (5, 25, 100)
+GLOBAL_COUNT = 50
+RENDER_COUNT = 2000
+TEMPLATE = u'<h1>{{ title }}</h1>{% for row in rows %}<p>{{ row }}</p>{% endfor %}'
+
+
+class ContextRecorder(object):
+    """
+    Wraps `Template.new_context` to record the size of the dicts created for each render.
+    """
+    def __init__(self):
+        self.renders = 0
+        self.entries = 0
+        self.bytes = 0
+        self._new_context = Template.new_context
+
+    def __enter__(self):
+        recorder = self
+
+        def new_context(template, vars=None, shared=False, locals=None):
+            context = recorder._new_context(template, vars, shared, locals)
+            recorder.renders += 1
+            if not shared:
+                # Keyword arguments, `vars` and the merged parent
+                recorder.entries += len(vars) * 2 + len(context.parent)
+                recorder.bytes += sys.getsizeof(vars) * 2 + sys.getsizeof(context.parent)
+            else:
+                recorder.bytes += sys.getsizeof(context.parent)
+            return context
+
+        Template.new_context = new_context
+        return self
+
+    def __exit__(self, *exc_info):
+        Template.new_context = self._new_context
+
+
+def build_response(scratch_space_size):
+    response = webapp2.Response()
+    response.raw = ScratchSpace()
+    response.raw.title = u'Benchmark'
+    response.raw.rows = range(10)
+    for index in xrange(scratch_space_size - 2):
+        setattr(response.raw, 'var{}'.format(index), index)
+    return response
+
+
+def measure(render, response):
+    with ContextRecorder() as recorder:
+        render(response)
+    duration = min(timeit.repeat(lambda: render(response), number=RENDER_COUNT, repeat=3)) / RENDER_COUNT
+    return duration, recorder.entries, recorder.bytes
+
+
+def main():
+    template_path = tempfile.mkdtemp()
+    try:
+        with open(os.path.join(template_path, 'page.html'), 'w') as template_file:
+            template_file.write(TEMPLATE)
+
+        renderer = Jinja2Renderer(config={'theme_base_template_path': [template_path], 'enable_i18n': False})
+        renderer.environment.globals.update(('global{}'.format(index), index) for index in xrange(GLOBAL_COUNT))
+
+        def render_kwargs(response):
+            return renderer.render_template('page.html', **response.raw.__dict__)
+
+        def render_context(response):
+            return renderer.render_context('page.html', response.raw)
+
+        print('{:>8} {:>12} {:>12} {:>14} {:>14} {:>12} {:>12}'.format(
+            'vars', 'kwargs (us)', 'layered (us)', 'kwargs copied', 'layered copied', 'kwargs (B)', 'layered (B)'))
+        for size in SCRATCH_SPACE_SIZES:
+            response = build_response(size)
+            kwargs_time, kwargs_entries, kwargs_bytes = measure(render_kwargs, response)
+            context_time, context_entries, context_bytes = measure(render_context, response)
+            print('{:>8} {:>12.2f} {:>12.2f} {:>14} {:>14} {:>12} {:>12}'.format(
+                size, kwargs_time * 1e6, context_time * 1e6, kwargs_entries, context_entries, kwargs_bytes,
+                context_bytes))
+    finally:
+        shutil.rmtree(template_path)
+
+
+if __name__ == '__main__':
+    main()
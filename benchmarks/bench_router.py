@@ -0,0 +1,103 @@
+"""
+Compares the default webapp2 router with `jerboa.routers.RadixRouter` for an app with 10, 100 and 1000 resources. Each
+resource has the routes that `crud_method_definition_generator` would produce, grouped by a `PathPrefixRoute` in the
+same way as `parse_component_config`.
+
+The first table only times `router.match`. The second times whole requests through the Jerboa dispatcher with the
+default `JerboaRouter`, with and without the `RouteMatchCache` that `JerboaApp` enables by default, so it shows what a
+cached match saves on the real dispatch path.
+
+Run from the repository root:
+
+    python benchmarks/bench_router.py
+"""
+import random
+import timeit
+import webapp2
+from webapp2_extras.routes import RedirectRoute, PathPrefixRoute
+from jerboa.app import custom_dispatcher, custom_adapter
+from jerboa.routers import JerboaRouter, RadixRouter, RouteMatchCache
+
+__author__ = 'Matt'
+
+RESOURCE_COUNTS = (10, 100, 1000)
+CRUD_METHODS = ('create', 'read', 'update', 'delete')
+REQUEST_COUNT = 1000
+
+
+def dummy_handler(request, response):
+    pass
+
+
+def build_routes(resource_count):
+    routes = [webapp2.Route(template='/', name='default', handler=dummy_handler)]
+    for resource_index in xrange(resource_count):
+        resource = 'resource{}'.format(resource_index)
+        routes.append(PathPrefixRoute('/{}'.format(resource), [
+            RedirectRoute('/{}'.format(method), handler=dummy_handler, name='{}_{}'.format(resource, method),
+                          strict_slash=True)
+            for method in CRUD_METHODS
+        ]))
+    return routes
+
+
+def build_requests(resource_count):
+    randomizer = random.Random(resource_count)
+    return [webapp2.Request.blank('/resource{}/{}'.format(randomizer.randrange(resource_count),
+                                                           randomizer.choice(CRUD_METHODS)))
+            for _ in xrange(REQUEST_COUNT)]
+
+
+def time_router(router, requests):
+    match = router.match
+
+    def run():
+        for request in requests:
+            match(request)
+
+    # Warm up, which also compiles the radix tree
+    run()
+    return min(timeit.repeat(run, number=1, repeat=5)) / len(requests)
+
+
+def build_app(router_class, resource_count, match_cache=None):
+    app = webapp2.WSGIApplication()
+    app.router = router_class(build_routes(resource_count))
+    app.router.set_dispatcher(custom_dispatcher)
+    app.router.set_adapter(custom_adapter)
+    app.router.match_cache = match_cache
+    return app
+
+
+def time_dispatch(app, requests):
+    def run():
+        for request in requests:
+            request.get_response(app)
+
+    run()
+    return min(timeit.repeat(run, number=1, repeat=5)) / len(requests)
+
+
+def main():
+    print('{:>10} {:>16} {:>16} {:>10}'.format('resources', 'webapp2 (us)', 'radix (us)', 'speedup'))
+    for resource_count in RESOURCE_COUNTS:
+        requests = build_requests(resource_count)
+        default_time = time_router(webapp2.Router(build_routes(resource_count)), requests)
+        radix_time = time_router(RadixRouter(build_routes(resource_count)), requests)
+        print('{:>10} {:>16.2f} {:>16.2f} {:>9.1f}x'.format(resource_count, default_time * 1e6, radix_time * 1e6,
+                                                           default_time / radix_time))
+
+    print('')
+    print('{:>10} {:>16} {:>16} {:>10}'.format('resources', 'dispatch (us)', 'cached (us)', 'speedup'))
+    for resource_count in RESOURCE_COUNTS:
+        requests = build_requests(resource_count)
+        dispatch_time = time_dispatch(build_app(JerboaRouter, resource_count), requests)
+        cached_time = time_dispatch(build_app(JerboaRouter, resource_count,
+                                              match_cache=RouteMatchCache(max_size=resource_count * len(CRUD_METHODS))),
+                                    requests)
+        print('{:>10} {:>16.2f} {:>16.2f} {:>9.1f}x'.format(resource_count, dispatch_time * 1e6, cached_time * 1e6,
+                                                           dispatch_time / cached_time))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+"""
+Compares `wtforms.Form.validate` against the cached `jerboa.forms.ValidationPlan` for `UserForm` and a form built from
+`AddressMixin` and `MobilePhoneMixin`, with valid and invalid input.
+
+The forms are created once and validated repeatedly, so only validation is timed. Invalid input mostly times the
+validators themselves (raising and translating the errors), so expect little difference there. Exits with a non zero
+status if the plan is more than `TOLERANCE` slower for any case, so that it can be used as a regression check:
+
+    python benchmarks/bench_validation.py
+"""
+import sys
+import timeit
+import webapp2
+from jerboa.forms import BaseForm, UserForm, AddressMixin, MobilePhoneMixin, BaseModelMixin, SecondaryEmailValidation, \
+    TEST_RECAPTCHA_SITE_KEY, TEST_RECAPTCHA_SITE_SECRET
+import wtforms
+
+__author__ = 'Matt'
+
+VALIDATE_COUNT = 500
+#: Timings on a shared machine are noisy
+TOLERANCE = 0.1
+
+USER_POST = {
+    'uid': u'1',
+    'first_name': u'Matt',
+    'last_name': u'Badger',
+    'username': u'matt',
+    'email_address': u'matt@example.com',
+    'password': u'password',
+    'c_password': u'password',
+    'language_preference': u'en',
+}
+
+ADDRESS_POST = {
+    'uid': u'1',
+    'address_1': u'1 High Street',
+    'city': u'Bedford',
+    'county': u'Bedfordshire',
+    'post_code': u'MK40 1AA',
+    'country': u'GB',
+    'mobile': u'+447700900123',
+    'recovery_email_address': u'matt@example.com',
+}
+
+INVALID_ADDRESS_POST = dict(ADDRESS_POST, county=u'Nowhere', post_code=u'', mobile=u'07700 ???',
+                            recovery_email_address=u'not an email')
+
+
+class AddressForm(BaseForm, AddressMixin, MobilePhoneMixin, BaseModelMixin):
+    class Meta:
+        csrf = False
+
+    recovery_email_address = wtforms.fields.StringField(u'Recovery Email', [SecondaryEmailValidation])
+
+
+class ValidationUserForm(UserForm):
+    # The reCAPTCHA validator calls Google, which is benchmarked separately
+    class Meta:
+        csrf = False
+
+
+def build_request(app, post=None):
+    request = webapp2.Request.blank('/', POST=post)
+    request.app = app
+    request.session = {}
+    app.set_globals(app=app, request=request)
+    return request
+
+
+def time_validate(form, repeat=7):
+    """
+    Returns the best (wtforms, plan) time per call. The two are timed alternately so that they see the same noise.
+    """
+    def run():
+        for _ in xrange(VALIDATE_COUNT):
+            form.validate()
+
+    timings = {False: [], True: []}
+    for _ in xrange(repeat):
+        for use_validation_plan in (False, True):
+            form.use_validation_plan = use_validation_plan
+            timings[use_validation_plan].append(timeit.timeit(run, number=1))
+    return min(timings[False]) / VALIDATE_COUNT, min(timings[True]) / VALIDATE_COUNT
+
+
+def main():
+    app = webapp2.WSGIApplication()
+    form_config = {
+        'recaptcha_site_key': TEST_RECAPTCHA_SITE_KEY,
+        'recaptcha_site_secret': TEST_RECAPTCHA_SITE_SECRET,
+    }
+    benchmarks = [
+        ('UserForm', ValidationUserForm, USER_POST),
+        ('AddressForm', AddressForm, ADDRESS_POST),
+        ('AddressForm!', AddressForm, INVALID_ADDRESS_POST),
+    ]
+
+    regressions = 0
+    print('{:>14} {:>14} {:>10} {:>10}'.format('form', 'wtforms (us)', 'plan (us)', 'speedup'))
+    for name, form_class, post in benchmarks:
+        request = build_request(app, post=post)
+        form = form_class(request=request, **form_config)
+        # Leave out the reCAPTCHA response field
+        form._fields.pop('g-recaptcha-response', None)
+
+        wtforms_time, plan_time = time_validate(form)
+
+        speedup = wtforms_time / plan_time
+        if speedup < 1.0 - TOLERANCE:
+            regressions += 1
+        print('{:>14} {:>14.1f} {:>10.1f} {:>9.1f}x'.format(name, wtforms_time * 1e6, plan_time * 1e6, speedup))
+
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -4,11 +4,19 @@ import logging
 import inspect
 import webapp2
 from webob import exc
-from blinker import signal
+from blinker import signal, ANY
 from datetime import datetime, timedelta
 from urlparse import urlparse
 from google.appengine.api import namespace_manager
 from webapp2_extras.routes import RedirectRoute, PathPrefixRoute, MultiRoute
+from .compression import ResponseCompressor
+from .concurrency import HookThreadPool, send_concurrently
+from .conditional import ConditionalGet
+from .instrumentation import DispatchTimingCollector
+from .output_cache import OutputCache, route_output_cache_config
+from .renderers import DEFAULT_STREAM_BUFFER_SIZE, JSON_CONTENT_TYPE, JsonRenderer
+from .reporting import ErrorReporter
+from .routers import JerboaRouter, RadixRouter, RouteMatchCache, match_request, dispatch_matched_route
 from .forms import PlaceholderForm, BaseSearchForm, DeleteModelForm
 from .utils import decode_unicode_request_params, filter_unwanted_params, set_url_query_parameter
 
@@ -209,6 +217,10 @@ def parse_component_config(resource_config, app_registry, default_login=False, d
                 'prefix_route': True,
                 'content_type': 'text/html',
                 'remove_form_uid': False,
+                'stream_template': False,
+                'stream_buffer_size': DEFAULT_STREAM_BUFFER_SIZE,
+                'output_cache': None,
+                'json_keys': None,
             }
 
             try:
@@ -510,11 +522,30 @@ def default_route_signaler(request, response, **kwargs):
     This is the default handler for each of the created routes. When invoked, it sends out a signal. The relevant
     handler can then pick up the signal at process the request. This avoids the need to couple a handler to a route
     directly.
+    If the app has a `HandlerDispatchTable` (JerboaApp builds one by default) then the receivers are taken straight
+    from it. Otherwise we fall back to looking up the named signal for every request.
+
     :param request:
     :param response:
     :param kwargs:
     :return:
     """
+    try:
+        receivers = request.app.handler_dispatch_table[(request.route.name, request.method)]
+    except (AttributeError, KeyError):
+        receivers = None
+
+    if receivers:
+        for receiver in receivers:
+            # We send request as an arg to avoid having to use a separate 'sender', which would affect the method
+            # signatures
+            receiver(request, response=response)
+        return
+    elif receivers is not None:
+        if logging.getLogger().isEnabledFor(logging.DEBUG):
+            logging.debug(u'No handler registered for `%s_http_%s`', request.route.name, request.method.lower())
+        return
+
     handler_hook_name = u'{}_http_{}'.format(request.route.name, request.method.lower())
     handler_signal = signal(handler_hook_name)
 
@@ -522,7 +553,57 @@ def default_route_signaler(request, response, **kwargs):
         # We send request as an arg to avoid having to use a separate 'sender', which would affect the method signatures
         handler_signal.send(request, response=response)
     else:
-        logging.debug(u'No handler registered for `{}`'.format(handler_hook_name))
+        # Formatted by logging, and only if debug logging is enabled
+        logging.debug(u'No handler registered for `%s`', handler_hook_name)
+
+
+class HandlerDispatchTable(object):
+    """
+    Maps (route name, HTTP method) to the receivers connected to the matching `[route]_http_[method]` signal e.g.
+    `StandardFormHandler.callback_handler` for ('user_create', 'POST'). This saves `default_route_signaler` from
+    building the signal name and searching the blinker registry on every request.
+
+    Each watched signal notifies the table when a receiver connects or disconnects so that the entry can be rebuilt.
+    Note that the table holds strong references to the receivers; disconnect them explicitly if you need to remove
+    a handler.
+
+    Routes that are not in the table (e.g. added after the table was built) are still dispatched by the signal lookup.
+    """
+    def __init__(self, methods=None):
+        self.methods = methods or webapp2.WSGIApplication.allowed_methods
+        self._signals = {}
+        self._keys = {}
+        self._table = {}
+
+    def __getitem__(self, key):
+        return self._table[key]
+
+    def __contains__(self, key):
+        return key in self._table
+
+    def __len__(self):
+        return len(self._table)
+
+    def build(self, route_names):
+        for route_name in route_names:
+            for method in self.methods:
+                key = (route_name, method)
+                if key in self._signals:
+                    continue
+
+                handler_signal = signal(u'{}_http_{}'.format(route_name, method.lower()))
+                self._signals[key] = handler_signal
+                self._keys[handler_signal] = key
+                handler_signal.receiver_connected.connect(self._receivers_changed, sender=handler_signal)
+                handler_signal.receiver_disconnected.connect(self._receivers_changed, sender=handler_signal)
+                self._refresh(key)
+
+    def _refresh(self, key):
+        # Replace the entry in one go so that concurrent requests only ever see a complete tuple of receivers
+        self._table[key] = tuple(self._signals[key].receivers_for(ANY))
+
+    def _receivers_changed(self, handler_signal, **kwargs):
+        self._refresh(self._keys[handler_signal])
 
 
 def add_routes(app_instance, route_list):
@@ -569,8 +650,20 @@ APP_EXCEPTION_HOOK = signal('app_exception_hook')
 UNHANDLED_EXCEPTION_HOOK = signal('unhandled_exception_hook')
 
 
+# Used when the router does not have an error reporter of its own
+DEFAULT_ERROR_REPORTER = ErrorReporter()
+
+
+def _report_exception(message, exception, request, router=None, always_sample=False):
+    error_reporter = getattr(router, 'error_reporter', None) or DEFAULT_ERROR_REPORTER
+    # Server errors are always sampled, and are never dropped by the rate limit
+    error_reporter.report(message, exception=exception, request=request, always_sample=always_sample,
+                          always_report=always_sample)
+
+
 def _handle_exception(exception, request, response, router=None):
-    logging.exception('Non specific exception encountered.')
+    _report_exception('Non specific exception encountered.', exception=exception, request=request, router=router,
+                      always_sample=True)
 
     if bool(UNHANDLED_EXCEPTION_HOOK.receivers):
         UNHANDLED_EXCEPTION_HOOK.send(router or 'custom_dispatcher', exception=exception, request=request, response=response)
@@ -579,7 +672,9 @@ def _handle_exception(exception, request, response, router=None):
 
 
 def _handle_app_exception(exception, request, response, router=None):
-    logging.exception('Encountered application error.')
+    # Server errors always include a traceback; HTTP errors (e.g. method not allowed) are caused by the client
+    _report_exception('Encountered application error.', exception=exception, request=request, router=router,
+                      always_sample=not isinstance(exception, exc.HTTPException))
 
     if bool(APP_EXCEPTION_HOOK.receivers):
         APP_EXCEPTION_HOOK.send(router or 'custom_dispatcher', exception=exception, request=request, response=response)
@@ -588,7 +683,7 @@ def _handle_app_exception(exception, request, response, router=None):
 
 
 def _handle_client_exception(exception, request, response, router=None):
-    logging.exception('Encountered client error.')
+    _report_exception('Encountered client error.', exception=exception, request=request, router=router)
 
     if bool(CLIENT_EXCEPTION_HOOK.receivers):
         CLIENT_EXCEPTION_HOOK.send(router or 'custom_dispatcher', exception=exception, request=request, response=response)
@@ -610,7 +705,8 @@ def _handle_logged_in_user_exception(exception, request, response, router=None):
     :param router:
     :return:
     """
-    logging.exception('Encountered logged in user error; they don\'t need to be here')
+    _report_exception('Encountered logged in user error; they don\'t need to be here', exception=exception,
+                      request=request, router=router)
 
     if bool(LOGGED_IN_USER_EXCEPTION_HOOK.receivers):
         LOGGED_IN_USER_EXCEPTION_HOOK.send(router or 'custom_dispatcher', exception=exception, request=request, response=response)
@@ -620,7 +716,7 @@ def _handle_logged_in_user_exception(exception, request, response, router=None):
 
 
 def _handle_invalid_user_exception(exception, request, response, router=None):
-    logging.exception('Encountered invalid user.')
+    _report_exception('Encountered invalid user.', exception=exception, request=request, router=router)
 
     if bool(INVALID_USER_EXCEPTION_HOOK.receivers):
         INVALID_USER_EXCEPTION_HOOK.send(router or 'custom_dispatcher', exception=exception, request=request, response=response)
@@ -629,7 +725,7 @@ def _handle_invalid_user_exception(exception, request, response, router=None):
 
 
 def _handle_unauthorized_user_exception(exception, request, response, router=None):
-    logging.exception('Encountered unauthorized user.')
+    _report_exception('Encountered unauthorized user.', exception=exception, request=request, router=router)
 
     if bool(UNAUTHORIZED_USER_EXCEPTION_HOOK.receivers):
         UNAUTHORIZED_USER_EXCEPTION_HOOK.send(router or 'custom_dispatcher', exception=exception, request=request, response=response)
@@ -676,11 +772,79 @@ def custom_adapter(router, handler):
         return adapter(handler)
 
 
+class DispatcherPipeline(object):
+    """
+    The hooks that the custom dispatcher should send for a router. Only hooks that have receivers for the router (or
+    for any sender) are included, so an app only pays for the hooks it actually uses. The pipeline is recompiled
+    whenever a receiver connects to, or disconnects from, one of the dispatcher hooks.
+
+    If no router is given then every hook is included and nothing is recompiled. This is what the dispatcher uses
+    when the router does not have a pipeline of its own.
+    """
+    PRE_DISPATCH_HOOKS = (CUSTOM_DISPATCHER_PRE_HOOK, CUSTOM_DISPATCHER_PRE_PROCESS_RESPONSE_HOOK)
+    POST_DISPATCH_HOOKS = (CUSTOM_DISPATCHER_POST_HOOK, CUSTOM_DISPATCHER_POST_PROCESS_RESPONSE_HOOK)
+    HOOKS = (CUSTOM_DISPATCHER_REQUEST_INIT_HOOK, CUSTOM_DISPATCHER_RESPONSE_INIT_HOOK) + PRE_DISPATCH_HOOKS + \
+        POST_DISPATCH_HOOKS
+
+    def __init__(self, router=None):
+        self.router = router
+        self.request_init = CUSTOM_DISPATCHER_REQUEST_INIT_HOOK
+        self.response_init = CUSTOM_DISPATCHER_RESPONSE_INIT_HOOK
+        self.pre_dispatch = self.PRE_DISPATCH_HOOKS
+        self.post_dispatch = self.POST_DISPATCH_HOOKS
+
+        if router is not None:
+            for hook in self.HOOKS:
+                hook.receiver_connected.connect(self._hooks_changed, sender=hook)
+                hook.receiver_disconnected.connect(self._hooks_changed, sender=hook)
+            self.compile()
+
+    def compile(self):
+        # `has_receivers_for` is only an optimistic check, so we look for an actual receiver
+        live_hooks = set(hook for hook in self.HOOKS if any(True for _ in hook.receivers_for(self.router)))
+
+        self.request_init, self.response_init = [hook if hook in live_hooks else None for hook in
+                                                 (CUSTOM_DISPATCHER_REQUEST_INIT_HOOK,
+                                                  CUSTOM_DISPATCHER_RESPONSE_INIT_HOOK)]
+        self.pre_dispatch = tuple(hook for hook in self.PRE_DISPATCH_HOOKS if hook in live_hooks)
+        self.post_dispatch = tuple(hook for hook in self.POST_DISPATCH_HOOKS if hook in live_hooks)
+
+    def _hooks_changed(self, hook, **kwargs):
+        self.compile()
+
+    @property
+    def stages(self):
+        return [hook.name for hook in (self.request_init, self.response_init) + self.pre_dispatch + self.post_dispatch
+                if hook is not None]
+
+
+DEFAULT_DISPATCHER_PIPELINE = DispatcherPipeline()
+
+
 def custom_dispatcher(router, request, response):
+    dispatch_timing = getattr(router, 'dispatch_timing', None)
+    if dispatch_timing is None:
+        return _dispatch_request(router=router, request=request, response=response)
+
+    timer = dispatch_timing.start()
     try:
-        rv = router.match(request)
+        return _dispatch_request(router=router, request=request, response=response, timer=timer)
+    finally:
+        dispatch_timing.finish(timer=timer, request=request, response=response)
+
+
+def _send_dispatcher_hook(hook, router, timer=None, **kwargs):
+    if timer is None:
+        hook.send(router, **kwargs)
+    else:
+        timer.send(hook, router, **kwargs)
+
+
+def _dispatch_request(router, request, response, timer=None):
+    try:
+        rv = match_request(router, request)
     except exc.HTTPMethodNotAllowed, e:
-        logging.exception('HTTP method not allowed for route')
+        # Reported by the app exception handler
         return _handle_app_exception(exception=e, request=request, response=response, router=router)
 
     if rv is None:
@@ -692,25 +856,91 @@ def custom_dispatcher(router, request, response):
     # values without having to check it they can or not.
     response.raw = ScratchSpace()
 
+    if timer is not None:
+        timer.mark('route_match')
+
+    pipeline = getattr(router, 'dispatcher_pipeline', None) or DEFAULT_DISPATCHER_PIPELINE
+
+    namespace_resolver = getattr(router, 'namespace_resolver', None)
+    if namespace_resolver is None:
+        active_namespace_manager = namespace_manager
+    else:
+        request.namespace = namespace_resolver.resolve(request)
+        active_namespace_manager = namespace_resolver.namespace_manager
+
     # Use this hook to set a custom namespace; set request.namespace
-    CUSTOM_DISPATCHER_REQUEST_INIT_HOOK.send(router, request=request)
-    CUSTOM_DISPATCHER_RESPONSE_INIT_HOOK.send(router, response=response)
+    if pipeline.request_init is not None:
+        _send_dispatcher_hook(pipeline.request_init, router, timer, request=request)
+    if pipeline.response_init is not None:
+        _send_dispatcher_hook(pipeline.response_init, router, timer, response=response)
 
-    current_namespace = namespace_manager.get_namespace()
+    current_namespace = active_namespace_manager.get_namespace()
     try:
         target_namespace = request.namespace
     except AttributeError:
         target_namespace = 'default'
 
     try:
-        if target_namespace != 'default':
-            namespace_manager.set_namespace(target_namespace)
-
+        # Setting the namespace validates it every time, so skip it if we are already in the right one
+        if target_namespace != 'default' and target_namespace != current_namespace:
+            active_namespace_manager.set_namespace(target_namespace)
+
+        if timer is not None:
+            timer.mark('namespace')
+
+        output_cache = getattr(router, 'output_cache', None)
+        output_cache_key = None
+        output_cache_config = None
+        conditional_get = getattr(router, 'conditional_get', None)
+        if conditional_get is not None and not conditional_get.applies(request):
+            conditional_get = None
+        version_etag = None
+        compression = getattr(router, 'compression', None)
         try:
-            CUSTOM_DISPATCHER_PRE_HOOK.send(router, request=request, response=response)
-            CUSTOM_DISPATCHER_PRE_PROCESS_RESPONSE_HOOK.send(router, request=request, response=response)
-
-            router.default_dispatcher(request, response)
+            hook_pool = getattr(router, 'hook_pool', None)
+            for hook in pipeline.pre_dispatch:
+                if hook_pool is None:
+                    _send_dispatcher_hook(hook, router, timer, request=request, response=response)
+                else:
+                    send_concurrently(hook, router, hook_pool, timer=timer, namespace_manager=active_namespace_manager,
+                                      request=request, response=response)
+
+            # Checked after the pre dispatch hooks so that any request checks (e.g. authentication) still apply
+            if conditional_get is not None:
+                version_etag = conditional_get.version_etag(request)
+                if conditional_get.is_not_modified(request, version_etag):
+                    conditional_get.write_not_modified(response, version_etag, early=True)
+                    if timer is not None:
+                        timer.mark('conditional_get')
+                    return response
+
+            if output_cache is not None and request.method == 'GET':
+                output_cache_config = route_output_cache_config(request)
+                if output_cache_config is not None:
+                    # None if the page can't be cached for this request e.g. an unknown user on a per user route
+                    output_cache_key = output_cache.cache_key(request, output_cache_config)
+                if output_cache_key is not None:
+                    cached_entry = output_cache.get(output_cache_key, output_cache_config)
+                    if cached_entry is not None:
+                        output_cache.write_response(cached_entry, response)
+                        etag = None
+                        if conditional_get is not None:
+                            etag = conditional_get.set_etag(request, response, etag=version_etag)
+                        if compression is not None:
+                            compression.compress_response(request, response, output_cache=output_cache,
+                                                          cache_key=output_cache_key, cache_entry=cached_entry,
+                                                          cache_config=output_cache_config)
+                        if conditional_get is not None and etag is not None:
+                            # Compression changes strong tags
+                            etag = response.headers['ETag']
+                            if conditional_get.is_not_modified(request, etag):
+                                conditional_get.write_not_modified(response, etag)
+                        if timer is not None:
+                            timer.mark('output_cache')
+                        return response
+
+            # Not `router.default_dispatcher`, which would match the request again
+            dispatch_matched_route(router, request, response)
         except ApplicationError, e:
             _handle_app_exception(exception=e, request=request, response=response, router=router)
         except UserLoggedInException, e:
@@ -724,12 +954,37 @@ def custom_dispatcher(router, request, response):
         except BaseAppException, e:
             _handle_exception(exception=e, request=request, response=response, router=router)
         else:
+            if timer is not None:
+                timer.mark('handler_dispatch')
+
             # We don't want to trigger this hook unless the request was successful.
-            CUSTOM_DISPATCHER_POST_HOOK.send(router, request=request, response=response)
-            CUSTOM_DISPATCHER_POST_PROCESS_RESPONSE_HOOK.send(router, request=request, response=response)
+            for hook in pipeline.post_dispatch:
+                _send_dispatcher_hook(hook, router, timer, request=request, response=response)
+
+            etag = None
+            if conditional_get is not None:
+                # Set before the page is cached, so that cached hits have the same tag
+                etag = conditional_get.set_etag(request, response, etag=version_etag)
+
+            cached_entry = None
+            if output_cache_key is not None and output_cache.cacheable(request, response):
+                cached_entry = output_cache.set(output_cache_key, output_cache_config, response)
+
+            if compression is not None:
+                compression.compress_response(request, response, output_cache=output_cache, cache_key=output_cache_key,
+                                              cache_entry=cached_entry, cache_config=output_cache_config)
+                if etag is not None:
+                    # Compression changes strong tags
+                    etag = response.headers['ETag']
+
+            if conditional_get is not None and conditional_get.is_not_modified(request, etag):
+                conditional_get.write_not_modified(response, etag)
+                if timer is not None:
+                    timer.mark('conditional_get')
 
     finally:
-        namespace_manager.set_namespace(current_namespace)
+        if active_namespace_manager.get_namespace() != current_namespace:
+            active_namespace_manager.set_namespace(current_namespace)
 
     return response
 
@@ -741,27 +996,116 @@ to invoke a renderer during the post processing stage of a request.
 """
 
 
+DEFAULT_JSON_RENDERER = JsonRenderer()
+
+
 def default_post_request_hook(sender, request, response):
-    if request.method == 'GET' and response.status_int == 200:
-        AppRegistry.renderers['default'].render(template_name=request.route.method_config['page_template'], response=response)
+    if response.status_int != 200:
+        return
+
+    method_config = getattr(request.route, 'method_config', None)
+    if method_config is None:
+        # Not a jerboa generated route e.g. the warmup route
+        return
+
+    if (method_config.get('content_type') or '').split(';', 1)[0].strip() == JSON_CONTENT_TYPE:
+        # No template lookup for API routes; they can also return JSON from a POST
+        AppRegistry.renderers.get('json', DEFAULT_JSON_RENDERER).render(response=response,
+                                                                         keys=method_config.get('json_keys'))
+    elif request.method == 'GET':
+        if method_config.get('stream_template'):
+            buffer_size = method_config.get('stream_buffer_size', DEFAULT_STREAM_BUFFER_SIZE)
+            # The stream is rendered after the dispatcher has restored the namespace, and has to set it again
+            active_namespace_manager = getattr(getattr(sender, 'namespace_resolver', None), 'namespace_manager', None)
+            AppRegistry.renderers['default'].render(template_name=method_config['page_template'], response=response,
+                                                    stream=True, buffer_size=buffer_size,
+                                                    namespace_manager=active_namespace_manager)
+        else:
+            AppRegistry.renderers['default'].render(template_name=method_config['page_template'], response=response)
+
+
+"""
+App Engine sends a warmup request (`/_ah/warmup`) to new instances before they receive traffic, when `inbound_services:
+- warmup` is set in app.yaml. With `preload_templates='warmup'`, the page templates are loaded during that request
+rather than during the first user request.
+"""
+
+
+def warmup_route(request, response):
+    report = request.app.preload_templates()
+    response.content_type = 'text/plain'
+    if report is None:
+        response.write(u'No renderer to preload')
+        return
+    if not report.ok:
+        response.set_status(500)
+    response.write(u'Preloaded {} template(s) with {} error(s)'.format(len(report.load_times), len(report.errors)))
 
 
 class JerboaApp(webapp2.WSGIApplication):
+    router_class = JerboaRouter
+
     # TODO: must set request.namespace in pre_request_dispatch
-    def __init__(self, resource_config, renderer_config=None, default_login=True, add_default_route=True, debug=None, webapp2_config=None):
+    def __init__(self, resource_config, renderer_config=None, default_login=True, add_default_route=True, debug=None,
+                 webapp2_config=None, radix_router=False, match_cache_size=1000, dispatch_timing=False,
+                 namespace_resolver=None, concurrent_pre_hooks=False, error_reporter=None, output_cache=False,
+                 preload_templates=False, conditional_get=False, compression=False):
         if debug is None:
             try:
                 debug = os.environ['SERVER_SOFTWARE'].startswith('Dev')
             except KeyError:
                 debug = True
 
+        if radix_router:
+            # Must be set before webapp2 creates the router
+            self.router_class = RadixRouter
+
         super(JerboaApp, self).__init__(debug=debug, config=webapp2_config)
 
+        self.router.dispatcher_pipeline = DispatcherPipeline(router=self.router)
+
+        if match_cache_size:
+            self.router.match_cache = RouteMatchCache(max_size=match_cache_size)
+
+        if dispatch_timing is True:
+            dispatch_timing = DispatchTimingCollector()
+        if dispatch_timing:
+            self.router.dispatch_timing = dispatch_timing
+
+        if namespace_resolver is not None:
+            self.router.namespace_resolver = namespace_resolver
+
+        if concurrent_pre_hooks is True:
+            concurrent_pre_hooks = HookThreadPool()
+        if concurrent_pre_hooks:
+            self.router.hook_pool = concurrent_pre_hooks
+
+        if error_reporter is not None:
+            self.router.error_reporter = error_reporter
+
+        if output_cache is True:
+            output_cache = OutputCache()
+        if output_cache:
+            self.router.output_cache = output_cache
+
+        if conditional_get is True:
+            conditional_get = ConditionalGet()
+        if conditional_get:
+            self.router.conditional_get = conditional_get
+
+        if compression is True:
+            compression = ResponseCompressor()
+        if compression:
+            self.router.compression = compression
+
         self.app_registry = AppRegistry()
 
         if add_default_route:
             self.router.add(webapp2.Route(template='/', name='default', handler=default_route))
 
+        if preload_templates == 'warmup':
+            self.router.add(webapp2.Route(template='/_ah/warmup', name='warmup', handler=warmup_route))
+
         self.router.set_dispatcher(custom_dispatcher)
         self.router.set_adapter(custom_adapter)
         CUSTOM_DISPATCHER_PRE_PROCESS_RESPONSE_HOOK.connect(set_content_type, sender=self.router)
@@ -781,6 +1125,41 @@ class JerboaApp(webapp2.WSGIApplication):
             for route in AppRegistry.routes:
                 self.router.add(route)
 
+        self.handler_dispatch_table = HandlerDispatchTable(methods=self.allowed_methods)
+        self.build_handler_dispatch_table()
+
+        self.template_preload_report = None
+        if preload_templates is True:
+            self.preload_templates()
+
+    def page_templates(self):
+        return set(route.method_config['page_template'] for route in self.router.build_routes.itervalues()
+                   if getattr(route, 'method_config', None) and route.method_config.get('page_template'))
+
+    def preload_templates(self):
+        """
+        Loads the page template of every route (and the templates that they extend or include) into the default
+        renderer, so that the first request to each page doesn't have to. Errors such as a missing template are logged
+        rather than raised. The report is also stored on `template_preload_report`.
+        """
+        try:
+            renderer = self.app_registry.renderers['default']
+        except KeyError:
+            return None
+
+        report = renderer.preload_templates(self.page_templates())
+        report.log()
+        self.template_preload_report = report
+        return report
+
+    def build_handler_dispatch_table(self):
+        """
+        Adds any routes that use `default_route_signaler` to the dispatch table. Call this again if you add routes to
+        the router after the app has been created.
+        """
+        self.handler_dispatch_table.build(route_names=[name for name, route in self.router.build_routes.iteritems()
+                                                       if getattr(route, 'handler', None) is default_route_signaler])
+
     parse_component_config = staticmethod(parse_component_config)
 
     add_routes = add_routes
@@ -1494,8 +1873,26 @@ class ScratchSpace(object):
             response.raw.dict = dict(a="abc", b="bcd")
 
         Can be accessed in the template by just using the variables like {{var1}} or {{dict.b}}
+
+        The scratch space is also a read only mapping of its attributes, so the renderer can use it as the template
+        context without copying it. Only special methods are used for this, so any attribute name is still available
+        to handlers.
     """
-    pass
+    def __getitem__(self, key):
+        return self.__dict__[key]
+
+    def __contains__(self, key):
+        return key in self.__dict__
+
+    def __iter__(self):
+        return iter(self.__dict__)
+
+    def __len__(self):
+        return len(self.__dict__)
+
+    def __nonzero__(self):
+        # An empty scratch space is still a valid response.raw
+        return True
 
 
 def set_content_type(sender, request, response):
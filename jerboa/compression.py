@@ -0,0 +1,161 @@
+# coding=utf-8
+import zlib
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+__author__ = 'Matt'
+
+
+"""
+Response compression.
+
+When the app is created with `compression=True`, the dispatcher compresses successful responses once the post process
+response hooks (i.e. the renderer) have run. The encoding is negotiated from the request `Accept-Encoding` header:
+brotli if the `brotli` package is installed and the client accepts it, otherwise gzip. Responses are only compressed if
+their content type is in `content_types` and the body is at least `min_size` bytes; small bodies can grow when
+compressed. Streamed responses are never compressed.
+
+If the route also uses the output cache, the compressed variants are cached alongside the page, so each page is only
+compressed once per encoding rather than once per request.
+
+Strong ETags get the encoding appended (e.g. `"abc-gzip"`), as the compressed body is a different representation.
+"""
+
+
+COMPRESSIBLE_CONTENT_TYPES = frozenset([
+    'text/html',
+    'text/plain',
+    'text/css',
+    'text/csv',
+    'text/xml',
+    'text/javascript',
+    'application/javascript',
+    'application/json',
+    'application/xml',
+    'image/svg+xml',
+])
+
+
+def parse_accept_encoding(header):
+    """
+    Returns a dict of content coding -> quality value. Codings with a quality of 0 are included, as they are refused.
+    """
+    codings = {}
+    for item in header.split(','):
+        parts = item.strip().split(';')
+        coding = parts[0].strip().lower()
+        if not coding:
+            continue
+        quality = 1.0
+        for param in parts[1:]:
+            name, _, value = param.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        codings[coding] = quality
+    return codings
+
+
+class ResponseCompressor(object):
+    DEFAULT_MIN_SIZE = 1024
+
+    def __init__(self, min_size=DEFAULT_MIN_SIZE, content_types=COMPRESSIBLE_CONTENT_TYPES, gzip_level=6,
+                 brotli_quality=5, use_brotli=True):
+        """
+        :param min_size: Bodies smaller than this (in bytes) are sent uncompressed.
+        :param content_types: The content types that are compressed.
+        :param gzip_level: zlib compression level, from 1 (fastest) to 9 (smallest).
+        :param brotli_quality: brotli quality, from 0 (fastest) to 11 (smallest).
+        :param use_brotli: Set to False to only use gzip, even if brotli is installed.
+        """
+        self.min_size = min_size
+        self.content_types = frozenset(content_types)
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+        # Most preferred first
+        self.encodings = ('br', 'gzip') if use_brotli and brotli is not None else ('gzip',)
+        self.compressed = 0
+        self.variant_hits = 0
+
+    def negotiate(self, request):
+        header = request.headers.get('Accept-Encoding')
+        if not header:
+            return None
+
+        codings = parse_accept_encoding(header)
+        any_quality = codings.get('*')
+        best, best_quality = None, 0.0
+        for encoding in self.encodings:
+            quality = codings.get(encoding, any_quality)
+            if quality is not None and quality > best_quality:
+                best, best_quality = encoding, quality
+        return best
+
+    def compressible(self, response):
+        if response.status_int != 200 or 'Content-Encoding' in response.headers:
+            return False
+        if response.content_type not in self.content_types:
+            return False
+        # Streamed responses don't have a list of chunks
+        return isinstance(response.app_iter, list) and response.content_length >= self.min_size
+
+    def compress(self, body, encoding):
+        if encoding == 'br':
+            return brotli.compress(body, quality=self.brotli_quality)
+
+        # wbits of 16 + MAX_WBITS writes a gzip header and trailer
+        compressor = zlib.compressobj(self.gzip_level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        return compressor.compress(body) + compressor.flush()
+
+    def compress_response(self, request, response, output_cache=None, cache_key=None, cache_entry=None,
+                          cache_config=None):
+        """
+        Compresses the response body in place, if it is compressible and the client accepts a supported encoding.
+        Pass the output cache details to reuse (or store) the compressed variant of a cached page; they are ignored if
+        there is no cache entry.
+        """
+        if not self.compressible(response):
+            return None
+
+        if cache_entry is None:
+            output_cache = None
+
+        # Shared caches must keep a copy per encoding, even if this response is not compressed
+        if 'accept-encoding' not in [value.lower() for value in response.vary or ()]:
+            response.vary = tuple(response.vary or ()) + ('Accept-Encoding',)
+
+        encoding = self.negotiate(request)
+        if encoding is None:
+            return None
+
+        body = None
+        if output_cache is not None:
+            body = output_cache.get_variant(cache_key, cache_entry, encoding)
+            if body is not None:
+                self.variant_hits += 1
+
+        if body is None:
+            body = self.compress(response.body, encoding)
+            self.compressed += 1
+            if output_cache is not None:
+                output_cache.set_variant(cache_key, cache_entry, encoding, body, cache_config)
+
+        response.body = body
+        response.headers['Content-Encoding'] = encoding
+
+        etag = response.headers.get('ETag')
+        if etag is not None and not etag.startswith('W/'):
+            response.headers['ETag'] = '{}-{}"'.format(etag[:-1], encoding)
+
+        return encoding
+
+    def stats(self):
+        return {
+            'compressed': self.compressed,
+            'variant_hits': self.variant_hits,
+        }
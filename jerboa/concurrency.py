@@ -0,0 +1,187 @@
+# coding=utf-8
+import sys
+import threading
+from .instrumentation import monotonic_clock, elapsed
+from .utils import RequestContext
+
+__author__ = 'Matt'
+
+
+"""
+Concurrent dispatcher hooks.
+
+Pre dispatch receivers often make an independent backend call each (load the user, load the tenant settings, check
+feature flags). Blinker runs them one after the other, so the hook takes the sum of their latencies. Mark a receiver as
+independent and I/O bound with the `concurrent_receiver` decorator:
+
+    @concurrent_receiver
+    def load_feature_flags(sender, request, response):
+        request.feature_flags = ...
+
+    CUSTOM_DISPATCHER_PRE_HOOK.connect(load_feature_flags, sender=app.router)
+
+When the app is created with `concurrent_pre_hooks=True` (or a `HookThreadPool`), the dispatcher runs the marked
+receivers for each pre dispatch hook on worker threads. Unmarked receivers still run in the request thread, in order.
+The hook only completes once every receiver has finished, so it takes roughly as long as the slowest receiver.
+
+The worker threads only live for one hook: they are started when it is sent and joined before it returns. App Engine's
+Python 2.7 runtime doesn't allow threads to outlive the request that started them, so nothing is kept between requests.
+Each worker runs with the webapp2 app and request globals of the request (so `webapp2.get_request()` and i18n work) and
+in the request namespace.
+
+If a receiver raises an exception, it is re-raised in the request thread with its original traceback (if several
+fail, only the first is raised). It is then handled by the normal dispatcher exception routing e.g.
+`UnauthorizedUserException` still results in a 403.
+
+Marked receivers must not depend on each other, or on the order that they run in.
+"""
+
+
+def concurrent_receiver(receiver):
+    """
+    Marks a dispatcher hook receiver as independent and I/O bound, so that it can run on the hook thread pool.
+    """
+    receiver.concurrent_receiver = True
+    return receiver
+
+
+def is_concurrent_receiver(receiver):
+    return getattr(receiver, 'concurrent_receiver', False)
+
+
+class HookTask(object):
+    def __init__(self, fn, args, kwargs):
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.duration = None
+        self._exc_info = None
+        self._done = threading.Event()
+
+    def run(self):
+        started = monotonic_clock()
+        try:
+            self.fn(*self.args, **self.kwargs)
+        except Exception:
+            self._exc_info = sys.exc_info()
+        finally:
+            self.duration = elapsed(started)
+            self._done.set()
+
+    def wait(self):
+        self._done.wait()
+
+    def reraise(self):
+        if self._exc_info is not None:
+            exc_type, exc_value, exc_traceback = self._exc_info
+            raise exc_type, exc_value, exc_traceback
+
+
+class HookThreadPool(object):
+    """
+    Runs hook tasks on up to `max_workers` threads. The threads are started for each batch of tasks and have all finished
+    by the time `join` returns, so none of them outlive the request.
+    """
+    def __init__(self, max_workers=8, thread_factory=threading.Thread):
+        """
+        :param max_workers: The maximum number of threads to use for one hook.
+        :param thread_factory: Creates the threads e.g. `google.appengine.api.background_thread.BackgroundThread`.
+            Called with the same arguments as `threading.Thread`.
+        """
+        if max_workers < 1:
+            raise ValueError(u'The hook thread pool needs at least one worker')
+
+        self.max_workers = max_workers
+        self.thread_factory = thread_factory
+
+    def start(self, tasks):
+        """
+        Starts running the tasks and returns the worker threads; pass them to `join`.
+        """
+        pending = list(tasks)
+        pending.reverse()
+        lock = threading.Lock()
+
+        def work():
+            while True:
+                with lock:
+                    if not pending:
+                        return
+                    task = pending.pop()
+                task.run()
+
+        workers = []
+        for index in xrange(min(self.max_workers, len(pending))):
+            worker = self.thread_factory(target=work, name=u'jerboa-hook-{}'.format(index))
+            worker.daemon = True
+            worker.start()
+            workers.append(worker)
+        return workers
+
+    @staticmethod
+    def join(workers):
+        for worker in workers:
+            worker.join()
+
+
+def _run_in_request_context(context, receiver, sender, kwargs):
+    # webapp2 globals and the namespace are both per thread, so the worker must take on those of the request
+    with context:
+        receiver(sender, **kwargs)
+
+
+def send_concurrently(hook, sender, pool, timer=None, namespace_manager=None, **kwargs):
+    """
+    Equivalent to `hook.send(sender, **kwargs)`, except that receivers marked with `concurrent_receiver` run on the pool.
+    Waits for every receiver to finish before re-raising the first exception.
+
+    The concurrent receivers run with the webapp2 globals of the calling thread, and in its current namespace if a
+    namespace manager is given.
+    """
+    receivers = list(hook.receivers_for(sender))
+    if sum(1 for receiver in receivers if is_concurrent_receiver(receiver)) < 2:
+        # Nothing would run in parallel, so avoid the overhead of the pool
+        if timer is None:
+            for receiver in receivers:
+                receiver(sender, **kwargs)
+        else:
+            timer.send(hook, sender, **kwargs)
+        return
+
+    context = RequestContext.capture(namespace_manager=namespace_manager)
+
+    tasks = []
+    for receiver in receivers:
+        if not is_concurrent_receiver(receiver):
+            continue
+        tasks.append((receiver, HookTask(fn=_run_in_request_context, args=(context, receiver, sender, kwargs),
+                                         kwargs={})))
+    workers = pool.start(task for _, task in tasks)
+
+    serial_error = None
+    try:
+        for receiver in receivers:
+            if is_concurrent_receiver(receiver):
+                continue
+            started = monotonic_clock()
+            receiver(sender, **kwargs)
+            if timer is not None:
+                timer.record_receiver(hook, receiver, elapsed(started))
+    except Exception:
+        serial_error = sys.exc_info()
+
+    # Always wait for the concurrent receivers; they may still be modifying the request
+    pool.join(workers)
+    for receiver, task in tasks:
+        if timer is not None:
+            timer.record_receiver(hook, receiver, task.duration)
+
+    if serial_error is not None:
+        exc_type, exc_value, exc_traceback = serial_error
+        raise exc_type, exc_value, exc_traceback
+
+    for receiver, task in tasks:
+        task.reraise()
+
+    if timer is not None:
+        timer.mark(hook.name)
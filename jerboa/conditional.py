@@ -0,0 +1,131 @@
+# coding=utf-8
+import hashlib
+from blinker import signal
+from .utils import request_locale
+
+__author__ = 'Matt'
+
+
+"""
+Conditional GET support for rendered pages.
+
+When the app is created with `conditional_get=True`, the dispatcher adds an `ETag` header to successful GET responses
+once the post process response hooks (i.e. the renderer) have run. If the request `If-None-Match` header has the same
+tag then the response is replaced with an empty `304 Not Modified`, so the client (or CDN) reuses its copy.
+
+By default the tag is a hash of the rendered body, which saves bandwidth but not the render. A route that knows the
+version of its data up front can connect to `ETAG_VERSION_HOOK`, with the route name as the sender:
+
+    def company_overview_version(sender, request):
+        return company_last_modified(request.route_kwargs['company_uid'])
+
+    ETAG_VERSION_HOOK.connect(company_overview_version, sender='company_overview')
+
+The receiver runs after the pre dispatch hooks (so authentication still applies). Its return value is used for a weak
+tag that also varies on the path, query string, namespace and locale. If it matches, the dispatcher returns the 304
+without calling the handler or rendering the page. Return `None` to fall back to hashing the body.
+
+Streamed responses only get a tag from a version, as the body is not available when the tag is set.
+"""
+
+
+ETAG_VERSION_HOOK = signal('etag_version_hook')
+
+
+def parse_if_none_match(header):
+    """
+    Returns the opaque tags in an `If-None-Match` header, without the weak prefix, or `['*']`.
+    """
+    tags = []
+    for tag in header.split(','):
+        tag = tag.strip()
+        if tag.startswith('W/'):
+            tag = tag[2:]
+        if tag:
+            tags.append(tag)
+    return tags
+
+
+def etag_matches(if_none_match, etag):
+    """
+    `If-None-Match` uses the weak comparison, so `W/"abc"` matches `"abc"`.
+    """
+    if not if_none_match:
+        return False
+    tags = parse_if_none_match(if_none_match)
+    if etag.startswith('W/'):
+        etag = etag[2:]
+    return '*' in tags or etag in tags
+
+
+class ConditionalGet(object):
+    def __init__(self, version_hook=ETAG_VERSION_HOOK):
+        self.version_hook = version_hook
+        self.not_modified = 0
+        self.early_not_modified = 0
+
+    @staticmethod
+    def applies(request):
+        return request.method == 'GET'
+
+    def version_etag(self, request):
+        """
+        Returns a weak tag built from the versions supplied by the `ETAG_VERSION_HOOK` receivers for the route, or
+        None if there aren't any.
+        """
+        if not self.version_hook.receivers:
+            return None
+
+        route_name = request.route.name
+        if route_name is None:
+            return None
+
+        versions = [version for _, version in self.version_hook.send(route_name, request=request)
+                    if version is not None]
+        if not versions:
+            return None
+
+        parts = (route_name, versions, request.path_qs, getattr(request, 'namespace', None), request_locale(request))
+        return 'W/"{}"'.format(hashlib.sha1(repr(parts)).hexdigest())
+
+    @staticmethod
+    def body_etag(response):
+        if not isinstance(response.app_iter, list):
+            # Streamed; hashing the body would mean holding all of it in memory
+            return None
+        return '"{}"'.format(hashlib.sha1(response.body).hexdigest())
+
+    def set_etag(self, request, response, etag=None):
+        """
+        Adds the tag to a successful response, unless the handler has set one already. Returns the tag.
+        """
+        if response.status_int != 200:
+            return None
+
+        if 'ETag' in response.headers:
+            return response.headers['ETag']
+
+        if etag is None:
+            etag = self.body_etag(response)
+        if etag is not None:
+            response.headers['ETag'] = etag
+        return etag
+
+    def is_not_modified(self, request, etag):
+        return etag is not None and etag_matches(request.headers.get('If-None-Match'), etag)
+
+    def write_not_modified(self, response, etag, early=False):
+        response.status = 304
+        response.body = ''
+        response.content_length = None
+        response.headers['ETag'] = etag
+        if early:
+            self.early_not_modified += 1
+        else:
+            self.not_modified += 1
+
+    def stats(self):
+        return {
+            'not_modified': self.not_modified,
+            'early_not_modified': self.early_not_modified,
+        }
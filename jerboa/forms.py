@@ -1,11 +1,13 @@
 import re
-import json
-import urllib
-import urllib2
 import wtforms
+import webapp2
 from datetime import datetime
+from collections import OrderedDict
 import wtforms.csrf.session as csrf_lib
+from wtforms.meta import DefaultMeta
 import webapp2_extras.i18n as i18n
+from . import recaptcha
+from .utils import LRUCache, request_locale
 from .utils import STATIC_LANGUAGE_CODES_TUPLE, UK_COUNTY_SET, STATIC_COUNTRY_CODES_SET, STATIC_LANGUAGE_CODES_SET, UK_COUNTIES_TUPLE, STATIC_COUNTRY_LABLES_TUPLE, US_STATES_SET, eu_country
 
 DEFAULT_NONE_VALUE = u'NONE'
@@ -33,6 +35,9 @@ EMAIL_REGEXP = "^[a-zA-Z0-9.!#$%&'*+/=?^_`{|}~-]+@[a-zA-Z0-9](?:[a-zA-Z0-9-]{0,6
 ALPHANUMERIC_REGEXP = "^\w+$"
 MOBILE_REGEXP = "^\+?[0-9-()]{1,20}$"
 
+EMAIL_RE = re.compile(EMAIL_REGEXP)
+MOBILE_RE = re.compile(MOBILE_REGEXP)
+
 
 # === Filters ===
 def strip_whitespace_filter(value):
@@ -66,6 +71,187 @@ class FormField(wtforms.FormField):
         return len(self._fields)
 
 
+class FormPrototype(object):
+    """
+    The bound fields of a form class, built once so that each form instance can copy them rather than constructing
+    every field from scratch.
+
+    WTForms binds each field of a form for every instance, which means running the field constructor (label, id,
+    flags, choices etc.) for every field, on every request. None of that depends on the request apart from the meta
+    and the translations, which are replaced on each copy. Labels that default to the field name are translated, so
+    they are rebuilt for each copy.
+
+    Prototypes are cached per (form class, prefix, field options), where the field options are the reCAPTCHA keys.
+    """
+    _prototypes = {}
+
+    def __init__(self, form_class, prefix='', field_options=None):
+        field_options = dict(field_options or ())
+        meta = form_class._wtforms_meta()
+        self.fields = []
+        for name, unbound_field in form_class._unbound_fields:
+            options = dict(name=name, prefix=prefix, translations=None)
+            for field_class, extra_options in field_options.iteritems():
+                if issubclass(unbound_field.field_class, field_class):
+                    options.update(extra_options)
+            field = unbound_field.bind(form=None, _meta=meta, **options)
+            label = unbound_field.args[0] if unbound_field.args else unbound_field.kwargs.get('label')
+            self.fields.append((name, field, label is None))
+
+    @classmethod
+    def for_form(cls, form_class, prefix='', field_options=None):
+        key = (form_class, prefix, field_options)
+        try:
+            return cls._prototypes[key]
+        except KeyError:
+            prototype = cls._prototypes[key] = cls(form_class=form_class, prefix=prefix,
+                                                   field_options=dict(field_options or ()))
+            return prototype
+
+    @classmethod
+    def supports(cls, form_class):
+        # A custom `bind_field` could depend on the form instance
+        return form_class._wtforms_meta.bind_field.__func__ is DefaultMeta.bind_field.__func__
+
+    @staticmethod
+    def _copy(obj):
+        # Much faster than `copy.copy`, which goes through the pickle protocol
+        clone = object.__new__(obj.__class__)
+        clone.__dict__.update(obj.__dict__)
+        return clone
+
+    def bind(self, meta, translations):
+        for name, prototype, default_label in self.fields:
+            field = self._copy(prototype)
+            field.meta = meta
+            if translations is not None:
+                field._translations = translations
+            field.flags = self._copy(prototype.flags)
+            if default_label:
+                field.label = wtforms.fields.Label(field.id, field.gettext(name.replace('_', ' ').title()))
+            else:
+                field.label = self._copy(prototype.label)
+            if prototype.render_kw is not None:
+                field.render_kw = dict(prototype.render_kw)
+            # Not `getattr`, as `FormField` proxies unknown attributes to its form, which the prototype doesn't have
+            if isinstance(prototype.__dict__.get('choices'), list):
+                field.choices = list(prototype.choices)
+            yield name, field
+
+
+class ValidationPlan(object):
+    """
+    The validation steps of a form class, worked out once rather than on every call to `validate`.
+
+    `wtforms.Form.validate` looks up the inline `validate_<field name>` method of every field, checks the extra
+    validators, and calls the (usually empty) `pre_validate` and `post_validate` of every field. The plan records which
+    of these each field actually needs. Fields with nothing to validate are skipped altogether.
+
+    Each field still runs its own validators in order, so the errors are the same as `wtforms.Form.validate`. Fields
+    that override `validate` (e.g. `FormField`) are validated by calling it.
+    """
+    _plans = {}
+    _field_class_steps = {}
+
+    def __init__(self, form_class, fields):
+        #: (field name, inline validator, custom validate, has pre_validate, has post_validate) for each field
+        self.steps = []
+        for name, field in fields.iteritems():
+            inline = getattr(form_class, 'validate_%s' % name, None)
+            self.steps.append((name, inline) + self.field_class_steps(field.__class__))
+
+    @classmethod
+    def for_form(cls, form):
+        # Fields can be added to, or removed from, a form instance
+        key = (form.__class__, tuple(form._fields))
+        try:
+            return cls._plans[key]
+        except KeyError:
+            plan = cls._plans[key] = cls(form_class=form.__class__, fields=form._fields)
+            return plan
+
+    @classmethod
+    def field_class_steps(cls, field_class):
+        """
+        Returns (custom validate, has pre_validate, has post_validate) for a field class.
+        """
+        try:
+            return cls._field_class_steps[field_class]
+        except KeyError:
+            steps = cls._field_class_steps[field_class] = (
+                field_class.validate.__func__ is not wtforms.Field.validate.__func__,
+                field_class.pre_validate.__func__ is not wtforms.Field.pre_validate.__func__,
+                field_class.post_validate.__func__ is not wtforms.Field.post_validate.__func__,
+            )
+            return steps
+
+    def validate(self, form, extra_validators=None):
+        success = True
+        fields = form._fields
+        for name, inline, custom_validate, has_pre_validate, has_post_validate in self.steps:
+            field = fields[name]
+            if extra_validators and name in extra_validators:
+                extra = list(extra_validators[name])
+                if inline is not None:
+                    extra.append(inline)
+            elif inline is not None:
+                extra = [inline]
+            else:
+                extra = None
+
+            if custom_validate:
+                if not field.validate(form, extra or ()):
+                    success = False
+                continue
+
+            if extra:
+                field.check_validators(extra)
+            elif not (field.validators or field.process_errors or has_pre_validate or has_post_validate):
+                # Nothing can fail
+                field.errors = []
+                continue
+
+            if not self.validate_field(form, field, extra, has_pre_validate, has_post_validate):
+                success = False
+        return success
+
+    @staticmethod
+    def validate_field(form, field, extra, has_pre_validate, has_post_validate):
+        # Equivalent to `wtforms.Field.validate` (as of WTForms 2.3)
+        errors = field.errors = list(field.process_errors)
+        stop_validation = False
+
+        if has_pre_validate:
+            try:
+                field.pre_validate(form)
+            except wtforms.validators.StopValidation, e:
+                if e.args and e.args[0]:
+                    errors.append(e.args[0])
+                stop_validation = True
+            except ValueError, e:
+                errors.append(e.args[0])
+
+        if not stop_validation:
+            for validator in (list(field.validators) + extra) if extra else field.validators:
+                try:
+                    validator(form, field)
+                except wtforms.validators.StopValidation, e:
+                    if e.args and e.args[0]:
+                        errors.append(e.args[0])
+                    stop_validation = True
+                    break
+                except ValueError, e:
+                    errors.append(e.args[0])
+
+        if has_post_validate:
+            try:
+                field.post_validate(form, stop_validation)
+            except ValueError, e:
+                errors.append(e.args[0])
+
+        return not errors
+
+
 class BaseForm(LenghtSupportedForm):
     """
     BaseForm extends the WTForms implementation and adds in a few config options.
@@ -76,6 +262,10 @@ class BaseForm(LenghtSupportedForm):
     form.
     """
     title = ''
+    #: Copy the fields from a cached `FormPrototype` rather than binding them for each instance
+    use_prototype = True
+    #: Validate with a cached `ValidationPlan` rather than `wtforms.Form.validate`
+    use_validation_plan = True
 
     class Meta:
         csrf = True
@@ -116,6 +306,15 @@ class BaseForm(LenghtSupportedForm):
         recaptcha_site_key = kwargs.get('recaptcha_site_key', False)
         recaptcha_site_secret = kwargs.get('recaptcha_site_secret', False)
 
+        if self.use_prototype and FormPrototype.supports(self.__class__):
+            field_options = None
+            if recaptcha_site_key and recaptcha_site_secret:
+                recaptcha_options = (('site_key', recaptcha_site_key), ('site_secret', recaptcha_site_secret))
+                field_options = ((Recaptcha2InputField, recaptcha_options), (Recaptcha2ResponseField, recaptcha_options))
+            self._init_from_prototype(formdata=formdata, obj=existing_obj, data=data, meta=meta_dict,
+                                      field_options=field_options, **kwargs)
+            return
+
         if recaptcha_site_key and recaptcha_site_secret:
             try:
                 self.recaptcha2.kwargs.update({'site_key': recaptcha_site_key, 'site_secret': recaptcha_site_secret})
@@ -126,11 +325,111 @@ class BaseForm(LenghtSupportedForm):
 
         super(BaseForm, self).__init__(formdata=formdata, obj=existing_obj, data=data, meta=meta_dict, **kwargs)
 
+    def _init_from_prototype(self, formdata, obj, data, meta, field_options=None, prefix='', **kwargs):
+        # Equivalent to `wtforms.Form.__init__` (as of WTForms 2.3), except that the fields are copied from the
+        # prototype. The CSRF field holds per instance state, so it is still bound normally.
+        meta_obj = self._wtforms_meta()
+        meta_obj.update_values(meta)
+
+        if prefix and prefix[-1] not in '-_;:/.':
+            prefix += '-'
+
+        self.meta = meta_obj
+        self._prefix = prefix
+        self._fields = OrderedDict()
+
+        translations = self._get_translations()
+        prototype = FormPrototype.for_form(self.__class__, prefix=prefix, field_options=field_options)
+        for name, field in prototype.bind(meta=meta_obj, translations=translations):
+            self._fields[name] = field
+
+        if meta_obj.csrf:
+            self._csrf = meta_obj.build_csrf(self)
+            for name, unbound_field in self._csrf.setup_form(self):
+                self._fields[name] = meta_obj.bind_field(self, unbound_field,
+                                                         dict(name=name, prefix=prefix, translations=translations))
+
+        for name, field in self._fields.iteritems():
+            setattr(self, name, field)
+        self.process(formdata, obj, data=data, **kwargs)
+
+    def validate(self, extra_validators=None):
+        if not self.use_validation_plan:
+            return super(BaseForm, self).validate(extra_validators=extra_validators)
+        return ValidationPlan.for_form(self).validate(self, extra_validators=extra_validators)
+
     def _get_translations(self):
         return FormTranslations()
 
 
 # === Widgets ===
+class RenderedOptions(object):
+    """
+    The `<option>` markup for the choices of a select, rendered once per (widget class, choices, locale) rather than
+    on every render. Rendering a select then only has to swap in the selected version of the selected option(s).
+
+    Choices are cached by identity, so they must not be changed in place. The widgets only use the cache for tuple
+    choices, apart from `SelectOptGroups`, whose category dicts are treated as static.
+    """
+    cache = LRUCache(max_size=256)
+
+    def __init__(self, items):
+        """
+        :param items: Markup strings, or (value, markup, selected markup) tuples for options.
+        """
+        parts = []
+        self.positions = {}
+        offset = 0
+        for item in items:
+            if isinstance(item, tuple):
+                value, html, selected_html = item
+                self.positions.setdefault(value, []).append((offset, offset + len(html), selected_html))
+            else:
+                html = item
+            parts.append(html)
+            offset += len(html)
+        self.html = u''.join(parts)
+
+    @staticmethod
+    def current_locale():
+        try:
+            return request_locale(webapp2.get_request())
+        except (AssertionError, AttributeError):
+            return None
+
+    @classmethod
+    def for_choices(cls, widget, choices, build, coerce=None):
+        """
+        Returns the cached options for the choices, calling `build()` to render the items if there aren't any.
+        """
+        key = (widget.__class__, id(choices), coerce, cls.current_locale())
+        cached = cls.cache.get(key)
+        # The id of choices that have been garbage collected can be reused
+        if cached is not None and cached[0] is choices:
+            return cached[1]
+
+        options = cls(build())
+        cls.cache.set(key, (choices, options))
+        return options
+
+    def render(self, selected_value):
+        try:
+            positions = self.positions.get(selected_value)
+        except TypeError:
+            positions = None
+        if not positions:
+            return self.html
+
+        parts = []
+        last = 0
+        for start, end, selected_html in positions:
+            parts.append(self.html[last:start])
+            parts.append(selected_html)
+            last = end
+        parts.append(self.html[last:])
+        return u''.join(parts)
+
+
 class SelectOptGroups(object):
     """
     Renders a select field.
@@ -141,6 +440,8 @@ class SelectOptGroups(object):
     The field must provide an `iter_choices()` method which the widget will
     call on rendering; this method must yield tuples of
     `(value, label, selected)`.
+
+    The options are cached in `RenderedOptions`, so replace the choices dict rather than changing it in place.
     """
     def __init__(self, multiple=False):
         self.multiple = multiple
@@ -152,16 +453,20 @@ class SelectOptGroups(object):
         html = ['<select %s>' % wtforms.widgets.core.html_params(name=field.name, **kwargs)]
 
         html.append('<option value="default">=== Please select an entry category ===</option>')
-        # if form data for this field is empty, get the finished string from memcached
-        for category, category_info in field.choices.items():
-            html.append('<optgroup label="' + category_info.get('class_name') + '">')
-            for award_id, award_info in category_info.get('awards').items():
-                cat_id = category+award_id
-                html.append(self.render_option(cat_id, award_info.get('award_name'), cat_id == field.data))
-            html.append('</optgroup>')
+        options = RenderedOptions.for_choices(self, field.choices, lambda: self.iter_rendered_options(field.choices))
+        html.append(options.render(field.data))
         html.append('</select>')
         return wtforms.widgets.core.HTMLString(''.join(html))
 
+    def iter_rendered_options(self, choices):
+        for category, category_info in choices.items():
+            yield '<optgroup label="' + category_info.get('class_name') + '">'
+            for award_id, award_info in category_info.get('awards').items():
+                cat_id = category+award_id
+                yield (cat_id, self.render_option(cat_id, award_info.get('award_name'), False),
+                       self.render_option(cat_id, award_info.get('award_name'), True))
+            yield '</optgroup>'
+
     @classmethod
     def render_option(cls, value, label, selected, **kwargs):
         options = dict(kwargs, value=value)
@@ -170,32 +475,177 @@ class SelectOptGroups(object):
         return wtforms.widgets.core.HTMLString('<option %s>%s</option>' % (wtforms.widgets.core.html_params(**options), wtforms.widgets.core.escape(wtforms.compat.text_type(label))))
 
 
+class CachedSelectWidget(wtforms.widgets.core.Select):
+    """
+    The standard `Select` widget, but the options of tuple choices are cached in `RenderedOptions`.
+    """
+    def __call__(self, field, **kwargs):
+        if self.multiple or not isinstance(field.choices, tuple):
+            return super(CachedSelectWidget, self).__call__(field, **kwargs)
+
+        kwargs.setdefault('id', field.id)
+        if 'required' not in kwargs and 'required' in getattr(field, 'flags', []):
+            kwargs['required'] = True
+        options = RenderedOptions.for_choices(self, field.choices, lambda: self.iter_rendered_options(field),
+                                              coerce=field.coerce)
+        return wtforms.widgets.core.HTMLString('<select %s>%s</select>' % (
+            wtforms.widgets.core.html_params(name=field.name, **kwargs), options.render(field.data)))
+
+    def iter_rendered_options(self, field):
+        # The same choices as `SelectField.iter_choices`, which is what the uncached widget renders
+        choices = field.choices
+        if choices and not isinstance(choices[0], (list, tuple)):
+            choices = zip(choices, choices)
+        for value, label in choices:
+            yield (field.coerce(value), self.render_option(value, label, False), self.render_option(value, label, True))
+
+
 class ExtendedSelectWidget(wtforms.widgets.core.Select):
     """
     Add support of choices with ``optgroup`` to the ``Select`` widget.
+
+    The options of tuple choices are cached in `RenderedOptions`.
     """
     def __call__(self, field, **kwargs):
         kwargs.setdefault('id', field.id)
         if self.multiple:
             kwargs['multiple'] = True
         html = ['<select %s>' % wtforms.widgets.core.html_params(name=field.name, **kwargs)]
-        for item1, item2 in field.choices:
+        if isinstance(field.choices, tuple):
+            options = RenderedOptions.for_choices(self, field.choices, lambda: self.iter_rendered_options(field.choices))
+            html.append(options.render(field.data))
+        else:
+            for item1, item2 in field.choices:
+                if isinstance(item2, (list,tuple)):
+                    group_label = item1
+                    group_items = item2
+                    html.append('<optgroup %s>' % wtforms.widgets.core.html_params(label=group_label))
+                    for inner_val, inner_label in group_items:
+                        html.append(self.render_option(inner_val, inner_label, inner_val == field.data))
+                    html.append('</optgroup>')
+                else:
+                    val = item1
+                    label = item2
+                    html.append(self.render_option(val, label, val == field.data))
+        html.append('</select>')
+        return wtforms.widgets.core.HTMLString(''.join(html))
+
+    def iter_rendered_options(self, choices):
+        for item1, item2 in choices:
             if isinstance(item2, (list,tuple)):
                 group_label = item1
                 group_items = item2
-                html.append('<optgroup %s>' % wtforms.widgets.core.html_params(label=group_label))
+                yield '<optgroup %s>' % wtforms.widgets.core.html_params(label=group_label)
                 for inner_val, inner_label in group_items:
-                    html.append(self.render_option(inner_val, inner_label, inner_val == field.data))
-                html.append('</optgroup>')
+                    yield (inner_val, self.render_option(inner_val, inner_label, False),
+                           self.render_option(inner_val, inner_label, True))
+                yield '</optgroup>'
             else:
                 val = item1
                 label = item2
-                html.append(self.render_option(val, label, val == field.data))
-        html.append('</select>')
-        return wtforms.widgets.core.HTMLString(''.join(html))
+                yield val, self.render_option(val, label, False), self.render_option(val, label, True)
+
+
+class ChoiceIndex(object):
+    """
+    The set of valid values for the choices of a select field, with any optgroups flattened, so that validating the
+    field is a single lookup rather than a scan of every choice (`UK_COUNTIES_TUPLE` alone has over a hundred).
+
+    Indexes are cached by the identity of the choices (and the coerce function), so every instance of every form that
+    uses e.g. `STATIC_COUNTRY_LABLES_TUPLE` shares one index. Only tuples are cached; a list can be changed in place, so
+    it is scanned instead.
+    """
+    MAX_CACHED = 256
+    _indexes = {}
+
+    def __init__(self, choices, coerce=None):
+        if coerce is None:
+            self.values = frozenset(self.iter_values(choices))
+        else:
+            self.values = frozenset(coerce(value) for value in self.iter_values(choices))
+
+    @staticmethod
+    def iter_values(choices):
+        if not choices:
+            return
+        if not isinstance(choices[0], (list, tuple)):
+            # Plain values, which `SelectField` uses as both the value and the label
+            for value in choices:
+                yield value
+            return
+        for value, label in choices:
+            if isinstance(label, (list, tuple)):
+                for group_value, _ in label:
+                    yield group_value
+            else:
+                yield value
 
+    @classmethod
+    def for_choices(cls, choices, coerce=None):
+        """
+        Returns the index for the choices, or None if they can't be indexed (they aren't a tuple, or the values aren't
+        hashable).
+        """
+        if not isinstance(choices, tuple):
+            return None
+
+        key = (id(choices), coerce)
+        cached = cls._indexes.get(key)
+        # The id of a tuple that has been garbage collected can be reused
+        if cached is not None and cached[0] is choices:
+            return cached[1]
+
+        try:
+            index = cls(choices=choices, coerce=coerce)
+        except (TypeError, ValueError):
+            index = None
+        if len(cls._indexes) >= cls.MAX_CACHED:
+            # Choices built for each request would otherwise fill the cache
+            cls._indexes.clear()
+        cls._indexes[key] = (choices, index)
+        return index
+
+    def __contains__(self, value):
+        try:
+            return value in self.values
+        except TypeError:
+            return False
+
+
+class IndexedSelectField(wtforms.fields.core.SelectField):
+    """
+    A `SelectField` that validates the submitted value against a shared `ChoiceIndex`.
+
+    Tuple choices are kept as they are, rather than copied into a list for each instance, so that the index can be
+    shared. To change the choices of a single form instance, assign a new list or tuple to `choices`.
+    """
+    widget = CachedSelectWidget()
+    #: Compare the coerced choice values to the data, as `SelectField` does
+    coerce_choices = True
+    invalid_choice_message = 'Not a valid choice'
 
-class ExtendedSelectField(wtforms.fields.core.SelectField):
+    def __init__(self, label=None, validators=None, choices=None, **kwargs):
+        super(IndexedSelectField, self).__init__(label, validators, choices=choices, **kwargs)
+        if isinstance(choices, tuple):
+            self.choices = choices
+
+    def pre_validate(self, form):
+        if not getattr(self, 'validate_choice', True):
+            return
+
+        coerce = self.coerce if self.coerce_choices else None
+        index = ChoiceIndex.for_choices(self.choices, coerce=coerce)
+        if index is not None:
+            if self.data in index:
+                return
+        else:
+            for value in ChoiceIndex.iter_values(self.choices):
+                if (coerce(value) if coerce is not None else value) == self.data:
+                    return
+        raise ValueError(self.gettext(self.invalid_choice_message))
+
+
+class ExtendedSelectField(IndexedSelectField):
     """
     Add support of ``optgroup`` grouping to default WTForms' ``SelectField`` class.
 
@@ -220,24 +670,8 @@ class ExtendedSelectField(wtforms.fields.core.SelectField):
 
     """
     widget = ExtendedSelectWidget()
-
-    def pre_validate(self, form):
-        """
-        Don't forget to validate also values from embedded lists.
-        """
-        for item1, item2 in self.choices:
-            if isinstance(item2, (list, tuple)):
-                group_label = item1
-                group_items = item2
-                for val,label in group_items:
-                    if val == self.data:
-                        return
-            else:
-                val = item1
-                label = item2
-                if val == self.data:
-                    return
-        raise ValueError(self.gettext('Not a valid choice!'))
+    coerce_choices = False
+    invalid_choice_message = 'Not a valid choice!'
 
 
 class Recaptcha2Widget(object):
@@ -295,35 +729,43 @@ class Recaptcha2Validator(object):
     This is a validator for a RecaptchaField. Note that this is typically
     not used directly, since the RecaptchaField automatically adds this
     validator.
+
+    Responses are verified with `client`, or `jerboa.recaptcha.default_verify_client` if there isn't one. The result is
+    kept on the field, so validating the same form again doesn't verify the (single use) token a second time.
     """
 
-    def __init__(self, message=None):
+    def __init__(self, message=None, client=None, unavailable_message=None):
         if not message:
             message = u'Invalid reCaptcha response'
+        if not unavailable_message:
+            unavailable_message = u'reCaptcha could not be checked, please try again'
 
         self.message = message
+        self.client = client
+        self.unavailable_message = unavailable_message
 
     def __call__(self, form, field):
         """
         Verify a Google reCAPTCHA 2.0 response.
         """
-        endpoint = u"https://www.google.com/recaptcha/api/siteverify"
-
-        recaptcha_params = {
-            'secret': field.site_secret,
-            'response': field.data,
-            'remoteip': form.request_headers.get(u'remote_addr', None),
-        }
-        recaptcha_params = urllib.urlencode(recaptcha_params)
-        request = urllib2.Request(endpoint, recaptcha_params)
-        response = urllib2.urlopen(request)
-        result = json.load(response)
-
-        if not result['success']:
-            error_codes = result.get('error_codes', None)
+        verification = getattr(field, 'verification', None)
+        if verification is not None and verification[0] == (field.site_secret, field.data):
+            result = verification[1]
+        else:
+            client = self.client if self.client is not None else recaptcha.default_verify_client
+            try:
+                result = client.verify(field.site_secret, field.data,
+                                       remote_ip=form.request_headers.get(u'remote_addr', None))
+            except recaptcha.RecaptchaUnavailable:
+                raise wtforms.validators.ValidationError(self.unavailable_message)
+            field.verification = (field.site_secret, field.data), result
+
+        if not result.get('success'):
+            message = self.message
+            error_codes = result.get('error-codes', None)
             if error_codes:
-                self.message = u'{0}: {1}'.format(self.message, error_codes)
-            raise wtforms.validators.ValidationError(self.message)
+                message = u'{0}: {1}'.format(message, error_codes)
+            raise wtforms.validators.ValidationError(message)
 
 
 class Recaptcha2ResponseField(wtforms.HiddenField):
@@ -339,6 +781,8 @@ class Recaptcha2ResponseField(wtforms.HiddenField):
 
         self.site_key = site_key
         self.site_secret = site_secret
+        #: ((site secret, response), verify result) of the last verification of this field
+        self.verification = None
 
 
 class CheckboxArrayField(wtforms.SelectMultipleField):
@@ -350,74 +794,62 @@ class CheckboxArrayField(wtforms.SelectMultipleField):
 
 # === Validators ===
 def SecondaryEmailValidation(form, field):
-    if len(field.data) > 0:
-        regex = re.compile(EMAIL_REGEXP)
-        if not regex.match(field.data or ''):
-            raise wtforms.validators.ValidationError('Invalid characters found in email address')
+    if field.data and not EMAIL_RE.match(field.data):
+        raise wtforms.validators.ValidationError('Invalid characters found in email address')
 
 
 def MobileValidator(form, field):
-    if field.data:
-        regex = re.compile(MOBILE_REGEXP)
-        if not regex.match(field.data or ''):
-            raise wtforms.validators.ValidationError('Invalid characters found in mobile number')
-
-
-def USStateValidation(form, field):
-    if form.country.data == 'US' and not len(field.data) > 0:
-        raise wtforms.validators.ValidationError('State is a required field for US addresses.')
-    elif form.country.data == 'US' and field.data not in US_STATES_SET:
-        raise wtforms.validators.ValidationError('Please select a valid US state from the list.')
-
-
-def UKCountyValidation(form, field):
-    if form.country.data == 'GB' and not len(field.data) > 0:
-        raise wtforms.validators.ValidationError('County is a required field for UK addresses.')
-    elif form.country.data == 'GB' and field.data not in UK_COUNTY_SET:
-        raise wtforms.validators.ValidationError('Please select a valid UK county from the list.')
+    if field.data and not MOBILE_RE.match(field.data):
+        raise wtforms.validators.ValidationError('Invalid characters found in mobile number')
 
 
-def UKPostCodeValidation(form, field):
-    if not len(field.data) > 0 and form.country.data == 'GB':
-        raise wtforms.validators.ValidationError('Post code is a required field for UK addresses.')
-
-
-def DeliveryUSStateValidation(form, field):
-    if form.delivery_country.data == 'US' and not len(field.data) > 0:
-        raise wtforms.validators.ValidationError('Delivery State is a required field for US addresses.')
-    elif form.delivery_country.data == 'US' and field.data not in US_STATES_SET:
-        raise wtforms.validators.ValidationError('Please select a valid US state from the list.')
-
-
-def BillingUSStateValidation(form, field):
-    if form.billing_country.data == 'US' and not len(field.data) > 0:
-        raise wtforms.validators.ValidationError('Billing State is a required field for US addresses.')
-    elif form.billing_country.data == 'US' and field.data not in US_STATES_SET:
-        raise wtforms.validators.ValidationError('Please select a valid US state from the list.')
-
-
-def DeliveryUKCountyValidation(form, field):
-    if form.delivery_country.data == 'GB' and not len(field.data) > 0:
-        raise wtforms.validators.ValidationError('Delivery County is a required field for UK addresses.')
-    elif form.delivery_country.data == 'GB' and field.data not in UK_COUNTY_SET:
-        raise wtforms.validators.ValidationError('Please select a valid UK county from the list.')
-
-
-def BillingUKCountyValidation(form, field):
-    if form.billing_country.data == 'GB' and not len(field.data) > 0:
-        raise wtforms.validators.ValidationError('Billing County is a required field for UK addresses.')
-    elif form.billing_country.data == 'GB' and field.data not in UK_COUNTY_SET:
-        raise wtforms.validators.ValidationError('Please select a valid UK county from the list.')
-
-
-def DeliveryUKPostCodeValidation(form, field):
-    if not len(field.data) > 0 and form.delivery_country.data == 'GB':
-        raise wtforms.validators.ValidationError('Delivery Post code is a required field for UK addresses.')
-
-
-def BillingUKPostCodeValidation(form, field):
-    if not len(field.data) > 0 and form.billing_country.data == 'GB':
-        raise wtforms.validators.ValidationError('Billing Post code is a required field for UK addresses.')
+def country_dependent_validator(country_field, country_code, required_message, valid_values=None,
+                                invalid_message=None):
+    """
+    Builds a validator for a field that is only required for one country e.g. the county of a UK address. The country
+    is checked first, so the validator does nothing else for addresses in any other country.
+
+    :param country_field: The name of the country field on the same form.
+    :param country_code: The country that the field is required for.
+    :param required_message: The error if the field is empty.
+    :param valid_values: If given, a set of the values that are valid for the country.
+    :param invalid_message: The error if the value is not in `valid_values`.
+    """
+    def validator(form, field):
+        if form[country_field].data != country_code:
+            return
+        if not field.data:
+            raise wtforms.validators.ValidationError(required_message)
+        if valid_values is not None and field.data not in valid_values:
+            raise wtforms.validators.ValidationError(invalid_message)
+
+    return validator
+
+
+USStateValidation = country_dependent_validator(
+    'country', 'US', 'State is a required field for US addresses.',
+    US_STATES_SET, 'Please select a valid US state from the list.')
+UKCountyValidation = country_dependent_validator(
+    'country', 'GB', 'County is a required field for UK addresses.',
+    UK_COUNTY_SET, 'Please select a valid UK county from the list.')
+UKPostCodeValidation = country_dependent_validator(
+    'country', 'GB', 'Post code is a required field for UK addresses.')
+DeliveryUSStateValidation = country_dependent_validator(
+    'delivery_country', 'US', 'Delivery State is a required field for US addresses.',
+    US_STATES_SET, 'Please select a valid US state from the list.')
+BillingUSStateValidation = country_dependent_validator(
+    'billing_country', 'US', 'Billing State is a required field for US addresses.',
+    US_STATES_SET, 'Please select a valid US state from the list.')
+DeliveryUKCountyValidation = country_dependent_validator(
+    'delivery_country', 'GB', 'Delivery County is a required field for UK addresses.',
+    UK_COUNTY_SET, 'Please select a valid UK county from the list.')
+BillingUKCountyValidation = country_dependent_validator(
+    'billing_country', 'GB', 'Billing County is a required field for UK addresses.',
+    UK_COUNTY_SET, 'Please select a valid UK county from the list.')
+DeliveryUKPostCodeValidation = country_dependent_validator(
+    'delivery_country', 'GB', 'Delivery Post code is a required field for UK addresses.')
+BillingUKPostCodeValidation = country_dependent_validator(
+    'billing_country', 'GB', 'Billing Post code is a required field for UK addresses.')
 
 
 def CountryCodeValidation(form, field):
@@ -548,7 +980,7 @@ class EmailAddressMixin(object):
 
 
 class LanguagePreferenceMixin(object):
-    language_preference = wtforms.fields.SelectField(i18n.lazy_gettext('Preferred Language'), [
+    language_preference = IndexedSelectField(i18n.lazy_gettext('Preferred Language'), [
         # custom validator to check that value is in list specified.
         LanguageCodeValidation,
         wtforms.validators.InputRequired(),
@@ -605,7 +1037,7 @@ class AddressMixin(object):
     post_code = wtforms.fields.StringField(i18n.lazy_gettext('Post Code/Zip Code (Required for UK companies)'), [
         UKPostCodeValidation,
     ])
-    country = wtforms.fields.SelectField(i18n.lazy_gettext('Country'), [
+    country = IndexedSelectField(i18n.lazy_gettext('Country'), [
         # custom validator to check that value is in list specified.
         CountryCodeValidation,
         wtforms.validators.InputRequired(),
@@ -645,18 +1077,18 @@ class SearchWithFiltersMixin(object):
 
 
 class GAESearchLimitMixin(object):
-    limit = wtforms.fields.SelectField(i18n.lazy_gettext('Results per page'), [
+    limit = IndexedSelectField(i18n.lazy_gettext('Results per page'), [
         wtforms.validators.Length(max=1000, message=i18n.lazy_gettext("The maximum results per page is %(max)d.")),
     ], choices=((u'5', u'5'), (u'20', u'20'), (u'50', u'50'), (u'100', u'100'), (u'250', u'250')), default=u'5')
 
 
 class SortByPlaceholderMixin(object):
-    sort_by = wtforms.fields.SelectField(i18n.lazy_gettext(u'Sort By'), [], choices=((DEFAULT_NONE_VALUE, u'No Sort')),
+    sort_by = IndexedSelectField(i18n.lazy_gettext(u'Sort By'), [], choices=((DEFAULT_NONE_VALUE, u'No Sort')),
                                          default=DEFAULT_NONE_VALUE)
 
 
 class SortDirectionMixin(object):
-    sort_direction = wtforms.fields.SelectField(i18n.lazy_gettext('Sort Direction'), [
+    sort_direction = IndexedSelectField(i18n.lazy_gettext('Sort Direction'), [
     ], choices=((u'ASCENDING', u'Ascending'), (u'DESCENDING', u'Descending')), default=u'ASCENDING')
 
 
@@ -774,20 +1206,20 @@ class UserForm(BaseModelForm, NameMixin, UsernameMixin, EmailAddressMixin, Confi
 
 # Example user forms
 class UserSortOptions(GAESortOptions):
-    sort_by = wtforms.fields.SelectField(i18n.lazy_gettext(u'Sort By'),
-                                         [],
-                                         choices=(
-                                             (u'NONE', i18n.lazy_gettext(u'None')),
-                                             (u'username', i18n.lazy_gettext(u'Username')),
-                                             (u'first_name', i18n.lazy_gettext(u'First Name')),
-                                             (u'last_name', i18n.lazy_gettext(u'Last Name')),
-                                             (u'email_address', i18n.lazy_gettext(u'Primary Email')),
-                                             (u'recovery_email_address', i18n.lazy_gettext(u'Recovery Email')),
-                                             (u'language_preference', i18n.lazy_gettext(u'Language')),
-                                             (u'created', i18n.lazy_gettext(u'Registered')),
-                                             (u'updated', i18n.lazy_gettext(u'Updated')),
-                                         ),
-                                         default=DEFAULT_NONE_VALUE)
+    sort_by = IndexedSelectField(i18n.lazy_gettext(u'Sort By'),
+                                 [],
+                                 choices=(
+                                     (u'NONE', i18n.lazy_gettext(u'None')),
+                                     (u'username', i18n.lazy_gettext(u'Username')),
+                                     (u'first_name', i18n.lazy_gettext(u'First Name')),
+                                     (u'last_name', i18n.lazy_gettext(u'Last Name')),
+                                     (u'email_address', i18n.lazy_gettext(u'Primary Email')),
+                                     (u'recovery_email_address', i18n.lazy_gettext(u'Recovery Email')),
+                                     (u'language_preference', i18n.lazy_gettext(u'Language')),
+                                     (u'created', i18n.lazy_gettext(u'Registered')),
+                                     (u'updated', i18n.lazy_gettext(u'Updated')),
+                                 ),
+                                 default=DEFAULT_NONE_VALUE)
 
 
 LANG_LIST = [(DEFAULT_NONE_VALUE, u'--')]
@@ -796,7 +1228,7 @@ LANG_TUPLE = tuple(LANG_LIST)
 
 
 class UserFilterOptions(GAEFilterOptions):
-    language_preference = wtforms.fields.SelectField(i18n.lazy_gettext(u'Preferred Language'), [
+    language_preference = IndexedSelectField(i18n.lazy_gettext(u'Preferred Language'), [
         LanguageCodeValidationWithDefaultSupport,
     ], choices=LANG_TUPLE, default=DEFAULT_NONE_VALUE)
 
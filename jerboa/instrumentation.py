@@ -0,0 +1,191 @@
+# coding=utf-8
+import re
+import threading
+
+try:
+    from time import monotonic as monotonic_clock
+except ImportError:
+    try:
+        # Backport of `time.monotonic` for Python 2, which reads the OS monotonic clock
+        from monotonic import monotonic as monotonic_clock
+    except (ImportError, RuntimeError):
+        # Not monotonic: on Linux default_timer is `time.time`, which goes backwards if the system clock is set back.
+        # Use `elapsed` to measure durations with it.
+        from timeit import default_timer as monotonic_clock
+
+__author__ = 'Matt'
+
+
+"""
+Opt-in timing for the custom dispatcher.
+
+When enabled, the dispatcher creates a `RequestTimer` for each request. Each stage of the dispatch pipeline (route match,
+hooks, namespace switch and handler dispatch) is timed, as is each receiver connected to the dispatcher hooks. This
+means that the page render shows up as `post_process_response_hook.default_post_request_hook`.
+
+At the end of the request the timings are:
+
+    - added to the response as a `Server-Timing` header (can be disabled)
+    - recorded in per route histograms, which you can read via `DispatchTimingCollector.snapshot` or export with
+      `DispatchTimingCollector.render_text`
+
+When timing is disabled the dispatcher skips all of this; the only overhead is checking whether a collector is set.
+"""
+
+
+# Upper bounds of the histogram buckets, in milliseconds
+DEFAULT_HISTOGRAM_BUCKETS = (1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+_METRIC_NAME_RE = re.compile(r'[^a-zA-Z0-9_.\-]')
+
+
+def elapsed(started):
+    """
+    Seconds since `started` (a `monotonic_clock` reading). Never negative, even if the clock isn't monotonic.
+    """
+    return max(monotonic_clock() - started, 0.0)
+
+
+def timing_metric_name(name):
+    return _METRIC_NAME_RE.sub('_', name)
+
+
+def receiver_name(receiver):
+    try:
+        return receiver.__name__
+    except AttributeError:
+        return receiver.__class__.__name__
+
+
+class TimingHistogram(object):
+    def __init__(self, buckets=DEFAULT_HISTOGRAM_BUCKETS):
+        self.buckets = buckets
+        # The last count is for values above the largest bucket
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        for index, upper_bound in enumerate(self.buckets):
+            if value <= upper_bound:
+                self.counts[index] += 1
+                return
+        self.counts[-1] += 1
+
+    def snapshot(self):
+        cumulative = 0
+        buckets = []
+        for upper_bound, count in zip(self.buckets + ('+Inf',), self.counts):
+            cumulative += count
+            buckets.append((upper_bound, cumulative))
+
+        return {
+            'count': self.count,
+            'sum': self.sum,
+            'buckets': buckets,
+        }
+
+
+class RequestTimer(object):
+    """
+    Records the duration of each dispatcher stage for a single request. Stages are sequential, so `mark` records the
+    time elapsed since the previous mark.
+    """
+    def __init__(self):
+        self.started = self._last_mark = monotonic_clock()
+        self.stages = []
+        self.receivers = []
+
+    def mark(self, stage):
+        now = monotonic_clock()
+        self.stages.append((stage, max(now - self._last_mark, 0.0)))
+        self._last_mark = now
+
+    def skip(self):
+        # Discard the time since the last mark e.g. when a stage does nothing worth reporting
+        self._last_mark = monotonic_clock()
+
+    def send(self, hook, sender, **kwargs):
+        """
+        Equivalent to `hook.send(sender, **kwargs)`, but times each receiver and then marks the hook as a stage.
+        """
+        for receiver in hook.receivers_for(sender):
+            started = monotonic_clock()
+            receiver(sender, **kwargs)
+            self.record_receiver(hook, receiver, elapsed(started))
+        self.mark(hook.name)
+
+    def record_receiver(self, hook, receiver, duration):
+        self.receivers.append((u'{}.{}'.format(hook.name, receiver_name(receiver)), duration))
+
+    @property
+    def total(self):
+        return elapsed(self.started)
+
+    def server_timing(self, total=None):
+        metrics = ['{};dur={:.3f}'.format(timing_metric_name(name), duration * 1000)
+                   for name, duration in self.stages + self.receivers]
+        if total is not None:
+            metrics.append('total;dur={:.3f}'.format(total * 1000))
+        return ', '.join(metrics)
+
+
+class DispatchTimingCollector(object):
+    """
+    Collects the request timings for an app. Install it by passing `dispatch_timing=True` (or an instance of this class)
+    to `JerboaApp`.
+
+    Histograms are keyed by (route name, stage) and measured in milliseconds.
+    """
+    def __init__(self, server_timing_header=True, buckets=DEFAULT_HISTOGRAM_BUCKETS):
+        self.server_timing_header = server_timing_header
+        self.buckets = buckets
+        self.histograms = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def start():
+        return RequestTimer()
+
+    def finish(self, timer, request, response):
+        total = timer.total
+
+        try:
+            route_name = request.route.name or u'unnamed'
+        except AttributeError:
+            route_name = u'unmatched'
+
+        if self.server_timing_header:
+            response.headers['Server-Timing'] = timer.server_timing(total=total)
+
+        with self._lock:
+            for name, duration in timer.stages + timer.receivers + [('total', total)]:
+                key = (route_name, name)
+                try:
+                    histogram = self.histograms[key]
+                except KeyError:
+                    histogram = self.histograms[key] = TimingHistogram(buckets=self.buckets)
+                histogram.observe(duration * 1000)
+
+    def snapshot(self):
+        with self._lock:
+            return dict((key, histogram.snapshot()) for key, histogram in self.histograms.iteritems())
+
+    def reset(self):
+        with self._lock:
+            self.histograms = {}
+
+    def render_text(self, metric_name='jerboa_dispatch_duration_ms'):
+        """
+        Renders the histograms in the Prometheus text exposition format.
+        """
+        lines = ['# TYPE {} histogram'.format(metric_name)]
+        for (route_name, stage), histogram in sorted(self.snapshot().iteritems()):
+            labels = u'route="{}",stage="{}"'.format(route_name, stage)
+            for upper_bound, count in histogram['buckets']:
+                lines.append(u'{}_bucket{{{},le="{}"}} {}'.format(metric_name, labels, upper_bound, count))
+            lines.append(u'{}_sum{{{}}} {}'.format(metric_name, labels, histogram['sum']))
+            lines.append(u'{}_count{{{}}} {}'.format(metric_name, labels, histogram['count']))
+        return u'\n'.join(lines) + u'\n'
@@ -0,0 +1,173 @@
+# coding=utf-8
+import re
+import logging
+from .utils import LRUCache
+
+__author__ = 'Matt'
+
+
+"""
+Multi-tenant namespace resolution for the custom dispatcher.
+
+Previously the only way to set a namespace was to connect a receiver to `CUSTOM_DISPATCHER_REQUEST_INIT_HOOK` and set
+`request.namespace`. That receiver would usually repeat the same config lookup for every request. A `NamespaceResolver`
+does the same job, but caches the namespace for each tenant key:
+
+    resolver = NamespaceResolver(strategy=HostNamespaceStrategy(subdomain=True), lookup=tenant_namespace_for_key)
+    app = JerboaApp(resource_config=..., namespace_resolver=resolver)
+
+The strategy extracts the tenant key from the request (host, path prefix or header). `lookup` turns the key into a
+namespace; return `None` to use the default namespace. It can also be a dict of key -> namespace, or a set of keys that
+are used as the namespace. Every strategy takes the key from the client (the `Host` header is as easy to set as any
+other header), so the resolver must have a lookup; otherwise any client could pick any tenant's namespace. If something
+in front of the app already limits the keys, e.g. only your own domains are mapped to it, pass `trust_keys=True` to use
+the key itself as the namespace. Custom strategies also need a lookup, unless they set `client_controlled = False`.
+
+Keys and namespaces that aren't valid App Engine namespaces resolve to the default namespace, rather than failing the
+request when the namespace is set.
+
+The resolver runs before the request init hook, so receivers can still override `request.namespace` if they need to.
+"""
+
+
+DEFAULT_NAMESPACE = 'default'
+# The same rule as `google.appengine.api.namespace_manager`
+NAMESPACE_RE = re.compile(r'^[0-9A-Za-z._-]{0,100}$')
+
+
+class HostNamespaceStrategy(object):
+    """
+    Uses the request host (without the port) as the tenant key. If `subdomain` is True then only the left most label is
+    used e.g. `acme` for `acme.example.com`.
+    """
+    client_controlled = True
+
+    def __init__(self, subdomain=False):
+        self.subdomain = subdomain
+
+    def key_for(self, request):
+        host = request.host.split(':', 1)[0].lower()
+        if self.subdomain:
+            return host.split('.', 1)[0]
+        return host
+
+
+class PathPrefixNamespaceStrategy(object):
+    """
+    Uses the first segment of the request path as the tenant key e.g. `acme` for `/acme/company/overview`.
+    """
+    client_controlled = True
+
+    def key_for(self, request):
+        return request.path.lstrip('/').split('/', 1)[0] or None
+
+
+class HeaderNamespaceStrategy(object):
+    """
+    Uses a request header as the tenant key e.g. one set by a trusted front end.
+    """
+    client_controlled = True
+
+    def __init__(self, header='X-Tenant'):
+        self.header = header
+
+    def key_for(self, request):
+        return request.headers.get(self.header) or None
+
+
+class LocalNamespaceManager(object):
+    """
+    Stand-in for `google.appengine.api.namespace_manager`, for running (and benchmarking) off App Engine. It counts
+    the number of times the namespace is set.
+    """
+    def __init__(self):
+        self.namespace = ''
+        self.set_count = 0
+
+    def get_namespace(self):
+        return self.namespace
+
+    def set_namespace(self, namespace):
+        if namespace is None:
+            namespace = ''
+        if not NAMESPACE_RE.match(namespace):
+            raise ValueError(u'`{}` is not a valid namespace'.format(namespace))
+        self.set_count += 1
+        self.namespace = namespace
+
+
+class NamespaceResolver(object):
+    def __init__(self, strategy, lookup=None, cache_size=1000, default_namespace=DEFAULT_NAMESPACE,
+                 namespace_manager=None, trust_keys=False):
+        """
+        :param strategy: Object with a `key_for(request)` method that returns the tenant key, or None.
+        :param lookup: Callable that takes a tenant key and returns the namespace, or None for the default namespace.
+            Can also be a dict of key -> namespace, or a set of the keys that can be used as namespaces. Required for
+            strategies where the client controls the key, unless `trust_keys` is set.
+        :param cache_size: Maximum number of tenant keys to remember.
+        :param default_namespace: Used when there is no tenant key or the lookup returns None.
+        :param namespace_manager: Defaults to the App Engine namespace manager. Use `LocalNamespaceManager` to run off
+            App Engine.
+        :param trust_keys: Use the tenant key as the namespace when there is no lookup, even though the client controls
+            the key. Only set this if the keys have already been checked e.g. by the front end.
+        """
+        if lookup is None and not trust_keys and getattr(strategy, 'client_controlled', True):
+            raise ValueError(u'{} takes the tenant key from the client, so it needs a lookup (or `trust_keys=True`)'
+                             .format(strategy.__class__.__name__))
+
+        if namespace_manager is None:
+            from google.appengine.api import namespace_manager
+
+        if isinstance(lookup, dict):
+            lookup = lookup.get
+        elif isinstance(lookup, (set, frozenset)):
+            lookup = self._set_lookup(lookup)
+
+        self.strategy = strategy
+        self.lookup = lookup
+        self.default_namespace = default_namespace
+        self.namespace_manager = namespace_manager
+        self.namespaces = LRUCache(max_size=cache_size)
+
+    @staticmethod
+    def _set_lookup(keys):
+        keys = frozenset(keys)
+
+        def lookup(key):
+            return key if key in keys else None
+        return lookup
+
+    def resolve(self, request):
+        key = self.strategy.key_for(request)
+        if key is None:
+            return self.default_namespace
+
+        namespace = self.namespaces.get(key)
+        if namespace is None:
+            namespace = self._resolve_key(key)
+        return namespace
+
+    def _resolve_key(self, key):
+        if not NAMESPACE_RE.match(key):
+            # Not cached, so that junk keys can't push out real tenants
+            return self.default_namespace
+
+        namespace = self.lookup(key) if self.lookup is not None else key
+        if namespace is None:
+            namespace = self.default_namespace
+        elif not NAMESPACE_RE.match(namespace):
+            logging.warning(u'Tenant `%s` has an invalid namespace `%s`; using the default namespace', key, namespace)
+            namespace = self.default_namespace
+
+        self.namespaces.set(key, namespace)
+        return namespace
+
+    def invalidate(self, key=None):
+        """
+        Forget the namespace for a tenant key e.g. after changing the tenant config. Clears everything if no key is
+        given.
+        """
+        if key is None:
+            self.namespaces.clear()
+        else:
+            self.namespaces.delete(key)
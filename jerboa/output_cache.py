@@ -0,0 +1,220 @@
+# coding=utf-8
+import time
+import hashlib
+from .utils import LocalMemcacheClient, request_locale
+
+__author__ = 'Matt'
+
+
+"""
+Full page output cache.
+
+Pages such as a company overview only change when the underlying data changes, but the handler hooks and the page
+render run for every request. Create the app with `output_cache=True` (or an `OutputCache`), then enable the output
+cache for a route in its method config:
+
+    'method': {
+        'title': 'Company Overview',
+        'code_name': 'overview',
+        'output_cache': {
+            'ttl': 300,
+            'vary_params': ['page'],
+            'stale_while_revalidate': 60,
+        },
+    }
+
+Successful (200) GET responses are then cached. The dispatcher checks the cache after the pre dispatch hooks have run,
+so authentication and other request checks still apply. A cached hit skips the handler (and its hooks) and the render.
+
+Cache keys are built from the route, the path, the query parameters listed in `vary_params` (all of them if it is
+`None`), and optionally the namespace and locale. Responses that set a cookie, or that send `Cache-Control: private` or
+`no-store`, are never cached.
+
+A cached hit is served to anyone who passes the pre dispatch hooks, so a page that contains anything specific to the
+user (their name, a CSRF token) must not be shared. With `vary_user` the page is cached separately for each user, using
+the `user_key` function given to `OutputCache`; if there is no `user_key`, or it returns None for a request, the page
+is neither served from nor stored in the cache. `vary_user` defaults to the route's `login_required`, so pages behind a
+login are never shared unless the route sets `'vary_user': False`.
+
+With `stale_while_revalidate`, an expired page can still be served for that many extra seconds. The first request to
+see the stale page regenerates it; every other request gets the stale copy in the meantime.
+
+Use `invalidate_output_cache(request, 'company_overview')` (e.g. in a `valid_form_hook` receiver after a write) to
+drop every cached page for a route.
+
+Pages are cached uncompressed. If response compression is enabled, each compressed variant is cached alongside the page
+(see `jerboa.compression`).
+"""
+
+
+DEFAULT_OUTPUT_CACHE_CONFIG = {
+    # Seconds that a cached page is fresh for
+    'ttl': 300,
+    # Query parameters that change the page. `None` means all of them; an empty list means none.
+    'vary_params': None,
+    'vary_namespace': True,
+    'vary_locale': True,
+    # Cache the page separately for each user. `None` means the same as the route's `login_required`.
+    'vary_user': None,
+    # Seconds after the TTL that a stale page can be served while it is regenerated
+    'stale_while_revalidate': 0,
+}
+
+def route_output_cache_config(request):
+    """
+    Returns the output cache config for the matched route, or None if the route is not cached.
+    """
+    try:
+        config = request.route.method_config['output_cache']
+    except (AttributeError, KeyError, TypeError):
+        return None
+
+    if not config:
+        return None
+
+    # The method config is shared by every request (and possibly by other routes), so it is never changed
+    merged = dict(DEFAULT_OUTPUT_CACHE_CONFIG)
+    if config is not True:
+        merged.update(config)
+    if merged['vary_user'] is None:
+        merged['vary_user'] = bool(request.route.method_config.get('login_required'))
+    return merged
+
+
+def invalidate_output_cache(request, *route_names):
+    """
+    Drops the cached pages for the named routes, using the output cache of the app that is handling the request.
+    """
+    output_cache = getattr(request.app.router, 'output_cache', None)
+    if output_cache is not None:
+        output_cache.invalidate(*route_names)
+
+
+class OutputCache(object):
+    """
+    Stores rendered responses in a memcache style backend (`get`, `set`, `add` and `delete`). Defaults to an in process
+    `LocalMemcacheClient`; use the App Engine memcache client to share the cache between instances.
+    """
+    KEY_PREFIX = 'jerboa/output/'
+    # Seconds that a request has to regenerate a stale page before another request tries
+    REVALIDATE_LOCK_TIMEOUT = 30
+
+    def __init__(self, backend=None, key_prefix=KEY_PREFIX, clock=time.time, user_key=None):
+        """
+        :param user_key: Returns a string that identifies the user of a request, or None if it can't (e.g. the user
+            id from the session). Required to cache routes that use `vary_user`.
+        """
+        self.backend = backend if backend is not None else LocalMemcacheClient()
+        self.key_prefix = key_prefix
+        self.clock = clock
+        self.user_key = user_key
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+
+    def _generation(self, route_name):
+        generation = self.backend.get(u'{}generation/{}'.format(self.key_prefix, route_name))
+        return generation or 0
+
+    def cache_key(self, request, config):
+        """
+        Returns the key of the page for the request, or None if it must not be cached for this request.
+        """
+        user = None
+        if config['vary_user']:
+            user = self.user_key(request) if self.user_key is not None else None
+            if user is None:
+                return None
+
+        if config['vary_params'] is None:
+            params = sorted(request.GET.items())
+        else:
+            params = [(name, request.GET.getall(name)) for name in config['vary_params']]
+
+        route_name = request.route.name
+        parts = (
+            route_name,
+            self._generation(route_name),
+            request.host,
+            request.path,
+            params,
+            getattr(request, 'namespace', None) if config['vary_namespace'] else None,
+            request_locale(request) if config['vary_locale'] else None,
+            user,
+        )
+        return self.key_prefix + hashlib.sha1(repr(parts)).hexdigest()
+
+    def get(self, key, config):
+        """
+        Returns the cached entry, or None if the page should be generated.
+        """
+        entry = self.backend.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        age = self.clock() - entry[0]
+        if age < config['ttl']:
+            self.hits += 1
+            return entry
+
+        if age < config['ttl'] + config['stale_while_revalidate'] and \
+                not self.backend.add(key + '/revalidate', True, time=self.REVALIDATE_LOCK_TIMEOUT):
+            # Another request is already regenerating the page
+            self.stale_hits += 1
+            return entry
+
+        self.misses += 1
+        return None
+
+    @staticmethod
+    def cacheable(request, response):
+        if request.method != 'GET' or response.status_int != 200 or 'Set-Cookie' in response.headers:
+            return False
+        cache_control = response.cache_control
+        return cache_control.private is None and not cache_control.no_store
+
+    def set(self, key, config, response):
+        # Copy the headers, as later stages (e.g. compression) change them in place
+        entry = (self.clock(), response.status, list(response.headerlist), response.body)
+        self.backend.set(key, entry, time=config['ttl'] + config['stale_while_revalidate'])
+        self.backend.delete(key + '/revalidate')
+        return entry
+
+    @staticmethod
+    def variant_key(key, entry, encoding):
+        # Includes the time the page was cached, so a regenerated page never uses the variants of the old one
+        return u'{}/{}/{!r}'.format(key, encoding, entry[0])
+
+    def get_variant(self, key, entry, encoding):
+        """
+        Returns the body of the cached page in a content encoding (e.g. gzip), or None.
+        """
+        return self.backend.get(self.variant_key(key, entry, encoding))
+
+    def set_variant(self, key, entry, encoding, body, config):
+        # Expire with the page
+        remaining = entry[0] + config['ttl'] + config['stale_while_revalidate'] - self.clock()
+        if remaining > 0:
+            self.backend.set(self.variant_key(key, entry, encoding), body, time=remaining)
+
+    @staticmethod
+    def write_response(entry, response):
+        created, status, headerlist, body = entry
+        response.status = status
+        response.headerlist = list(headerlist)
+        response.body = body
+
+    def invalidate(self, *route_names):
+        for route_name in route_names:
+            key = u'{}generation/{}'.format(self.key_prefix, route_name)
+            # Changing the generation changes the key for every cached page of the route. Use the time rather than
+            # incrementing, as the backend may have evicted the current generation.
+            self.backend.set(key, repr(self.clock()))
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'stale_hits': self.stale_hits,
+            'misses': self.misses,
+        }
@@ -0,0 +1,361 @@
+# coding=utf-8
+import json
+import time
+import socket
+import urllib
+import httplib
+import threading
+from Queue import Queue, Empty, Full
+from urlparse import urlsplit, parse_qs
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from SocketServer import ThreadingMixIn
+from .instrumentation import monotonic_clock
+
+__author__ = 'Matt'
+
+
+"""
+reCAPTCHA verification.
+
+`Recaptcha2Validator` verifies responses with a `RecaptchaVerifyClient`, which keeps a pool of keep alive connections
+to the verify endpoint rather than opening a new connection (and TLS handshake) for every form submission. Each call is
+bounded by a connect timeout and a read timeout, so a slow endpoint can't hold up the request thread indefinitely.
+
+The client doesn't cache results. Google only verifies each token once, so a token that has been used can't be replayed
+by another request (or another client). The validator remembers the result on the field instead, so validating the
+same form twice (e.g. after changing another field) doesn't fail with `timeout-or-duplicate`.
+
+After `failure_threshold` consecutive failures (connection errors, timeouts, or error responses) the circuit breaker
+opens, and verification fails straight away for `reset_timeout` seconds. After that a single trial call is allowed
+through; if it succeeds the breaker closes again. While verification is unavailable the validator fails the field with
+its `unavailable_message`, i.e. the form is not accepted without a verified response.
+
+The validators use `default_verify_client` unless they are given a client. To change the settings, replace it when the
+app starts:
+
+    from jerboa import recaptcha
+
+    recaptcha.default_verify_client = recaptcha.RecaptchaVerifyClient(connect_timeout=1, read_timeout=3)
+
+`LocalRecaptchaVerifyServer` is an in process stand in for the verify endpoint, so that tests and benchmarks can run
+offline.
+"""
+
+
+VERIFY_URL = 'https://www.google.com/recaptcha/api/siteverify'
+
+
+class RecaptchaUnavailable(Exception):
+    """
+    The verify endpoint couldn't be reached, didn't respond in time, returned an error, or the circuit breaker is open.
+    """
+    pass
+
+
+class ConnectionPool(object):
+    """
+    Thread safe pool of keep alive HTTP(S) connections to a single host. Connections are created on demand, and up to
+    `max_size` idle connections are kept for reuse.
+    """
+    def __init__(self, url, max_size=10, connect_timeout=2.0, read_timeout=5.0):
+        parts = urlsplit(url)
+        self.scheme = parts.scheme
+        self.host = parts.hostname
+        self.port = parts.port
+        self.path = parts.path or '/'
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self._idle = Queue(maxsize=max_size)
+        self.created = 0
+        self.reused = 0
+
+    def _new_connection(self):
+        connection_class = httplib.HTTPSConnection if self.scheme == 'https' else httplib.HTTPConnection
+        connection = connection_class(self.host, self.port, timeout=self.connect_timeout)
+        connection.connect()
+        # The connect timeout also applies to reads unless it is replaced. App Engine's httplib has no socket.
+        if getattr(connection, 'sock', None) is not None:
+            connection.sock.settimeout(self.read_timeout)
+        self.created += 1
+        return connection
+
+    def _release(self, connection):
+        try:
+            self._idle.put_nowait(connection)
+        except Full:
+            connection.close()
+
+    def post(self, body, headers=None):
+        """
+        Posts the body to the pool URL and returns (status, response body).
+
+        If an idle connection turns out to have been closed by the server, the request is retried once on a new
+        connection. Timeouts are never retried.
+        """
+        headers = dict(headers or (), Connection='keep-alive')
+        try:
+            connection = self._idle.get_nowait()
+            reused = True
+        except Empty:
+            connection = self._new_connection()
+            reused = False
+
+        try:
+            response, data = self._send(connection, body, headers)
+        except socket.timeout:
+            connection.close()
+            raise
+        except (httplib.HTTPException, socket.error):
+            connection.close()
+            if not reused:
+                raise
+            # Not `self.post`, which would take the next idle connection; that may be just as stale
+            connection = self._new_connection()
+            reused = False
+            try:
+                response, data = self._send(connection, body, headers)
+            except (httplib.HTTPException, socket.error):
+                connection.close()
+                raise
+
+        if reused:
+            self.reused += 1
+        if response.will_close:
+            connection.close()
+        else:
+            self._release(connection)
+        return response.status, data
+
+    def _send(self, connection, body, headers):
+        connection.request('POST', self.path, body, headers)
+        # Buffered reads are safe as requests are never pipelined; unbuffered reads recv a byte at a time
+        response = connection.getresponse(buffering=True)
+        return response, response.read()
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except Empty:
+                return
+
+    def stats(self):
+        return {
+            'created': self.created,
+            'reused': self.reused,
+            'idle': self._idle.qsize(),
+        }
+
+
+class CircuitBreaker(object):
+    """
+    Opens after `failure_threshold` consecutive failures, so that calls fail fast rather than waiting for a timeout.
+    Once `reset_timeout` seconds have passed a single trial call is allowed; its outcome closes or re-opens the breaker.
+    """
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold=5, reset_timeout=30, clock=monotonic_clock):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self.rejected = 0
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and self.clock() - self.opened_at >= self.reset_timeout:
+                self.state = self.HALF_OPEN
+                return True
+            # Open, or half open with the trial call still running
+            self.rejected += 1
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                self.state = self.OPEN
+                self.opened_at = self.clock()
+
+    def stats(self):
+        return {
+            'state': self.state,
+            'failures': self.failures,
+            'rejected': self.rejected,
+        }
+
+
+class RecaptchaVerifyClient(object):
+    def __init__(self, verify_url=VERIFY_URL, pool_size=10, connect_timeout=2.0, read_timeout=5.0, failure_threshold=5,
+                 reset_timeout=30):
+        """
+        :param verify_url: The siteverify endpoint.
+        :param pool_size: The maximum number of idle connections to keep.
+        :param connect_timeout: Seconds to wait for a connection (including the TLS handshake).
+        :param read_timeout: Seconds to wait for each read from the endpoint.
+        :param failure_threshold: Consecutive failures before the circuit breaker opens.
+        :param reset_timeout: Seconds before an open circuit breaker allows a trial call.
+        """
+        self.pool = ConnectionPool(verify_url, max_size=pool_size, connect_timeout=connect_timeout,
+                                   read_timeout=read_timeout)
+        self.breaker = CircuitBreaker(failure_threshold=failure_threshold, reset_timeout=reset_timeout)
+        self.verified = 0
+
+    def verify(self, secret, token, remote_ip=None):
+        """
+        Returns the siteverify result, e.g. `{'success': False, 'error-codes': ['invalid-input-response']}`.
+
+        :raises RecaptchaUnavailable: If the endpoint could not be used.
+        """
+        if not token:
+            return {'success': False, 'error-codes': ['missing-input-response']}
+
+        if not self.breaker.allow():
+            raise RecaptchaUnavailable(u'reCAPTCHA verification is unavailable')
+
+        # Every call that the breaker allows must record an outcome; otherwise a half open breaker never closes again
+        try:
+            params = {'secret': secret, 'response': token}
+            if remote_ip:
+                params['remoteip'] = remote_ip
+            body = urllib.urlencode(dict((name, value.encode('utf-8') if isinstance(value, unicode) else value)
+                                         for name, value in params.iteritems()))
+            status, data = self.pool.post(body, {'Content-Type': 'application/x-www-form-urlencoded'})
+            if status != 200:
+                raise RecaptchaUnavailable(u'reCAPTCHA verification returned {}'.format(status))
+            result = json.loads(data)
+        except (httplib.HTTPException, socket.error, ValueError, RecaptchaUnavailable), e:
+            self.breaker.record_failure()
+            if isinstance(e, RecaptchaUnavailable):
+                raise
+            raise RecaptchaUnavailable(u'reCAPTCHA verification failed: {}'.format(e))
+        except Exception:
+            self.breaker.record_failure()
+            raise
+
+        self.breaker.record_success()
+        self.verified += 1
+        return result
+
+    def stats(self):
+        stats = {
+            'verified': self.verified,
+            'breaker': self.breaker.stats(),
+        }
+        stats.update(self.pool.stats())
+        return stats
+
+
+default_verify_client = RecaptchaVerifyClient()
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class _VerifyHandler(BaseHTTPRequestHandler):
+    # Keep alive
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        # The headers and body are written separately, which would otherwise stall on delayed ACKs
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.server.stand_in.count_connection()
+
+    def do_POST(self):
+        data = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        params = dict((name, values[0]) for name, values in parse_qs(data).iteritems())
+        status, body = self.server.stand_in.respond(params)
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class LocalRecaptchaVerifyServer(object):
+    """
+    In process stand in for the siteverify endpoint, for tests and benchmarks. Serves keep alive HTTP on a background
+    thread; point a client at `url`:
+
+        with LocalRecaptchaVerifyServer(valid_tokens=['token']) as server:
+            client = RecaptchaVerifyClient(verify_url=server.url)
+
+    Tokens in `valid_tokens` verify successfully, once each, as with the real endpoint. Set `delay` (seconds) to
+    simulate a slow endpoint, or `status` to simulate an outage.
+    """
+    def __init__(self, valid_tokens=(), delay=0, status=200, host='127.0.0.1', port=0):
+        self.valid_tokens = set(valid_tokens)
+        self.delay = delay
+        self.status = status
+        self.used_tokens = set()
+        self.requests = 0
+        self.connections = 0
+        self._lock = threading.Lock()
+        self._server = _ThreadingHTTPServer((host, port), _VerifyHandler)
+        self._server.stand_in = self
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address
+        return 'http://{}:{}/recaptcha/api/siteverify'.format(host, port)
+
+    def count_connection(self):
+        with self._lock:
+            self.connections += 1
+
+    def respond(self, params):
+        with self._lock:
+            self.requests += 1
+        if self.delay:
+            time.sleep(self.delay)
+        if self.status != 200:
+            return self.status, json.dumps({'error': 'unavailable'})
+
+        token = params.get('response')
+        with self._lock:
+            if token in self.used_tokens:
+                error_code = 'timeout-or-duplicate'
+            elif token in self.valid_tokens:
+                self.used_tokens.add(token)
+                error_code = None
+            else:
+                error_code = 'invalid-input-response'
+
+        if error_code is not None:
+            return 200, json.dumps({'success': False, 'error-codes': [error_code]})
+        return 200, json.dumps({'success': True, 'hostname': 'localhost'})
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, kwargs={'poll_interval': 0.05})
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
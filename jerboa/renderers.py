@@ -1,7 +1,327 @@
+import os
+import re
+import logging
 import jinja2
+import hashlib
+import datetime
+import webapp2
+from babel.support import LazyProxy
+from jinja2 import nodes, meta
+from jinja2.environment import TemplateStream
+from jinja2.ext import Extension
+from jinja2.utils import concat
+from .instrumentation import monotonic_clock, elapsed
+from .utils import LRUCache, LocalMemcacheClient, RequestContext, request_locale
+
+try:
+    # C accelerated, and unlike ujson it supports the `default` hook that we need for dates and lazy strings
+    import simplejson as json_backend
+except ImportError:
+    import json as json_backend
 
 __author__ = 'Matt'
 
+FRAGMENT_CACHE_EXTENSION = 'jerboa.renderers.FragmentCacheExtension'
+
+# Number of template output items that are joined into each chunk when streaming a template
+DEFAULT_STREAM_BUFFER_SIZE = 5
+
+
+class RenderContext(object):
+    """
+    Read only mapping that looks up each key in `layers` in turn. The layers are not copied, so changes to them are
+    visible straight away. Jinja uses this as the parent of the template context, with the scratch space layered on top
+    of the template globals.
+
+    Layers only need to support `in`, `[]` and iteration.
+    """
+    __slots__ = ('layers',)
+
+    def __init__(self, *layers):
+        self.layers = layers
+
+    def __getitem__(self, key):
+        for layer in self.layers:
+            if key in layer:
+                return layer[key]
+        raise KeyError(key)
+
+    def __contains__(self, key):
+        for layer in self.layers:
+            if key in layer:
+                return True
+        return False
+
+    def get(self, key, default=None):
+        for layer in self.layers:
+            if key in layer:
+                return layer[key]
+        return default
+
+    def keys(self):
+        seen = set()
+        keys = []
+        for layer in self.layers:
+            for key in layer:
+                if key not in seen:
+                    seen.add(key)
+                    keys.append(key)
+        return keys
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def copy(self):
+        # Jinja copies the context when it rewrites the traceback of a template error
+        return dict((key, self[key]) for key in self.keys())
+
+    def __nonzero__(self):
+        return any(True for layer in self.layers for _ in layer)
+
+    def items(self):
+        return [(key, self[key]) for key in self.keys()]
+
+    def __repr__(self):
+        return '<RenderContext {!r}>'.format(dict(self.items()))
+
+
+"""
+Bytecode caches for `Jinja2Renderer`. Without one, every new instance parses and compiles each template the first time
+it is used. Set `bytecode_cache` in the renderer config to share the compiled templates between instances (memcache)
+or restarts (filesystem):
+
+    'bytecode_cache': {'type': 'memcache', 'prefix': 'jinja2/bytecode/', 'timeout': 3600}
+    'bytecode_cache': {'type': 'filesystem', 'directory': '/tmp/jinja2'}
+    'bytecode_cache': {'type': 'memory', 'max_size': 500}
+
+The memcache backend uses the App Engine memcache client unless you set `client` to another memcache style client e.g.
+`jerboa.utils.LocalMemcacheClient` when running locally. You can also pass any `jinja2.BytecodeCache` instance instead
+of a spec.
+
+Jinja validates the cached bytecode against a checksum of the template source, so a changed template is recompiled
+(and counted as a miss). Use `renderer.bytecode_cache.stats()` for the hit/miss counts.
+"""
+
+
+class BytecodeCacheStatsMixin(object):
+    hits = 0
+    misses = 0
+
+    def get_bucket(self, environment, name, filename, source):
+        bucket = super(BytecodeCacheStatsMixin, self).get_bucket(environment, name, filename, source)
+        # The bucket resets itself if the cached bytecode is out of date
+        if bucket.code is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return bucket
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+        }
+
+
+class FileSystemBytecodeCache(BytecodeCacheStatsMixin, jinja2.FileSystemBytecodeCache):
+    pass
+
+
+class MemcacheBytecodeCache(BytecodeCacheStatsMixin, jinja2.MemcachedBytecodeCache):
+    pass
+
+
+class MemoryBytecodeCache(BytecodeCacheStatsMixin, jinja2.BytecodeCache):
+    """
+    Keeps the compiled templates in process. Only useful when the environment is recreated within the same process
+    e.g. one renderer per request or in tests.
+    """
+    def __init__(self, max_size=1000):
+        self.cache = LRUCache(max_size=max_size)
+
+    def load_bytecode(self, bucket):
+        data = self.cache.get(bucket.key)
+        if data is not None:
+            bucket.bytecode_from_string(data)
+
+    def dump_bytecode(self, bucket):
+        self.cache.set(bucket.key, bucket.bytecode_to_string())
+
+    def clear(self):
+        self.cache.clear()
+
+
+def build_bytecode_cache(spec):
+    """
+    Returns a bytecode cache for a `bytecode_cache` renderer config value.
+    """
+    if isinstance(spec, jinja2.BytecodeCache):
+        return spec
+
+    spec = dict(spec)
+    cache_type = spec.pop('type')
+
+    if cache_type == 'filesystem':
+        return FileSystemBytecodeCache(**spec)
+    elif cache_type == 'memory':
+        return MemoryBytecodeCache(**spec)
+    elif cache_type == 'memcache':
+        if spec.get('client') is None:
+            from google.appengine.api import memcache
+            spec['client'] = memcache
+        return MemcacheBytecodeCache(**spec)
+
+    raise ValueError(u'Unknown bytecode cache type `{}`'.format(cache_type))
+
+
+"""
+Fragment caching. `Jinja2Renderer` registers `FragmentCacheExtension` by default, so any template can cache an
+expensive block that doesn't depend on the current user:
+
+    {% cache 'country_selector', 3600 %}
+        ...
+    {% endcache %}
+
+The key can be any expression, and the TTL (in seconds) is optional. The cached fragment automatically varies on the
+namespace and locale of the current request. Fragments are kept in process by default; set `fragment_cache` in the
+renderer config to any memcache style client (e.g. the App Engine memcache client) to share them between instances.
+"""
+
+
+def default_fragment_cache_vary():
+    """
+    Returns the values, other than the key, that a cached fragment varies on: the namespace and locale of the current
+    request.
+    """
+    try:
+        request = webapp2.get_request()
+    except AssertionError:
+        # Not rendering as part of a request
+        return None, None
+
+    return getattr(request, 'namespace', None), request_locale(request)
+
+
+class FragmentCacheExtension(Extension):
+    tags = set(['cache'])
+
+    def __init__(self, environment):
+        super(FragmentCacheExtension, self).__init__(environment)
+        environment.extend(
+            fragment_cache=LocalMemcacheClient(),
+            fragment_cache_prefix='jerboa/fragment/',
+            fragment_cache_vary=default_fragment_cache_vary,
+        )
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+
+        args = [parser.parse_expression()]
+        if parser.stream.skip_if('comma'):
+            args.append(parser.parse_expression())
+        else:
+            args.append(nodes.Const(None))
+
+        body = parser.parse_statements(['name:endcache'], drop_needle=True)
+        return nodes.CallBlock(self.call_method('_cache_support', args), [], [], body).set_lineno(lineno)
+
+    def fragment_key(self, key):
+        environment = self.environment
+        return environment.fragment_cache_prefix + hashlib.sha1(
+            repr((key, environment.fragment_cache_vary()))).hexdigest()
+
+    def _cache_support(self, key, ttl, caller):
+        cache = self.environment.fragment_cache
+        cache_key = self.fragment_key(key)
+
+        rv = cache.get(cache_key)
+        if rv is not None:
+            return rv
+
+        rv = caller()
+        cache.set(cache_key, rv, time=ttl or 0)
+        return rv
+
+
+class ContextBoundStream(object):
+    """
+    Iterates over `chunks` with a `RequestContext` bound to the thread while each chunk is produced, and while the
+    chunks are closed.
+    """
+    __slots__ = ('chunks', 'context')
+
+    def __init__(self, chunks, context):
+        self.chunks = chunks
+        self.context = context
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        with self.context:
+            return next(self.chunks)
+
+    def close(self):
+        close = getattr(self.chunks, 'close', None)
+        if close is not None:
+            with self.context:
+                close()
+
+
+class TemplatePreloadReport(object):
+    """
+    The result of preloading templates: how long each template took to load, and any that failed.
+    """
+    def __init__(self):
+        self.load_times = {}
+        self.errors = {}
+        self.total_time = 0.0
+
+    @property
+    def ok(self):
+        return not self.errors
+
+    def log(self):
+        for template_name, error in sorted(self.errors.iteritems()):
+            logging.error(u'Failed to preload template `{}`: {}'.format(template_name, error))
+
+        slowest = sorted(self.load_times.iteritems(), key=lambda item: item[1], reverse=True)[:5]
+        logging.info(u'Preloaded {} template(s) in {:.1f}ms with {} error(s). Slowest: {}'.format(
+            len(self.load_times), self.total_time * 1000, len(self.errors),
+            u', '.join(u'{} ({:.1f}ms)'.format(name, duration * 1000) for name, duration in slowest)))
+
+
+class SimpleTemplate(object):
+    """
+    A template that only supports `{{ name }}` placeholders. The source is split into literal text and placeholders
+    once, so rendering is a single join; placeholders without a value are left as they are.
+    """
+    placeholder_re = re.compile(r'\{\{ (.+?) \}\}')
+
+    def __init__(self, source):
+        # List of (literal text, placeholder name, placeholder text). The last segment has no placeholder.
+        self.segments = []
+        position = 0
+        for match in self.placeholder_re.finditer(source):
+            self.segments.append((source[position:match.start()], match.group(1), match.group(0)))
+            position = match.end()
+        self.segments.append((source[position:], None, None))
+        self.source = source
+
+    def render(self, params):
+        if not params:
+            return self.source
+
+        parts = []
+        for literal, name, placeholder in self.segments:
+            parts.append(literal)
+            if name is not None:
+                parts.append(str(params[name]) if name in params else placeholder)
+        return ''.join(parts)
+
 
 class SimpleRenderer(object):
     template_path = None
@@ -9,26 +329,70 @@ class SimpleRenderer(object):
 
     def __init__(self, engine_config=None):
         self.template_path = engine_config['theme_base_template_path']
+        # Template path -> ((mtime, size), SimpleTemplate)
+        self.templates = {}
 
     @staticmethod
     def parse_simple_template(template, params=None):
         params.pop("request", None)
-
-        def set_variables(text, key):
-            return text.replace("{{ %s }}" % key, str(params[key]))
-        return reduce(set_variables, params, template) if params else template
+        return _parse_simple_template(template).render(params)
 
     def simple_template_path(self, template_name):
-        import os
         return os.path.join(self.template_path, template_name)
 
+    def get_template(self, template_path):
+        """
+        Returns the compiled template, only reading the file again if it has changed since it was last compiled.
+        """
+        stat = os.stat(template_path)
+        # The size catches most changes made within the mtime resolution of the filesystem
+        version = stat.st_mtime, stat.st_size
+        try:
+            cached_version, template = self.templates[template_path]
+        except KeyError:
+            pass
+        else:
+            if cached_version == version:
+                return template
+
+        with open(template_path) as template_file:
+            template = SimpleTemplate(template_file.read())
+        self.templates[template_path] = version, template
+        return template
+
+    def preload_templates(self, template_names):
+        report = TemplatePreloadReport()
+        started = monotonic_clock()
+        for template_name in set(template_names):
+            template_started = monotonic_clock()
+            try:
+                self.get_template(self.simple_template_path(template_name=template_name))
+            except (IOError, OSError), e:
+                report.errors[template_name] = e
+            else:
+                report.load_times[template_name] = elapsed(template_started)
+        report.total_time = elapsed(started)
+        return report
+
     def render_template(self, template_name, relative=True, *args, **kwargs):
         if relative:
             # this is where we would build the theme template path instead of an absolute one
             template_path = self.simple_template_path(template_name=template_name)
         else:
             template_path = template_name
-        return self.parse_simple_template(open(template_path).read(), params=kwargs)
+        kwargs.pop("request", None)
+        return self.get_template(template_path).render(kwargs)
+
+
+_simple_template_cache = LRUCache(max_size=100)
+
+
+def _parse_simple_template(source):
+    template = _simple_template_cache.get(source)
+    if template is None:
+        template = SimpleTemplate(source)
+        _simple_template_cache.set(source, template)
+    return template
 
 
 class Jinja2Renderer(object):
@@ -46,17 +410,52 @@ class Jinja2Renderer(object):
             'global_vars': {},
             'filters': {},
             'tests': {},
+            'bytecode_cache': {'type': 'memcache', 'timeout': 3600},
+            'compiled_templates': 'build/compiled_templates',
+            'fragment_cache': memcache,
         }
         """
         try:
-            config['environment_args']['loader'] = jinja2.FileSystemLoader(config['theme_base_template_path'])
+            # Templates compiled ahead of time by `jerboa.template_compiler`
+            loader = jinja2.ModuleLoader(config['compiled_templates'])
+        except KeyError:
+            loader = jinja2.FileSystemLoader(config['theme_base_template_path'])
+
+        try:
+            config['environment_args']['loader'] = loader
         except KeyError:
             config['environment_args'] = {
-                'loader': jinja2.FileSystemLoader(config['theme_base_template_path'])
+                'loader': loader
             }
 
+        try:
+            bytecode_cache = config['bytecode_cache']
+        except KeyError:
+            # No bytecode cache set in config
+            bytecode_cache = None
+
+        if bytecode_cache is not None:
+            config['environment_args']['bytecode_cache'] = build_bytecode_cache(bytecode_cache)
+
+        extensions = list(config['environment_args'].get('extensions', []))
+        if FragmentCacheExtension not in extensions and FRAGMENT_CACHE_EXTENSION not in extensions:
+            extensions.append(FragmentCacheExtension)
+        config['environment_args']['extensions'] = extensions
+
         # Initialize the environment.
         self.environment = jinja2.Environment(**config['environment_args'])
+        self.bytecode_cache = self.environment.bytecode_cache
+        # Bumped by `clear_template_cache`, so cached template modules from before it are not used
+        self.generation = 0
+        # Template filename -> (generation, template, module)
+        self.template_modules = {}
+
+        try:
+            if config['fragment_cache'] is not None:
+                self.environment.fragment_cache = config['fragment_cache']
+        except KeyError:
+            # Use the default in process cache
+            pass
 
         self.environment.globals.update({'getattr': getattr})
         try:
@@ -107,6 +506,115 @@ class Jinja2Renderer(object):
         """
         return self.environment.get_template(_filename).render(**context)
 
+    def render_context(self, _filename, context):
+        """Renders a template with a mapping as the context, without copying it.
+
+        :param _filename:
+            The template filename, related to the templates directory.
+        :param context:
+            A mapping (e.g. a `ScratchSpace`) of variables used in the rendered template. Values in the mapping take
+            precedence over the environment globals.
+        :returns:
+            A rendered template.
+        """
+        template = self.environment.get_template(_filename)
+        try:
+            return concat(template.root_render_func(self._new_context(template, context)))
+        except Exception:
+            self.environment.handle_exception()
+
+    def stream_template(self, _filename, _buffer_size=DEFAULT_STREAM_BUFFER_SIZE, _encoding='utf-8', **context):
+        """Renders a template as an iterator of encoded chunks, which can be used as the response `app_iter`.
+
+        Jinja yields a chunk for each piece of template output, so we buffer `_buffer_size` of them before yielding.
+        Set it to 0 to disable buffering.
+
+        :param _filename:
+            The template filename, related to the templates directory.
+        :param _buffer_size:
+            The number of template output items to join into each chunk.
+        :param _encoding:
+            The chunks are encoded with this charset.
+        :param context:
+            Keyword arguments used as variables in the rendered template.
+        :returns:
+            An iterator of byte strings.
+        """
+        return self.stream_context(_filename, context, _buffer_size=_buffer_size, _encoding=_encoding)
+
+    def stream_context(self, _filename, context, _buffer_size=DEFAULT_STREAM_BUFFER_SIZE, _encoding='utf-8',
+                       _namespace_manager=None):
+        """The streaming equivalent of `render_context`. See `stream_template` for the arguments.
+
+        The WSGI server consumes the stream after webapp2 has released the request and the dispatcher has restored the
+        namespace, so the request globals (which i18n and the fragment cache use) and the namespace are captured here,
+        and bound again while each chunk is rendered.
+
+        :param _namespace_manager:
+            The namespace manager to capture the namespace from. Defaults to the App Engine namespace manager.
+        """
+        if _namespace_manager is None:
+            from google.appengine.api import namespace_manager as _namespace_manager
+
+        template = self.environment.get_template(_filename)
+        stream = TemplateStream(self._generate(template, context))
+        if _buffer_size:
+            stream.enable_buffering(size=_buffer_size)
+        else:
+            stream.disable_buffering()
+
+        return ContextBoundStream((chunk.encode(_encoding) for chunk in stream),
+                                  RequestContext.capture(namespace_manager=_namespace_manager))
+
+    def _generate(self, template, context):
+        # Same as `Template.generate`, except that the context is not copied
+        try:
+            for event in template.root_render_func(self._new_context(template, context)):
+                yield event
+        except Exception:
+            yield self.environment.handle_exception()
+
+    @staticmethod
+    def _new_context(template, context):
+        # Jinja would normally merge the variables into a copy of the globals; a shared context uses the mapping as is
+        return template.new_context(RenderContext(context, template.globals), shared=True)
+
+    def preload_templates(self, template_names):
+        """Loads and compiles the templates, along with any templates that they extend, include or import, so that
+        they are in the environment cache before the first request.
+
+        :param template_names:
+            The template filenames, related to the templates directory.
+        :returns:
+            A `TemplatePreloadReport`.
+        """
+        report = TemplatePreloadReport()
+        started = monotonic_clock()
+        pending = list(template_names)
+        seen = set()
+        while pending:
+            template_name = pending.pop()
+            if template_name in seen:
+                continue
+            seen.add(template_name)
+
+            template_started = monotonic_clock()
+            try:
+                self.environment.get_template(template_name)
+                if self.environment.loader.has_source_access:
+                    # Compiled templates can't be parsed, but there is nothing left to compile for them anyway
+                    source = self.environment.loader.get_source(self.environment, template_name)[0]
+                    referenced = meta.find_referenced_templates(self.environment.parse(source))
+                    # Dynamic references (e.g. a variable) are None
+                    pending.extend(name for name in referenced if name is not None)
+            except (jinja2.TemplateNotFound, jinja2.TemplateSyntaxError), e:
+                report.errors[template_name] = e
+            else:
+                report.load_times[template_name] = elapsed(template_started)
+
+        report.total_time = elapsed(started)
+        return report
+
     def get_template_attribute(self, filename, attribute):
         """Loads a macro (or variable) a template exports.  This can be used to
         invoke a macro from within Python code.  If you for example have a
@@ -121,16 +629,128 @@ class Jinja2Renderer(object):
             hello = get_template_attribute('_foo.html', 'hello')
             return hello('World')
 
-        This function comes from `Flask`.
+        This function comes from `Flask`. The template module is cached, see `get_template_module`.
 
         :param filename:
             The template filename.
         :param attribute:
             The name of the variable of macro to acccess.
         """
+        return getattr(self.get_template_module(filename), attribute)
+
+    def get_template_module(self, filename):
+        """Returns the evaluated template module, which holds the macros and variables that the template exports.
+
+        The module is cached, so calling macros from Python in a loop doesn't look up (and evaluate) the template each
+        time. If the environment reloads changed templates then the template is still checked on each call, and a new
+        module is evaluated when it has changed.
+
+        :param filename:
+            The template filename.
+        """
+        try:
+            generation, template, module = self.template_modules[filename]
+        except KeyError:
+            pass
+        else:
+            if generation == self.generation and (not self.environment.auto_reload or template.is_up_to_date):
+                return module
+
+        generation = self.generation
         template = self.environment.get_template(filename)
-        return getattr(template.module, attribute)
+        module = template.module
+        self.template_modules[filename] = generation, template, module
+        return module
+
+    def clear_template_cache(self):
+        """Drops every loaded template and template module e.g. after changing the environment globals, which are
+        baked into the template modules.
+        """
+        self.generation += 1
+        self.template_modules.clear()
+        if self.environment.cache is not None:
+            self.environment.cache.clear()
 
-    def render(self, template_name, response):
+    def render(self, template_name, response, stream=False, buffer_size=DEFAULT_STREAM_BUFFER_SIZE,
+               namespace_manager=None):
+        """Renders the template into the response, using `response.raw` as the template context.
+
+        If `stream` is True then the template is rendered as the response is sent, which means the client receives the
+        start of the page sooner and the full page is never held in memory. Note that the response status and headers
+        have already been sent by the time the template runs, so a template error can only truncate the page. The
+        template still runs with the current request and namespace (from `namespace_manager`), see `stream_context`.
+        """
         # propably just need to pass request.route.config['page_template']
-        response.write(self.render_template(template_name, **response.raw.__dict__))
+        context = response.raw if hasattr(response.raw, '__getitem__') else response.raw.__dict__
+        if stream:
+            response.app_iter = self.stream_context(template_name, context, _buffer_size=buffer_size,
+                                                    _encoding=response.charset or 'utf-8',
+                                                    _namespace_manager=namespace_manager)
+        else:
+            response.write(self.render_context(template_name, context))
+
+
+"""
+JSON renderer.
+
+API style routes set `content_type` to `application/json` in their method config. For these routes the default post
+request hook serializes `response.raw` with `JsonRenderer` instead of rendering a template. Set `json_keys` in the
+method config to only output some of the scratch space:
+
+    'method': {
+        'code_name': 'read',
+        'content_type': 'application/json',
+        'json_keys': ['user', 'status_code'],
+    }
+
+Dates, times and lazy gettext strings are converted to strings; any other value that JSON can't represent raises a
+`TypeError`, so whitelist the keys on routes whose scratch space holds e.g. a form.
+
+`simplejson` is used if it is installed, otherwise the standard library `json` module.
+"""
+
+
+JSON_CONTENT_TYPE = 'application/json'
+
+
+def json_default(obj):
+    if isinstance(obj, (datetime.datetime, datetime.date, datetime.time)):
+        return obj.isoformat()
+    if isinstance(obj, LazyProxy):
+        return unicode(obj)
+    if isinstance(obj, (set, frozenset)):
+        return list(obj)
+    raise TypeError(u'{!r} is not JSON serializable'.format(obj))
+
+
+class JsonRenderer(object):
+    def __init__(self, config=None):
+        """
+        example_config = {
+            'indent': None,
+            'sort_keys': False,
+            'default': json_default,
+        }
+        """
+        config = config or {}
+        indent = config.get('indent')
+        # The encoder is reused for every response. Compact separators, and no indent, keep the C encoder in use.
+        self.encoder = json_backend.JSONEncoder(default=config.get('default', json_default), indent=indent,
+                                                sort_keys=config.get('sort_keys', False),
+                                                separators=(',', ': ') if indent is not None else (',', ':'))
+
+    def serialize(self, data, keys=None):
+        """
+        :param data: A `ScratchSpace`, or any mapping.
+        :param keys: Only output these keys. Keys that are not set are left out.
+        :returns: The JSON document as a byte string.
+        """
+        if not isinstance(data, dict):
+            # The scratch space attributes are serialized without copying them
+            data = vars(data)
+        if keys is not None:
+            data = dict((key, data[key]) for key in keys if key in data)
+        return self.encoder.encode(data)
+
+    def render(self, response, keys=None):
+        response.write(self.serialize(response.raw, keys=keys))
@@ -0,0 +1,163 @@
+# coding=utf-8
+import random
+import logging
+import threading
+from .instrumentation import monotonic_clock
+from .utils import LRUCache
+
+__author__ = 'Matt'
+
+
+"""
+Error reporting for the dispatcher exception handlers.
+
+The handlers used to call `logging.exception` for every error. Most 400/403 errors come from bots and scanners, so
+during a flood we spent a lot of time formatting tracebacks that nobody reads. `ErrorReporter` logs a single structured
+line per error instead:
+
+    Encountered client error. route=user_read exception=ClientError status=400 count=1 method=GET error=Invalid uid
+
+The exception message comes last (truncated to `max_error_length`), as it may contain spaces.
+
+Errors are grouped by (route name, exception type):
+
+    - only `rate_limit` errors are logged per group in each `period` (seconds); the rest are counted, and the count is
+      included in the next line that is logged for the group (`suppressed=...`)
+    - a traceback is only included for a sample (`traceback_sample_rate`) of the logged errors, unless the handler
+      asks for it e.g. for server errors
+    - server errors (`always_report`) are always logged; they still count towards the group, but never use up its
+      rate limit or get suppressed
+
+`rate_limits` overrides the rate limit for specific exception classes (and their subclasses), for example
+`{InvalidUserException: 1}`.
+"""
+
+
+class ErrorReporter(object):
+    DEFAULT_RATE_LIMIT = 10
+    DEFAULT_PERIOD = 60
+    DEFAULT_TRACEBACK_SAMPLE_RATE = 0.01
+    DEFAULT_MAX_ERROR_LENGTH = 200
+
+    def __init__(self, rate_limit=DEFAULT_RATE_LIMIT, period=DEFAULT_PERIOD,
+                 traceback_sample_rate=DEFAULT_TRACEBACK_SAMPLE_RATE, rate_limits=None, max_groups=1000, logger=None,
+                 clock=monotonic_clock, randomizer=random.random, max_error_length=DEFAULT_MAX_ERROR_LENGTH):
+        self.rate_limit = rate_limit
+        self.period = period
+        self.traceback_sample_rate = traceback_sample_rate
+        self.rate_limits = rate_limits or {}
+        self.logger = logger or logging.getLogger()
+        self.clock = clock
+        self.randomizer = randomizer
+        self.max_error_length = max_error_length
+        # group key -> [window start, logged in window, suppressed since last log, total]
+        self.groups = LRUCache(max_size=max_groups)
+        self.reported = 0
+        self.suppressed = 0
+        self.always_reported = 0
+        self.sampled = 0
+        self._class_rate_limits = {}
+        self._lock = threading.Lock()
+
+    def rate_limit_for(self, exception_class):
+        try:
+            return self._class_rate_limits[exception_class]
+        except KeyError:
+            pass
+
+        rate_limit = self.rate_limit
+        for klass in exception_class.__mro__:
+            if klass in self.rate_limits:
+                rate_limit = self.rate_limits[klass]
+                break
+
+        self._class_rate_limits[exception_class] = rate_limit
+        return rate_limit
+
+    def report(self, message, exception, request=None, always_sample=False, always_report=False,
+               level=logging.ERROR):
+        """
+        Call from within an exception handler so that the traceback is available. Returns True if the error was logged.
+
+        :param always_sample: Include the traceback.
+        :param always_report: Log the error even if the group is over its rate limit.
+        """
+        if not self.logger.isEnabledFor(level):
+            return False
+
+        exception_class = exception.__class__
+        try:
+            route_name = request.route.name or u'unnamed'
+        except AttributeError:
+            route_name = u'unmatched'
+        key = (route_name, exception_class)
+
+        now = self.clock()
+        with self._lock:
+            group = self.groups.get(key)
+            if group is None:
+                group = [now, 0, 0, 0]
+                self.groups.set(key, group)
+            elif now - group[0] >= self.period:
+                group[0] = now
+                group[1] = 0
+
+            group[3] += 1
+            if always_report:
+                self.always_reported += 1
+            elif group[1] >= self.rate_limit_for(exception_class):
+                group[2] += 1
+                self.suppressed += 1
+                return False
+            else:
+                group[1] += 1
+
+            suppressed, group[2] = group[2], 0
+            count = group[3]
+            self.reported += 1
+
+        sampled = always_sample or self.randomizer() < self.traceback_sample_rate
+        if sampled:
+            with self._lock:
+                self.sampled += 1
+
+        fields = [
+            (u'route', route_name),
+            (u'exception', exception_class.__name__),
+            # ClientError and its subclasses use `response_code`; webob HTTP exceptions use `code`
+            (u'status', getattr(exception, 'response_code', None) or getattr(exception, 'code', None)),
+            (u'count', count),
+        ]
+        if suppressed:
+            fields.append((u'suppressed', suppressed))
+        if request is not None:
+            fields.append((u'method', request.method))
+        fields.append((u'error', self.error_text(exception) or None))
+
+        self.logger.log(level, u'{} {}'.format(message, u' '.join(u'{}={}'.format(name, value)
+                                                                    for name, value in fields if value is not None)),
+                        exc_info=sampled)
+        return True
+
+    def error_text(self, exception):
+        """
+        Returns the exception message on a single line, truncated to `max_error_length`.
+        """
+        try:
+            text = unicode(exception)
+        except UnicodeError:
+            text = str(exception).decode('utf-8', 'replace')
+        text = u' '.join(text.split())
+        if len(text) > self.max_error_length:
+            text = text[:self.max_error_length - 3] + u'...'
+        return text
+
+    def stats(self):
+        with self._lock:
+            return {
+                'reported': self.reported,
+                'suppressed': self.suppressed,
+                'always_reported': self.always_reported,
+                'sampled': self.sampled,
+                'groups': len(self.groups),
+            }
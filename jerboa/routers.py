@@ -0,0 +1,334 @@
+# coding=utf-8
+import re
+import urllib
+import webapp2
+from webob import exc
+from webapp2_extras.routes import PathPrefixRoute
+from .utils import LRUCache
+
+__author__ = 'Matt'
+
+
+"""
+Routers for Jerboa apps.
+
+`JerboaRouter` is the default router for `JerboaApp`. It behaves exactly like the webapp2 router, but it can hold a
+`RouteMatchCache` which is cleared whenever a route is added.
+
+The standard webapp2 router tries each route regex in turn until one matches. That is fine for a handful of routes, but
+with hundreds of generated resources the match time grows with the number of routes. `RadixRouter` compiles the route
+templates into a tree of path segments so that a request only visits the branches that share its path.
+
+Route templates are split on `/`. A segment is either static text or a single variable (`<name>`, `<name:regex>` or
+`<:regex>`). Variables are typed where possible; `<id:\d+>` becomes a digit check rather than a regex match. Any route
+that can't be represented this way (e.g. a variable that spans several segments, `DomainRoute` or a simple tuple route)
+is kept in a fallback list and matched the normal way. The original route order is always respected, so the result is
+exactly what `webapp2.Router.default_matcher` would return.
+"""
+
+
+class RouteMatchCache(LRUCache):
+    """
+    Caches the `(route, args, kwargs)` result of `router.match` for a request. Production traffic tends to hit a small
+    number of distinct paths, so most requests can skip route matching altogether.
+
+    Only successful matches are cached; unknown paths (e.g. from scanners) would otherwise push out the useful entries.
+    """
+    @staticmethod
+    def request_key(request):
+        # Scheme is included as routes may be restricted to certain schemes
+        return request.method, request.scheme, request.host, request.path
+
+
+def match_request(router, request):
+    """
+    Matches the request via `router.match`, using the router match cache if there is one. The kwargs are copied on a
+    cache hit so that handlers can't modify the cached values.
+    """
+    match_cache = getattr(router, 'match_cache', None)
+    if match_cache is None:
+        return router.match(request)
+
+    key = match_cache.request_key(request)
+    rv = match_cache.get(key)
+    if rv is None:
+        rv = router.match(request)
+        if rv is None:
+            return None
+        match_cache.set(key, rv)
+
+    route, args, kwargs = rv
+    return route, args, kwargs.copy()
+
+
+def dispatch_matched_route(router, request, response):
+    """
+    Equivalent to `webapp2.Router.default_dispatcher` for a request that has already been matched, i.e.
+    `request.route`, `request.route_args` and `request.route_kwargs` are set. The default dispatcher always matches the
+    request again, which would undo the saving from the match cache.
+    """
+    route = request.route
+    if route.handler_adapter is None:
+        handler = route.handler
+        if isinstance(handler, basestring):
+            if handler not in router.handlers:
+                router.handlers[handler] = handler = webapp2.import_string(handler)
+            else:
+                handler = router.handlers[handler]
+
+        route.handler_adapter = router.adapt(handler)
+
+    return route.handler_adapter(request, response)
+
+
+class JerboaRouter(webapp2.Router):
+    #: Set to a `RouteMatchCache` to cache the result of matching requests.
+    match_cache = None
+    #: Set to a `jerboa.instrumentation.DispatchTimingCollector` to time each request dispatch.
+    dispatch_timing = None
+    #: Set to a `jerboa.app.DispatcherPipeline` so that the dispatcher only sends hooks with receivers.
+    dispatcher_pipeline = None
+    #: Set to a `jerboa.namespaces.NamespaceResolver` to resolve the request namespace before the request init hook.
+    namespace_resolver = None
+    #: Set to a `jerboa.concurrency.HookThreadPool` to run concurrent pre dispatch receivers in parallel.
+    hook_pool = None
+    #: Set to a `jerboa.reporting.ErrorReporter` to change how the dispatcher exception handlers log errors.
+    error_reporter = None
+    #: Set to a `jerboa.output_cache.OutputCache` to cache the responses of routes with an `output_cache` method config.
+    output_cache = None
+    #: Set to a `jerboa.conditional.ConditionalGet` to add ETags to GET responses and answer `If-None-Match` with a 304.
+    conditional_get = None
+    #: Set to a `jerboa.compression.ResponseCompressor` to compress responses for clients that accept gzip or brotli.
+    compression = None
+
+    def add(self, route):
+        super(JerboaRouter, self).add(route)
+        self.routes_changed()
+
+    def routes_changed(self):
+        if self.match_cache is not None:
+            self.match_cache.clear()
+
+
+_ROUTE_VARIABLE_RE = re.compile(r'^<([a-zA-Z_]\w*)?(?::([^>]*))?>$')
+# Regular expressions that we know can only ever match within a single path segment
+_SEGMENT_SAFE_RE = re.compile(r'^(?:\\d|\\w|\[[^\]\^/\\]*\])(?:\+|\*|\{\d+(?:,\d*)?\})$')
+
+SEGMENT_ANY = 'any'
+SEGMENT_DIGITS = 'digits'
+SEGMENT_REGEX = 'regex'
+
+
+def parse_segment(segment):
+    """
+    Returns `None` for static segments, otherwise a tuple of (variable name, segment type, segment regex). Raises
+    ValueError if the segment can't be matched in isolation.
+    """
+    if '<' not in segment and '>' not in segment:
+        return None
+
+    variable = _ROUTE_VARIABLE_RE.match(segment)
+    if not variable:
+        raise ValueError(u'Segment `{}` mixes static text and variables'.format(segment))
+
+    name, expr = variable.groups()
+    if not expr or expr == '[^/]+':
+        return name, SEGMENT_ANY, None
+    elif expr == r'\d+':
+        return name, SEGMENT_DIGITS, None
+    elif _SEGMENT_SAFE_RE.match(expr):
+        return name, SEGMENT_REGEX, re.compile('^(?:%s)$' % expr)
+
+    raise ValueError(u'Segment `{}` has a regex that may match across segments'.format(segment))
+
+
+def flatten_match_routes(routes):
+    """
+    Expands path prefixed routes into their (already prefixed) children. Any other multi route is left alone as it
+    has its own matching logic e.g. DomainRoute.
+    """
+    for route in routes:
+        if isinstance(route, PathPrefixRoute):
+            for child in flatten_match_routes(route.get_match_children()):
+                yield child
+        else:
+            yield route
+
+
+class RadixNode(object):
+    __slots__ = ('static', 'variables', 'routes')
+
+    def __init__(self):
+        self.static = {}
+        # List of (segment type, segment regex, node). Kept in insertion order.
+        self.variables = []
+        # List of (route index, route, variable names)
+        self.routes = []
+
+    def get_variable_child(self, segment_type, segment_regex):
+        pattern = segment_regex.pattern if segment_regex is not None else None
+        for existing_type, existing_regex, node in self.variables:
+            existing_pattern = existing_regex.pattern if existing_regex is not None else None
+            if existing_type == segment_type and existing_pattern == pattern:
+                return node
+
+        node = RadixNode()
+        self.variables.append((segment_type, segment_regex, node))
+        return node
+
+
+class RadixTree(object):
+    """
+    A tree of route path segments. Use `insert` to add a route and `candidates` to get the routes (in their original
+    order) whose path matches a request path.
+    """
+    def __init__(self):
+        self.root = RadixNode()
+        self.size = 0
+
+    def insert(self, index, route):
+        """
+        Raises ValueError if the route template can't be represented in the tree.
+        """
+        if not isinstance(route, webapp2.Route) or route.build_only:
+            raise ValueError(u'Only standard routes can be compiled')
+
+        node = self.root
+        names = []
+        for segment in route.template.split('/'):
+            parsed = parse_segment(segment)
+            if parsed is None:
+                try:
+                    node = node.static[segment]
+                except KeyError:
+                    child = node.static[segment] = RadixNode()
+                    node = child
+            else:
+                name, segment_type, segment_regex = parsed
+                names.append(name)
+                node = node.get_variable_child(segment_type, segment_regex)
+
+        node.routes.append((index, route, tuple(names)))
+        self.size += 1
+
+    def candidates(self, path):
+        found = []
+        self._collect(self.root, path.split('/'), 0, [], found)
+        if len(found) > 1:
+            found.sort(key=lambda candidate: candidate[0])
+        return found
+
+    def _collect(self, node, segments, position, values, found):
+        if position == len(segments):
+            for index, route, names in node.routes:
+                found.append((index, route, names, tuple(values)))
+            return
+
+        segment = segments[position]
+        try:
+            child = node.static[segment]
+        except KeyError:
+            pass
+        else:
+            self._collect(child, segments, position + 1, values, found)
+
+        for segment_type, segment_regex, child in node.variables:
+            if segment_type == SEGMENT_ANY:
+                if not segment:
+                    continue
+            elif segment_type == SEGMENT_DIGITS:
+                if not segment.isdigit():
+                    continue
+            elif segment_type == SEGMENT_REGEX:
+                if not segment_regex.match(segment):
+                    continue
+
+            values.append(segment)
+            self._collect(child, segments, position + 1, values, found)
+            values.pop()
+
+
+def build_route_variables(route, names, values):
+    """
+    Mirrors `webapp2._get_route_variables`; named variables become kwargs and unnamed variables become args.
+    """
+    kwargs = route.defaults.copy()
+    args = []
+    for name, value in zip(names, values):
+        if name:
+            kwargs[name] = value
+        else:
+            args.append(value)
+
+    return tuple(args), kwargs
+
+
+class RadixRouter(JerboaRouter):
+    """
+    Drop in replacement for `webapp2.Router` that matches routes using a `RadixTree`. The tree is compiled lazily the
+    first time a request is matched after routes have been added.
+
+    `match` returns the same `(route, args, kwargs)` tuple, and raises the same exceptions, as the default matcher.
+    """
+    def __init__(self, routes=None):
+        # Tuple of (tree, fallback routes), replaced as a whole so that concurrent requests see a consistent pair
+        self._compiled = None
+        super(RadixRouter, self).__init__(routes=routes)
+
+    def routes_changed(self):
+        super(RadixRouter, self).routes_changed()
+        self._compiled = None
+
+    def compile(self):
+        tree = RadixTree()
+        fallback_routes = []
+        for index, route in enumerate(flatten_match_routes(self.match_routes)):
+            try:
+                tree.insert(index, route)
+            except ValueError:
+                fallback_routes.append((index, route))
+
+        self._compiled = tree, fallback_routes
+        return self._compiled
+
+    def match(self, request):
+        compiled = self._compiled
+        if compiled is None:
+            compiled = self.compile()
+
+        tree, fallback_routes = compiled
+        candidates = tree.candidates(urllib.unquote(request.path))
+        method_not_allowed = False
+        fallback_position = 0
+        for index, route, names, values in candidates:
+            # Any fallback route that was added before this candidate takes precedence
+            while fallback_position < len(fallback_routes) and fallback_routes[fallback_position][0] < index:
+                try:
+                    rv = fallback_routes[fallback_position][1].match(request)
+                    if rv:
+                        return rv
+                except exc.HTTPMethodNotAllowed:
+                    method_not_allowed = True
+                fallback_position += 1
+
+            if route.schemes and request.scheme not in route.schemes:
+                continue
+            if route.methods and request.method not in route.methods:
+                method_not_allowed = True
+                continue
+
+            args, kwargs = build_route_variables(route=route, names=names, values=values)
+            return route, args, kwargs
+
+        for index, route in fallback_routes[fallback_position:]:
+            try:
+                rv = route.match(request)
+                if rv:
+                    return rv
+            except exc.HTTPMethodNotAllowed:
+                method_not_allowed = True
+
+        if method_not_allowed:
+            raise exc.HTTPMethodNotAllowed()
+
+        raise exc.HTTPNotFound()
@@ -0,0 +1,143 @@
+# coding=utf-8
+import os
+import sys
+import json
+import hashlib
+import argparse
+import importlib
+import jinja2
+from jinja2 import ModuleLoader, TemplateSyntaxError
+from .renderers import Jinja2Renderer
+
+__author__ = 'Matt'
+
+
+"""
+Ahead of time template compilation.
+
+Run this as part of your deploy to compile every template in `theme_base_template_path` into a package of Python
+modules:
+
+    python -m jerboa.template_compiler main:jinja_config build/compiled_templates
+
+`main:jinja_config` is the renderer config that your app uses, so the templates are compiled with the same extensions
+and options. Then point the renderer at the output:
+
+    jinja_config['compiled_templates'] = 'build/compiled_templates'
+
+The renderer then loads the templates through a `jinja2.ModuleLoader`, so there is no template parsing, compilation or
+file `stat` calls when an instance starts.
+
+The build fails if any template has a syntax error; every error is reported, not just the first. A `manifest.json` is
+written alongside the modules, listing each template, its module and a checksum of its source.
+"""
+
+
+MANIFEST_FILENAME = 'manifest.json'
+
+
+class TemplateCompilationError(Exception):
+    def __init__(self, errors):
+        self.errors = errors
+        details = [u'  {}:{}: {}'.format(error.name or error.filename, error.lineno, error.message) for error in errors]
+        super(TemplateCompilationError, self).__init__(u'{} template(s) failed to compile:\n{}'.format(
+            len(errors), u'\n'.join(details)))
+
+
+def build_compile_environment(renderer_config):
+    """
+    Builds the environment in the same way as `Jinja2Renderer`, but always loads templates from source.
+    """
+    config = dict(renderer_config)
+    config.pop('type', None)
+    config.pop('compiled_templates', None)
+    config.pop('bytecode_cache', None)
+    config['environment_args'] = dict(config.get('environment_args', {}))
+    config.setdefault('enable_i18n', False)
+
+    return Jinja2Renderer(config=config).environment
+
+
+def compile_templates(environment, target, extensions=None, py_compile=False):
+    """
+    Compiles every template that the environment loader can find into `target`. Returns the manifest.
+
+    :param environment: A jinja2 environment with a loader that can list its templates e.g. `FileSystemLoader`.
+    :param target: Output directory. It becomes a package, so it can also be imported or zipped.
+    :param extensions: Only compile templates with these file extensions e.g. `['html', 'txt']`.
+    :param py_compile: Also write byte compiled `.pyc` files, for runtimes that can't write them.
+    :raises TemplateCompilationError: If any template fails to compile. Nothing is written in this case.
+    """
+    compiled = []
+    errors = []
+    for name in environment.list_templates(extensions=extensions):
+        source, filename, _ = environment.loader.get_source(environment, name)
+        try:
+            code = environment.compile(source, name, filename, raw=True, defer_init=True)
+        except TemplateSyntaxError, e:
+            errors.append(e)
+        else:
+            compiled.append((name, source, code))
+
+    if errors:
+        raise TemplateCompilationError(errors)
+
+    if not os.path.isdir(target):
+        os.makedirs(target)
+
+    with open(os.path.join(target, '__init__.py'), 'w') as init_file:
+        init_file.write('# Generated by jerboa.template_compiler; do not edit\n')
+
+    manifest = {
+        'jinja2_version': jinja2.__version__,
+        'templates': {},
+    }
+    for name, source, code in compiled:
+        module_filename = ModuleLoader.get_module_filename(name)
+        module_path = os.path.join(target, module_filename)
+        with open(module_path, 'wb') as module_file:
+            module_file.write(code.encode('utf-8') if isinstance(code, unicode) else code)
+
+        if py_compile:
+            import py_compile as compiler
+            compiler.compile(module_path, doraise=True)
+
+        manifest['templates'][name] = {
+            'module': ModuleLoader.get_template_key(name),
+            'checksum': hashlib.sha1(source.encode('utf-8')).hexdigest(),
+        }
+
+    with open(os.path.join(target, MANIFEST_FILENAME), 'w') as manifest_file:
+        json.dump(manifest, manifest_file, indent=2, sort_keys=True)
+
+    return manifest
+
+
+def load_renderer_config(path):
+    module_name, attribute = path.split(':', 1)
+    return getattr(importlib.import_module(module_name), attribute)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=u'Compile Jinja2 templates into a Python module package.')
+    parser.add_argument('renderer_config', help=u'The renderer config to compile with, as `module:attribute`')
+    parser.add_argument('target', help=u'Output directory for the compiled templates')
+    parser.add_argument('--extension', action='append', dest='extensions',
+                        help=u'Only compile templates with this file extension. Can be repeated.')
+    parser.add_argument('--py-compile', action='store_true', help=u'Also write .pyc files')
+    args = parser.parse_args(argv)
+
+    environment = build_compile_environment(load_renderer_config(args.renderer_config))
+    try:
+        manifest = compile_templates(environment=environment, target=args.target, extensions=args.extensions,
+                                     py_compile=args.py_compile)
+    except TemplateCompilationError, e:
+        sys.stderr.write(u'{}\n'.format(e).encode('utf-8'))
+        return 1
+
+    sys.stdout.write('Compiled {} template(s) into {}\n'.format(len(manifest['templates']), args.target))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
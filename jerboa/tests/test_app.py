@@ -22,6 +22,11 @@
     :copyright: (c) 2015 Lighthouse
     :license: LGPL
 """
+import os
+import zlib
+import shutil
+import logging
+import tempfile
 import unittest
 from google.appengine.ext import testbed
 import webapp2
@@ -29,6 +34,14 @@ from webapp2 import Route
 from blinker import signal
 from jerboa.renderers import Jinja2Renderer
 from jerboa.app import *
+from jerboa.namespaces import *
+from jerboa.concurrency import HookThreadPool, concurrent_receiver
+from jerboa import instrumentation
+from jerboa.reporting import ErrorReporter
+from jerboa.output_cache import OutputCache, route_output_cache_config
+from jerboa.compression import ResponseCompressor
+from jerboa.conditional import ConditionalGet, ETAG_VERSION_HOOK
+from jerboa.utils import LocalMemcacheClient
 
 __author__ = 'Matt Badger'
 
@@ -491,3 +504,883 @@ class TestSearchFormHandlerHooks(unittest.TestCase):
         self.assertEqual(response.status_int, 302)
         self.assertEquals(signal_tester.hook_activations[handler]['ui_failed'], 1,
                           u'Handler should trigger `ui_failed` hook 1 time(s)')
+
+
+class TestHandlerDispatchTable(unittest.TestCase):
+    def setUp(self):
+        app = webapp2.WSGIApplication(debug=True)
+        app.router.set_dispatcher(custom_dispatcher)
+        app.router.set_adapter(custom_adapter)
+        app.router.add(RedirectRoute('/table/test', handler=default_route_signaler, name='dispatch_table_test'))
+        app.handler_dispatch_table = HandlerDispatchTable(methods=['GET'])
+        app.handler_dispatch_table.build(route_names=['dispatch_table_test'])
+        self.app = app
+
+        self.testbed = testbed.Testbed()
+        self.testbed.activate()
+
+    def tearDown(self):
+        self.testbed.deactivate()
+
+    def test_table_tracks_receivers(self):
+        def receiver(request, response):
+            pass
+
+        table = self.app.handler_dispatch_table
+        self.assertEqual(table[('dispatch_table_test', 'GET')], (), u'Table should start without receivers')
+
+        signal(u'dispatch_table_test_http_get').connect(receiver)
+        self.assertEqual(table[('dispatch_table_test', 'GET')], (receiver,), u'Table should pick up new receivers')
+
+        signal(u'dispatch_table_test_http_get').disconnect(receiver)
+        self.assertEqual(table[('dispatch_table_test', 'GET')], (), u'Table should drop disconnected receivers')
+
+    def test_signaler_uses_table(self):
+        activations = []
+
+        def receiver(request, response):
+            activations.append(request.route.name)
+
+        signal(u'dispatch_table_test_http_get').connect(receiver)
+        try:
+            request = webapp2.Request.blank('/table/test')
+            response = request.get_response(self.app)
+        finally:
+            signal(u'dispatch_table_test_http_get').disconnect(receiver)
+
+        self.assertEqual(response.status_int, 200)
+        self.assertEqual(activations, ['dispatch_table_test'], u'Receiver should be called once via the table')
+
+
+class TestDispatchTiming(unittest.TestCase):
+    def setUp(self):
+        app = webapp2.WSGIApplication(debug=True)
+        app.router.set_dispatcher(custom_dispatcher)
+        app.router.set_adapter(custom_adapter)
+        app.router.add(RedirectRoute('/timing/test', handler=default_route_signaler, name='dispatch_timing_test'))
+        app.router.dispatch_timing = DispatchTimingCollector()
+        self.app = app
+
+        self.testbed = testbed.Testbed()
+        self.testbed.activate()
+
+    def tearDown(self):
+        self.testbed.deactivate()
+
+    def test_server_timing_header(self):
+        def timed_pre_hook(sender, request, response):
+            pass
+
+        CUSTOM_DISPATCHER_PRE_HOOK.connect(timed_pre_hook, sender=self.app.router)
+        try:
+            request = webapp2.Request.blank('/timing/test')
+            response = request.get_response(self.app)
+        finally:
+            CUSTOM_DISPATCHER_PRE_HOOK.disconnect(timed_pre_hook, sender=self.app.router)
+
+        self.assertEqual(response.status_int, 200)
+        server_timing = response.headers['Server-Timing']
+        for metric in ['route_match;', 'handler_dispatch;', 'pre_dispatch_request_hook.timed_pre_hook;', 'total;']:
+            self.assertTrue(metric in server_timing, u'Server-Timing should include `{}`'.format(metric))
+
+    def test_histograms(self):
+        for _ in range(3):
+            webapp2.Request.blank('/timing/test').get_response(self.app)
+
+        snapshot = self.app.router.dispatch_timing.snapshot()
+        self.assertEqual(snapshot[('dispatch_timing_test', 'total')]['count'], 3)
+        self.assertEqual(snapshot[('dispatch_timing_test', 'route_match')]['buckets'][-1][1], 3,
+                         u'The +Inf bucket should count every request')
+        self.assertTrue('jerboa_dispatch_duration_ms_count{route="dispatch_timing_test",stage="total"} 3'
+                        in self.app.router.dispatch_timing.render_text())
+
+    def test_clock_set_back(self):
+        # Off Python 3 the clock may be the system clock, which can be set back during a request
+        readings = iter([100.0, 100.5, 99.0, 99.25])
+        previous_clock = instrumentation.monotonic_clock
+        instrumentation.monotonic_clock = lambda: next(readings)
+        try:
+            timer = instrumentation.RequestTimer()
+            timer.mark('route_match')
+            timer.mark('handler_dispatch')
+            total = timer.total
+        finally:
+            instrumentation.monotonic_clock = previous_clock
+
+        self.assertEqual(timer.stages, [('route_match', 0.5), ('handler_dispatch', 0.0)],
+                         u'Durations should never be negative')
+        self.assertEqual(total, 0.0)
+
+
+class TestMatchCacheDispatch(unittest.TestCase):
+    def setUp(self):
+        app = webapp2.WSGIApplication(debug=True)
+        app.router.set_dispatcher(custom_dispatcher)
+        app.router.set_adapter(custom_adapter)
+        self.route = RedirectRoute('/match/test', handler=default_route_signaler, name='match_cache_test')
+        app.router.add(self.route)
+        app.router.match_cache = RouteMatchCache()
+        self.app = app
+
+        self.testbed = testbed.Testbed()
+        self.testbed.activate()
+
+    def tearDown(self):
+        self.testbed.deactivate()
+
+    def test_cached_match_is_not_repeated(self):
+        match_calls = []
+        route_match = self.route.match
+
+        def counting_match(request):
+            match_calls.append(request.path)
+            return route_match(request)
+
+        self.route.match = counting_match
+        for _ in range(3):
+            response = webapp2.Request.blank('/match/test').get_response(self.app)
+            self.assertEqual(response.status_int, 200)
+
+        self.assertEqual(len(match_calls), 1, u'Only the first request should match the route')
+        self.assertEqual(self.app.router.match_cache.stats()['hits'], 2)
+
+
+class TestDispatcherPipeline(unittest.TestCase):
+    def setUp(self):
+        app = webapp2.WSGIApplication(debug=True)
+        app.router.set_dispatcher(custom_dispatcher)
+        app.router.set_adapter(custom_adapter)
+        app.router.add(RedirectRoute('/pipeline/test', handler=default_route_signaler, name='dispatcher_pipeline_test'))
+        app.router.dispatcher_pipeline = DispatcherPipeline(router=app.router)
+        self.app = app
+
+        self.testbed = testbed.Testbed()
+        self.testbed.activate()
+
+    def tearDown(self):
+        self.testbed.deactivate()
+
+    def test_pipeline_recompiles(self):
+        pipeline = self.app.router.dispatcher_pipeline
+        activations = []
+
+        def pre_hook(sender, request, response):
+            activations.append(sender)
+
+        self.assertFalse(CUSTOM_DISPATCHER_PRE_HOOK.name in pipeline.stages,
+                         u'Hooks without receivers should not be in the pipeline')
+
+        CUSTOM_DISPATCHER_PRE_HOOK.connect(pre_hook, sender=self.app.router)
+        try:
+            self.assertTrue(CUSTOM_DISPATCHER_PRE_HOOK.name in pipeline.stages,
+                            u'Connecting a receiver should add the hook to the pipeline')
+
+            response = webapp2.Request.blank('/pipeline/test').get_response(self.app)
+            self.assertEqual(response.status_int, 200)
+            self.assertEqual(activations, [self.app.router], u'Pre hook should be sent once')
+        finally:
+            CUSTOM_DISPATCHER_PRE_HOOK.disconnect(pre_hook, sender=self.app.router)
+
+        self.assertFalse(CUSTOM_DISPATCHER_PRE_HOOK.name in pipeline.stages,
+                         u'Disconnecting the receiver should remove the hook from the pipeline')
+
+    def test_other_router_receivers_are_ignored(self):
+        other_router = webapp2.Router()
+
+        def pre_hook(sender, request, response):
+            pass
+
+        CUSTOM_DISPATCHER_PRE_HOOK.connect(pre_hook, sender=other_router)
+        try:
+            self.assertFalse(CUSTOM_DISPATCHER_PRE_HOOK.name in self.app.router.dispatcher_pipeline.stages,
+                             u'Receivers for a different router should not add the hook')
+        finally:
+            CUSTOM_DISPATCHER_PRE_HOOK.disconnect(pre_hook, sender=other_router)
+
+
+class TestNamespaceResolver(unittest.TestCase):
+    def setUp(self):
+        self.lookups = []
+
+        def tenant_lookup(key):
+            self.lookups.append(key)
+            return {'acme': 'acme_ns'}.get(key)
+
+        self.namespace_manager = LocalNamespaceManager()
+        self.resolver = NamespaceResolver(strategy=HostNamespaceStrategy(subdomain=True), lookup=tenant_lookup,
+                                          namespace_manager=self.namespace_manager)
+
+        app = webapp2.WSGIApplication(debug=True)
+        app.router.set_dispatcher(custom_dispatcher)
+        app.router.set_adapter(custom_adapter)
+        app.router.add(RedirectRoute('/namespace/test', handler=default_route_signaler, name='namespace_test'))
+        app.router.namespace_resolver = self.resolver
+        self.app = app
+
+        self.testbed = testbed.Testbed()
+        self.testbed.activate()
+
+    def tearDown(self):
+        self.testbed.deactivate()
+
+    def test_namespace_resolved_and_cached(self):
+        namespaces = []
+
+        def record_namespace(request, response, **kwargs):
+            namespaces.append((request.namespace, self.namespace_manager.get_namespace()))
+
+        signal('namespace_test_http_get').connect(record_namespace)
+        try:
+            for _ in range(2):
+                response = webapp2.Request.blank('/namespace/test', base_url='http://acme.example.com').get_response(
+                    self.app)
+                self.assertEqual(response.status_int, 200)
+        finally:
+            signal('namespace_test_http_get').disconnect(record_namespace)
+
+        self.assertEqual(namespaces, [('acme_ns', 'acme_ns'), ('acme_ns', 'acme_ns')],
+                         u'Handler should run in the resolved namespace')
+        self.assertEqual(self.lookups, ['acme'], u'Namespace lookup should be cached')
+        self.assertEqual(self.namespace_manager.get_namespace(), '', u'Namespace should be restored after the request')
+
+    def test_unknown_tenant_uses_default_namespace(self):
+        response = webapp2.Request.blank('/namespace/test', base_url='http://other.example.com').get_response(self.app)
+        self.assertEqual(response.status_int, 200)
+        self.assertEqual(self.namespace_manager.set_count, 0, u'Default namespace should not be set')
+
+    def test_unchanged_namespace_is_not_set(self):
+        self.namespace_manager.set_namespace('acme_ns')
+        self.namespace_manager.set_count = 0
+
+        webapp2.Request.blank('/namespace/test', base_url='http://acme.example.com').get_response(self.app)
+        self.assertEqual(self.namespace_manager.set_count, 0, u'Namespace should not be set when it is unchanged')
+
+    def test_strategies(self):
+        request = webapp2.Request.blank('/acme/company/overview', base_url='http://Acme.Example.com:8080',
+                                        headers={'X-Tenant': 'acme'})
+        self.assertEqual(HostNamespaceStrategy().key_for(request), 'acme.example.com')
+        self.assertEqual(HostNamespaceStrategy(subdomain=True).key_for(request), 'acme')
+        self.assertEqual(PathPrefixNamespaceStrategy().key_for(request), 'acme')
+        self.assertEqual(HeaderNamespaceStrategy().key_for(request), 'acme')
+        self.assertEqual(HeaderNamespaceStrategy().key_for(webapp2.Request.blank('/')), None)
+
+    def test_client_controlled_keys(self):
+        self.assertRaises(ValueError, NamespaceResolver, strategy=HeaderNamespaceStrategy(),
+                          namespace_manager=self.namespace_manager)
+        self.assertRaises(ValueError, NamespaceResolver, strategy=PathPrefixNamespaceStrategy(),
+                          namespace_manager=self.namespace_manager)
+        self.assertRaises(ValueError, NamespaceResolver, strategy=HostNamespaceStrategy(),
+                          namespace_manager=self.namespace_manager)
+
+        trusted = NamespaceResolver(strategy=HostNamespaceStrategy(subdomain=True), trust_keys=True,
+                                    namespace_manager=self.namespace_manager)
+        self.assertEqual(trusted.resolve(webapp2.Request.blank('/', base_url='http://acme.example.com')), 'acme')
+
+        resolver = NamespaceResolver(strategy=HeaderNamespaceStrategy(), lookup=frozenset(['acme']),
+                                     namespace_manager=self.namespace_manager)
+        for tenant, namespace in [('acme', 'acme'), ('other', 'default'), ('bad tenant!', 'default')]:
+            request = webapp2.Request.blank('/', headers={'X-Tenant': tenant})
+            self.assertEqual(resolver.resolve(request), namespace)
+        self.assertFalse('bad tenant!' in resolver.namespaces, u'Invalid keys should not be cached')
+
+    def test_least_recently_used_tenant_is_dropped(self):
+        def tenant_lookup(key):
+            self.lookups.append(key)
+            return key
+
+        resolver = NamespaceResolver(strategy=HeaderNamespaceStrategy(), lookup=tenant_lookup, cache_size=2,
+                                     namespace_manager=self.namespace_manager)
+        for tenant in ['acme', 'globex', 'acme', 'initech', 'acme']:
+            resolver.resolve(webapp2.Request.blank('/', headers={'X-Tenant': tenant}))
+        self.assertEqual(self.lookups, ['acme', 'globex', 'initech'],
+                         u'Only the least recently used tenant should be dropped when the cache is full')
+
+    def test_invalid_namespace(self):
+        self.resolver = NamespaceResolver(strategy=HostNamespaceStrategy(subdomain=True),
+                                          lookup={'acme': 'acme ns'}, namespace_manager=self.namespace_manager)
+        self.app.router.namespace_resolver = self.resolver
+
+        response = webapp2.Request.blank('/namespace/test', base_url='http://acme.example.com').get_response(self.app)
+        self.assertEqual(response.status_int, 200)
+        self.assertEqual(self.namespace_manager.set_count, 0, u'Invalid namespaces should use the default namespace')
+
+
+class TestStreamedTemplate(unittest.TestCase):
+    def setUp(self):
+        self.template_path = tempfile.mkdtemp()
+        with open(os.path.join(self.template_path, 'stream.html'), 'w') as template_file:
+            template_file.write('{% cache "nav" %}<nav>{{ tenant }}</nav>{% endcache %}'
+                                '{% for row in rows %}<li>{{ _("Row") }} {{ row }} {{ current_namespace() }}</li>'
+                                '{% endfor %}')
+
+        self.namespace_manager = LocalNamespaceManager()
+        renderer = Jinja2Renderer(config={
+            'environment_args': {'extensions': ['jinja2.ext.i18n']},
+            'theme_base_template_path': [self.template_path],
+            'enable_i18n': True,
+            'global_vars': {'current_namespace': self.namespace_manager.get_namespace},
+        })
+        self.previous_renderer = AppRegistry.renderers.get('default')
+        AppRegistry.renderers['default'] = renderer
+
+        app = webapp2.WSGIApplication(debug=True)
+        app.router.set_dispatcher(custom_dispatcher)
+        app.router.set_adapter(custom_adapter)
+        route = RedirectRoute('/stream/test', handler=default_route_signaler, name='stream_test')
+        route.method_config = {'page_template': 'stream.html', 'stream_template': True, 'stream_buffer_size': 2}
+        app.router.add(route)
+        app.router.namespace_resolver = NamespaceResolver(strategy=HostNamespaceStrategy(subdomain=True),
+                                                          lookup={'acme': 'acme_ns', 'globex': 'globex_ns'},
+                                                          namespace_manager=self.namespace_manager)
+        CUSTOM_DISPATCHER_POST_PROCESS_RESPONSE_HOOK.connect(default_post_request_hook, sender=app.router)
+        signal('stream_test_http_get').connect(self.handler)
+        self.app = app
+
+        self.testbed = testbed.Testbed()
+        self.testbed.activate()
+
+    def tearDown(self):
+        signal('stream_test_http_get').disconnect(self.handler)
+        CUSTOM_DISPATCHER_POST_PROCESS_RESPONSE_HOOK.disconnect(default_post_request_hook, sender=self.app.router)
+        if self.previous_renderer is None:
+            AppRegistry.renderers.pop('default', None)
+        else:
+            AppRegistry.renderers['default'] = self.previous_renderer
+        shutil.rmtree(self.template_path)
+        self.testbed.deactivate()
+
+    @staticmethod
+    def handler(request, response, **kwargs):
+        response.raw.tenant = request.namespace
+        response.raw.rows = [1, 2]
+
+    def get(self, tenant):
+        request = webapp2.Request.blank('/stream/test', base_url='http://{}.example.com'.format(tenant))
+        statuses = []
+        app_iter = self.app(request.environ, lambda status, headers, exc_info=None: statuses.append(status))
+        # Like a WSGI server, only consume the body once the app has returned
+        self.assertRaises(AssertionError, webapp2.get_request)
+        try:
+            body = b''.join(app_iter)
+        finally:
+            if hasattr(app_iter, 'close'):
+                app_iter.close()
+        return statuses[0], body
+
+    def test_chunks_render_in_request_context(self):
+        self.assertEqual(self.get('acme'), ('200 OK', '<nav>acme_ns</nav><li>Row 1 acme_ns</li><li>Row 2 acme_ns</li>'))
+        self.assertEqual(self.get('globex'),
+                         ('200 OK', '<nav>globex_ns</nav><li>Row 1 globex_ns</li><li>Row 2 globex_ns</li>'),
+                         u'Cached fragments should vary on the namespace of the streamed request')
+        self.assertEqual(self.namespace_manager.get_namespace(), '', u'Namespace should be restored after each chunk')
+        self.assertRaises(AssertionError, webapp2.get_request)
+
+
+class TestConcurrentPreHooks(unittest.TestCase):
+    def setUp(self):
+        app = webapp2.WSGIApplication(debug=True)
+        app.router.set_dispatcher(custom_dispatcher)
+        app.router.set_adapter(custom_adapter)
+        app.router.add(RedirectRoute('/concurrent/test', handler=default_route_signaler, name='concurrent_test'))
+        app.router.hook_pool = HookThreadPool(max_workers=4)
+        self.app = app
+
+        self.testbed = testbed.Testbed()
+        self.testbed.activate()
+
+    def tearDown(self):
+        self.testbed.deactivate()
+
+    def test_receivers_run_concurrently(self):
+        import threading
+        # Each receiver waits for the other, so this can only pass if they run at the same time
+        user_started, settings_started = threading.Event(), threading.Event()
+
+        @concurrent_receiver
+        def load_user(sender, request, response):
+            user_started.set()
+            settings_started.wait(5)
+            request.loaded_user = settings_started.is_set()
+
+        @concurrent_receiver
+        def load_settings(sender, request, response):
+            settings_started.set()
+            user_started.wait(5)
+            request.loaded_settings = user_started.is_set()
+
+        loaded = []
+
+        def record_request(request, response, **kwargs):
+            loaded.append((request.loaded_user, request.loaded_settings))
+
+        CUSTOM_DISPATCHER_PRE_HOOK.connect(load_user, sender=self.app.router)
+        CUSTOM_DISPATCHER_PRE_HOOK.connect(load_settings, sender=self.app.router)
+        signal('concurrent_test_http_get').connect(record_request)
+        try:
+            response = webapp2.Request.blank('/concurrent/test').get_response(self.app)
+        finally:
+            CUSTOM_DISPATCHER_PRE_HOOK.disconnect(load_user, sender=self.app.router)
+            CUSTOM_DISPATCHER_PRE_HOOK.disconnect(load_settings, sender=self.app.router)
+            signal('concurrent_test_http_get').disconnect(record_request)
+
+        self.assertEqual(response.status_int, 200)
+        self.assertEqual(loaded, [(True, True)], u'Handler should run after every pre hook receiver')
+
+    def test_exceptions_are_routed(self):
+        @concurrent_receiver
+        def check_user(sender, request, response):
+            raise UnauthorizedUserException()
+
+        @concurrent_receiver
+        def check_feature_flags(sender, request, response):
+            pass
+
+        triggered = []
+
+        def record_request(request, response, **kwargs):
+            triggered.append(request)
+
+        CUSTOM_DISPATCHER_PRE_HOOK.connect(check_user, sender=self.app.router)
+        CUSTOM_DISPATCHER_PRE_HOOK.connect(check_feature_flags, sender=self.app.router)
+        signal('concurrent_test_http_get').connect(record_request)
+        try:
+            response = webapp2.Request.blank('/concurrent/test').get_response(self.app)
+        finally:
+            CUSTOM_DISPATCHER_PRE_HOOK.disconnect(check_user, sender=self.app.router)
+            CUSTOM_DISPATCHER_PRE_HOOK.disconnect(check_feature_flags, sender=self.app.router)
+            signal('concurrent_test_http_get').disconnect(record_request)
+
+        self.assertEqual(response.status_int, 403, u'Exception should be handled by the dispatcher')
+        self.assertEqual(triggered, [], u'Handler should not run when a pre hook receiver fails')
+
+    def test_receivers_see_request_globals(self):
+        import threading
+        seen = []
+
+        @concurrent_receiver
+        def load_user(sender, request, response):
+            seen.append((webapp2.get_request() == request, threading.current_thread().name))
+
+        @concurrent_receiver
+        def load_settings(sender, request, response):
+            seen.append((webapp2.get_request() == request, threading.current_thread().name))
+
+        CUSTOM_DISPATCHER_PRE_HOOK.connect(load_user, sender=self.app.router)
+        CUSTOM_DISPATCHER_PRE_HOOK.connect(load_settings, sender=self.app.router)
+        try:
+            response = webapp2.Request.blank('/concurrent/test').get_response(self.app)
+        finally:
+            CUSTOM_DISPATCHER_PRE_HOOK.disconnect(load_user, sender=self.app.router)
+            CUSTOM_DISPATCHER_PRE_HOOK.disconnect(load_settings, sender=self.app.router)
+
+        self.assertEqual(response.status_int, 200)
+        self.assertEqual([same for same, _ in seen], [True, True], u'Receivers should see the current request')
+        hook_threads = [thread for thread in threading.enumerate()
+                        if thread.name in set(name for _, name in seen)]
+        self.assertEqual(hook_threads, [], u'Hook threads should not outlive the request')
+
+
+class TestErrorReporter(unittest.TestCase):
+    def setUp(self):
+        self.records = []
+        test = self
+
+        class RecordingHandler(logging.Handler):
+            def emit(self, record):
+                test.records.append(record)
+
+        self.logger = logging.getLogger('jerboa.tests.error_reporter')
+        self.logger.propagate = False
+        self.logger.setLevel(logging.DEBUG)
+        self.handler = RecordingHandler()
+        self.logger.addHandler(self.handler)
+        self.now = [0]
+        self.reporter = ErrorReporter(rate_limit=2, period=60, traceback_sample_rate=0, logger=self.logger,
+                                      clock=lambda: self.now[0], rate_limits={InvalidUserException: 1})
+
+        app = webapp2.WSGIApplication(debug=True)
+        app.router.set_dispatcher(custom_dispatcher)
+        app.router.set_adapter(custom_adapter)
+        app.router.add(RedirectRoute('/errors/test', handler=default_route_signaler, name='errors_test'))
+        app.router.error_reporter = self.reporter
+        self.app = app
+
+        self.testbed = testbed.Testbed()
+        self.testbed.activate()
+
+    def tearDown(self):
+        self.logger.removeHandler(self.handler)
+        self.testbed.deactivate()
+
+    def raise_in_handler(self, exception_class, count):
+        def failing_handler(request, response, **kwargs):
+            raise exception_class()
+
+        signal('errors_test_http_get').connect(failing_handler)
+        try:
+            return [webapp2.Request.blank('/errors/test').get_response(self.app).status_int for _ in range(count)]
+        finally:
+            signal('errors_test_http_get').disconnect(failing_handler)
+
+    def test_rate_limited_by_route_and_exception(self):
+        self.assertEqual(self.raise_in_handler(UnauthorizedUserException, 5), [403] * 5)
+        self.assertEqual(len(self.records), 2, u'Only the first errors in the period should be logged')
+        self.assertTrue(u'route=errors_test exception=UnauthorizedUserException status=403' in
+                        self.records[0].getMessage())
+        self.assertFalse(self.records[0].exc_info, u'Traceback should only be included when sampled')
+
+        self.raise_in_handler(InvalidUserException, 2)
+        self.assertEqual(len(self.records), 3, u'Each exception class should have a separate limit')
+
+        self.now[0] = 61
+        self.raise_in_handler(UnauthorizedUserException, 1)
+        self.assertEqual(len(self.records), 4)
+        self.assertTrue(u'suppressed=3' in self.records[-1].getMessage(),
+                        u'Suppressed errors should be counted in the next report')
+        self.assertEqual(self.reporter.stats()['suppressed'], 4)
+
+    def test_error_message_is_logged(self):
+        self.raise_in_handler(UnauthorizedUserException, 1)
+        self.assertFalse(self.records[0].exc_info)
+        self.assertTrue(self.records[0].getMessage().endswith(
+            u'method=GET error=User is valid but does not have permission to execute this request'))
+
+        self.reporter.max_error_length = 20
+        self.assertEqual(self.reporter.error_text(ValueError(u'Invalid key\n' + u'x' * 50)), u'Invalid key xxxxx...')
+
+    def test_server_errors_include_traceback(self):
+        self.assertEqual(self.raise_in_handler(ApplicationError, 1), [500])
+        self.assertTrue(self.records[0].exc_info, u'Server errors should always include the traceback')
+
+    def test_server_errors_are_not_rate_limited(self):
+        self.assertEqual(self.raise_in_handler(ApplicationError, 5), [500] * 5)
+        self.assertEqual(len(self.records), 5, u'Every server error should be logged')
+        self.assertEqual(self.reporter.stats()['suppressed'], 0)
+        self.assertEqual(self.reporter.stats()['always_reported'], 5)
+        self.assertTrue(u'count=5' in self.records[-1].getMessage())
+
+        self.raise_in_handler(BaseAppException, 5)
+        self.assertEqual(len(self.records), 10, u'Unhandled exceptions should always be logged')
+
+    def test_disabled_level_is_skipped(self):
+        self.logger.setLevel(logging.CRITICAL)
+        self.raise_in_handler(UnauthorizedUserException, 1)
+        self.assertEqual(self.records, [])
+        self.assertEqual(self.reporter.stats()['reported'], 0)
+
+
+class TestOutputCache(unittest.TestCase):
+    def setUp(self):
+        self.now = [1000.0]
+        clock = lambda: self.now[0]
+        self.output_cache = OutputCache(backend=LocalMemcacheClient(clock=clock), clock=clock)
+
+        app = webapp2.WSGIApplication(debug=True)
+        app.router.set_dispatcher(custom_dispatcher)
+        app.router.set_adapter(custom_adapter)
+        route = RedirectRoute('/cached/test', handler=default_route_signaler, name='cached_test')
+        route.method_config = {
+            'output_cache': {'ttl': 60, 'vary_params': ['page'], 'stale_while_revalidate': 30},
+        }
+        app.router.add(route)
+        app.router.output_cache = self.output_cache
+        self.app = app
+
+        self.handled = []
+        signal('cached_test_http_get').connect(self.handler)
+
+        self.testbed = testbed.Testbed()
+        self.testbed.activate()
+
+    def tearDown(self):
+        signal('cached_test_http_get').disconnect(self.handler)
+        self.testbed.deactivate()
+
+    def handler(self, request, response, **kwargs):
+        self.handled.append(request.path_qs)
+        response.write(u'page {} render {}'.format(request.GET.get('page'), len(self.handled)))
+
+    def get(self, path):
+        return webapp2.Request.blank(path).get_response(self.app)
+
+    def test_hits_skip_the_handler(self):
+        first = self.get('/cached/test?page=1')
+        second = self.get('/cached/test?page=1&utm_source=mail')
+
+        self.assertEqual(second.body, first.body, u'Cached response should be served')
+        self.assertEqual(second.content_type, first.content_type)
+        self.assertEqual(len(self.handled), 1, u'Handler should not run for a cached hit')
+
+        self.get('/cached/test?page=2')
+        self.assertEqual(len(self.handled), 2, u'Params in vary_params should change the cache key')
+
+    def test_method_config_is_not_changed(self):
+        route = self.app.router.build_routes['cached_test']
+        self.get('/cached/test?page=1')
+        self.assertEqual(route.method_config['output_cache'],
+                         {'ttl': 60, 'vary_params': ['page'], 'stale_while_revalidate': 30},
+                         u'Defaults should not be written into the shared method config')
+
+    def test_stale_while_revalidate(self):
+        self.get('/cached/test?page=1')
+        self.now[0] += 70
+
+        regenerated = self.get('/cached/test?page=1')
+        self.assertEqual(len(self.handled), 2, u'The first request for a stale page should regenerate it')
+        self.assertEqual(regenerated.body, 'page 1 render 2')
+
+        self.now[0] += 70
+        # Simulate another request that is already regenerating the page
+        request = webapp2.Request.blank('/cached/test?page=1')
+        request.app = self.app
+        request.route = self.app.router.match(request)[0]
+        self.app.set_globals(app=self.app, request=request)
+        try:
+            cache_key = self.output_cache.cache_key(request, route_output_cache_config(request))
+        finally:
+            self.app.clear_globals()
+        self.output_cache.backend.add(cache_key + '/revalidate', True)
+
+        stale = self.get('/cached/test?page=1')
+        self.assertEqual(stale.body, 'page 1 render 2', u'Stale page should be served while it is regenerated')
+        self.assertEqual(self.output_cache.stats()['stale_hits'], 1)
+
+        self.now[0] += 100
+        self.get('/cached/test?page=1')
+        self.assertEqual(len(self.handled), 3, u'Expired page should be regenerated')
+
+    def test_vary_on_selected_locale(self):
+        # Nothing sets up the i18n store before the cache is checked; the key must still use the selected locale
+        self.app.config['webapp2_extras.i18n'] = {
+            'locale_selector': lambda store, request: request.GET.get('lang', 'en_GB'),
+        }
+        self.app.router.build_routes['cached_test'].method_config = {'output_cache': {'ttl': 60, 'vary_params': []}}
+
+        english = self.get('/cached/test?lang=en_GB')
+        french = self.get('/cached/test?lang=fr_FR')
+        self.assertEqual(len(self.handled), 2, u'Each locale should have its own page')
+        self.assertNotEqual(french.body, english.body)
+        self.assertEqual(self.get('/cached/test?lang=fr_FR').body, french.body)
+        self.assertEqual(len(self.handled), 2)
+
+    def test_invalidate(self):
+        self.get('/cached/test?page=1')
+        self.output_cache.invalidate('cached_test')
+        self.get('/cached/test?page=1')
+        self.assertEqual(len(self.handled), 2, u'Invalidated page should be regenerated')
+
+    def test_cookies_are_not_cached(self):
+        def set_cookie(request, response, **kwargs):
+            response.set_cookie('session', 'abc')
+
+        signal('cached_test_http_get').connect(set_cookie)
+        try:
+            self.get('/cached/test?page=1')
+            self.get('/cached/test?page=1')
+        finally:
+            signal('cached_test_http_get').disconnect(set_cookie)
+
+        self.assertEqual(len(self.handled), 2, u'Responses that set a cookie should not be cached')
+
+    def test_private_responses_are_not_cached(self):
+        def set_private(request, response, **kwargs):
+            response.cache_control.private = True
+
+        signal('cached_test_http_get').connect(set_private)
+        try:
+            self.get('/cached/test?page=1')
+            self.get('/cached/test?page=1')
+        finally:
+            signal('cached_test_http_get').disconnect(set_private)
+
+        self.assertEqual(len(self.handled), 2, u'Private responses should not be cached')
+
+    def test_login_required_routes_vary_on_user(self):
+        route = self.app.router.build_routes['cached_test']
+        route.method_config = {'login_required': True, 'output_cache': {'ttl': 60}}
+
+        def get_as(user):
+            request = webapp2.Request.blank('/cached/test?page=1')
+            if user is not None:
+                request.headers['X-User'] = user
+            return request.get_response(self.app)
+
+        get_as('alice')
+        get_as('alice')
+        self.assertEqual(len(self.handled), 2, u'Pages behind a login should not be cached without a user key')
+
+        self.output_cache.user_key = lambda request: request.headers.get('X-User')
+        alice = get_as('alice')
+        self.assertEqual(get_as('alice').body, alice.body)
+        self.assertEqual(len(self.handled), 3)
+        get_as('bob')
+        self.assertEqual(len(self.handled), 4, u'Each user should have their own page')
+        get_as(None)
+        get_as(None)
+        self.assertEqual(len(self.handled), 6, u'Requests without a user should not use the cache')
+
+        route.method_config = {'login_required': True, 'output_cache': {'ttl': 60, 'vary_user': False}}
+        get_as('carol')
+        get_as('dave')
+        self.assertEqual(len(self.handled), 7, u'Routes can opt out of varying on the user')
+
+
+class TestConditionalGet(unittest.TestCase):
+    def setUp(self):
+        self.conditional_get = ConditionalGet()
+
+        app = webapp2.WSGIApplication(debug=True)
+        app.router.set_dispatcher(custom_dispatcher)
+        app.router.set_adapter(custom_adapter)
+        app.router.add(RedirectRoute('/conditional/test', handler=default_route_signaler, name='conditional_test'))
+        app.router.conditional_get = self.conditional_get
+        self.app = app
+
+        self.handled = []
+        self.version = None
+        signal('conditional_test_http_get').connect(self.handler)
+
+        self.testbed = testbed.Testbed()
+        self.testbed.activate()
+
+    def tearDown(self):
+        signal('conditional_test_http_get').disconnect(self.handler)
+        ETAG_VERSION_HOOK.disconnect(self.version_receiver)
+        self.testbed.deactivate()
+
+    def handler(self, request, response, **kwargs):
+        self.handled.append(request.path_qs)
+        response.write(u'page {}'.format(request.GET.get('page')))
+
+    def version_receiver(self, sender, request):
+        return self.version
+
+    def get(self, path, if_none_match=None):
+        request = webapp2.Request.blank(path)
+        if if_none_match is not None:
+            request.headers['If-None-Match'] = if_none_match
+        return request.get_response(self.app)
+
+    def test_body_etag(self):
+        first = self.get('/conditional/test?page=1')
+        etag = first.headers['ETag']
+        self.assertEqual(first.status_int, 200)
+        self.assertFalse(etag.startswith('W/'), u'Body tags should be strong')
+
+        not_modified = self.get('/conditional/test?page=1', if_none_match=etag)
+        self.assertEqual(not_modified.status_int, 304)
+        self.assertEqual(not_modified.body, '')
+        self.assertEqual(not_modified.headers['ETag'], etag)
+
+        changed = self.get('/conditional/test?page=2', if_none_match=etag)
+        self.assertEqual(changed.status_int, 200)
+        self.assertEqual(changed.body, 'page 2')
+
+    def test_version_etag_skips_the_handler(self):
+        ETAG_VERSION_HOOK.connect(self.version_receiver, sender='conditional_test')
+        self.version = 1
+
+        etag = self.get('/conditional/test?page=1').headers['ETag']
+        self.assertTrue(etag.startswith('W/'), u'Version tags should be weak')
+
+        not_modified = self.get('/conditional/test?page=1', if_none_match=etag)
+        self.assertEqual(not_modified.status_int, 304)
+        self.assertEqual(len(self.handled), 1, u'Handler should not run when the version matches')
+        self.assertEqual(self.conditional_get.stats()['early_not_modified'], 1)
+
+        self.version = 2
+        self.assertEqual(self.get('/conditional/test?page=1', if_none_match=etag).status_int, 200)
+        self.assertEqual(len(self.handled), 2)
+
+    def test_output_cache_hits(self):
+        self.app.router.output_cache = OutputCache()
+        route = self.app.router.build_routes['conditional_test']
+        route.method_config = {'output_cache': True}
+        try:
+            etag = self.get('/conditional/test?page=1').headers['ETag']
+            cached = self.get('/conditional/test?page=1', if_none_match=etag)
+        finally:
+            del route.method_config
+
+        self.assertEqual(cached.status_int, 304)
+        self.assertEqual(len(self.handled), 1)
+
+
+class TestCompression(unittest.TestCase):
+    def setUp(self):
+        self.compression = ResponseCompressor(min_size=100, use_brotli=False)
+
+        app = webapp2.WSGIApplication(debug=True)
+        app.router.set_dispatcher(custom_dispatcher)
+        app.router.set_adapter(custom_adapter)
+        route = RedirectRoute('/compressed/test', handler=default_route_signaler, name='compressed_test')
+        route.method_config = {}
+        app.router.add(route)
+        app.router.compression = self.compression
+        self.app = app
+        self.route = route
+
+        self.handled = []
+        self.content_type = 'text/html'
+        signal('compressed_test_http_get').connect(self.handler)
+
+        self.testbed = testbed.Testbed()
+        self.testbed.activate()
+
+    def tearDown(self):
+        signal('compressed_test_http_get').disconnect(self.handler)
+        self.testbed.deactivate()
+
+    def handler(self, request, response, **kwargs):
+        self.handled.append(request.path_qs)
+        response.content_type = self.content_type
+        response.write(u'<li>row</li>' * int(request.GET.get('rows', 100)))
+
+    def get(self, path, accept_encoding='gzip, deflate', **headers):
+        request = webapp2.Request.blank(path)
+        request.headers['Accept-Encoding'] = accept_encoding
+        request.headers.update(headers)
+        return request.get_response(self.app)
+
+    def test_negotiate(self):
+        request = webapp2.Request.blank('/')
+        for header, expected in [('gzip, deflate, br', 'gzip'), ('identity', None), ('gzip;q=0', None), ('*', 'gzip'),
+                                 ('*, gzip;q=0', None)]:
+            request.headers['Accept-Encoding'] = header
+            self.assertEqual(self.compression.negotiate(request), expected, header)
+
+    def test_compress(self):
+        response = self.get('/compressed/test')
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(zlib.decompress(response.body, 16 + zlib.MAX_WBITS), '<li>row</li>' * 100)
+        self.assertTrue('Accept-Encoding' in response.vary)
+
+        self.assertFalse('Content-Encoding' in self.get('/compressed/test', accept_encoding='identity').headers)
+        self.assertFalse('Content-Encoding' in self.get('/compressed/test?rows=2').headers,
+                         u'Small responses should not be compressed')
+
+        self.content_type = 'image/png'
+        self.assertFalse('Content-Encoding' in self.get('/compressed/test').headers,
+                         u'Only allowed content types should be compressed')
+
+    def test_cached_variants(self):
+        self.app.router.output_cache = OutputCache()
+        self.route.method_config = {'output_cache': True}
+
+        first = self.get('/compressed/test')
+        second = self.get('/compressed/test')
+        self.assertEqual(len(self.handled), 1)
+        self.assertEqual(second.body, first.body)
+        self.assertEqual(self.compression.stats(), {'compressed': 1, 'variant_hits': 1})
+
+        identity = self.get('/compressed/test', accept_encoding='identity')
+        self.assertEqual(identity.body, '<li>row</li>' * 100, u'The page should be cached uncompressed')
+
+    def test_etag(self):
+        self.app.router.conditional_get = ConditionalGet()
+
+        etag = self.get('/compressed/test').headers['ETag']
+        self.assertTrue(etag.endswith('-gzip"'))
+        self.assertEqual(self.get('/compressed/test', **{'If-None-Match': etag}).status_int, 304)
+        self.assertEqual(self.get('/compressed/test', accept_encoding='identity',
+                                  **{'If-None-Match': etag}).status_int, 200)
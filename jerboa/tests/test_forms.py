@@ -0,0 +1,403 @@
+# -*- coding: utf-8 -*-
+"""
+    jerboa.test_forms
+    ~~~~~~~~~~~~~~~~~
+
+
+    :copyright: (c) 2015 Lighthouse
+    :license: LGPL
+"""
+import httplib
+import unittest
+import webapp2
+import wtforms
+from jerboa.forms import *
+from jerboa.recaptcha import LocalRecaptchaVerifyServer, RecaptchaVerifyClient, RecaptchaUnavailable, CircuitBreaker
+
+__author__ = 'Matt Badger'
+
+
+class AddressForm(BaseForm, AddressMixin, BaseModelMixin):
+    class Meta:
+        csrf = False
+
+
+class UnprototypedAddressForm(AddressForm):
+    use_prototype = False
+
+
+class UnprototypedUserForm(UserForm):
+    use_prototype = False
+
+
+class UnprototypedUserSearchForm(UserSearchForm):
+    use_prototype = False
+
+
+class FormTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = webapp2.WSGIApplication(debug=True)
+        self.request = self.build_request()
+
+    def tearDown(self):
+        self.app.clear_globals()
+
+    def build_request(self, post=None):
+        request = webapp2.Request.blank('/', POST=post)
+        request.app = self.app
+        self.app.set_globals(app=self.app, request=request)
+        return request
+
+    @staticmethod
+    def rendered_fields(form):
+        return [(field.name, unicode(field.label), unicode(field)) for field in form]
+
+
+class TestFormPrototype(FormTestCase):
+    def test_matches_bound_form(self):
+        post = {'address_1': u'1 High Street', 'county': u'Bedfordshire', 'country': u'GB', 'uid': u'1'}
+        form = AddressForm(request=self.build_request(post=post))
+        expected = UnprototypedAddressForm(request=self.build_request(post=post))
+
+        self.assertEqual(form.validate(), expected.validate())
+        self.assertEqual(form.errors, expected.errors)
+        self.assertEqual(form.data, expected.data)
+        self.assertEqual(self.rendered_fields(form), self.rendered_fields(expected))
+
+    def test_fields_are_not_shared(self):
+        first = AddressForm(request=self.build_request(post={'city': u'London'}))
+        second = AddressForm(request=self.build_request())
+
+        self.assertFalse(first.city is second.city)
+        self.assertEqual(second.city.data, u'')
+        first.address_2.flags.required = True
+        self.assertFalse(second.address_2.flags.required)
+        self.assertTrue(first.city.meta is first.meta)
+
+    def test_form_fields(self):
+        post = {'sort_options-sort_by': u'username', 'filter_options-language_preference': u'en'}
+        form = UserSearchForm(request=self.build_request(post=post))
+        expected = UnprototypedUserSearchForm(request=self.build_request(post=post))
+
+        self.assertEqual(form.data, expected.data)
+        self.assertEqual(self.rendered_fields(form), self.rendered_fields(expected))
+        other = UserSearchForm(request=self.build_request())
+        self.assertFalse(form.sort_options.sort_by is other.sort_options.sort_by,
+                         u'Enclosed forms should not be shared')
+
+    def test_csrf_and_recaptcha(self):
+        self.request.session = {}
+        form_config = {
+            'csrf_secret': 'secret',
+            'recaptcha_site_key': TEST_RECAPTCHA_SITE_KEY,
+            'recaptcha_site_secret': TEST_RECAPTCHA_SITE_SECRET,
+        }
+        form = UserForm(request=self.request, **form_config)
+        expected = UnprototypedUserForm(request=self.request, **form_config)
+
+        self.assertEqual([field.name for field in form], [field.name for field in expected])
+        self.assertEqual(form.recaptcha2.site_key, TEST_RECAPTCHA_SITE_KEY)
+        self.assertEqual(getattr(form, 'g-recaptcha-response').site_secret, TEST_RECAPTCHA_SITE_SECRET)
+        self.assertTrue(form.csrf_token.current_token)
+
+        other_keys = dict(form_config, recaptcha_site_key=u'other-key')
+        self.assertEqual(UserForm(request=self.request, **other_keys).recaptcha2.site_key, u'other-key')
+        self.assertEqual(UserForm(request=self.request, **form_config).recaptcha2.site_key, TEST_RECAPTCHA_SITE_KEY)
+
+
+class UnplannedAddressForm(AddressForm):
+    use_validation_plan = False
+
+
+class InlineValidationForm(AddressForm):
+    def validate_city(self, field):
+        if field.data == u'Nowhere':
+            raise wtforms.validators.ValidationError(u'Unknown city')
+
+
+class TestValidationPlan(FormTestCase):
+    POSTS = [
+        {},
+        {'address_1': u'1 High Street', 'city': u'Bedford', 'county': u'Bedfordshire', 'post_code': u'MK40 1AA',
+         'country': u'GB', 'uid': u'1'},
+        {'address_1': u'1 High Street', 'city': u'Bedford', 'county': u'Nowhere', 'country': u'GB', 'uid': u'1'},
+        {'address_1': u'1 Main Street', 'city': u'Boston', 'country': u'US', 'uid': u'1', 'address_2': u'x' * 200},
+        {'country': u'XX', 'county': u'Bedfordshire'},
+    ]
+
+    def test_matches_wtforms_validate(self):
+        for post in self.POSTS:
+            form = AddressForm(request=self.build_request(post=post))
+            expected = UnplannedAddressForm(request=self.build_request(post=post))
+            self.assertEqual(form.validate(), expected.validate(), post)
+            self.assertEqual(form.errors, expected.errors, post)
+
+    def test_extra_and_inline_validators(self):
+        def no_flats(form, field):
+            if u'Flat' in field.data:
+                raise wtforms.validators.ValidationError(u'No flats')
+
+        post = {'address_1': u'Flat 1', 'city': u'Nowhere', 'county': u'Bedfordshire', 'country': u'FR', 'uid': u'1'}
+        form = InlineValidationForm(request=self.build_request(post=post))
+        self.assertFalse(form.validate(extra_validators={'address_1': [no_flats]}))
+        self.assertEqual(form.errors, {'address_1': [u'No flats'], 'city': [u'Unknown city']})
+
+        form.city.data = u'Paris'
+        self.assertTrue(form.validate(), u'Errors from the previous validation should be cleared')
+
+    def test_form_fields(self):
+        post = {'query': u'', 'sort_options-limit': u'20', 'filter_options-language_preference': u'zz'}
+        form = UserSearchForm(request=self.build_request(post=post))
+        expected = type('UnplannedUserSearchForm', (UserSearchForm,), {'use_validation_plan': False})(
+            request=self.build_request(post=post))
+        self.assertFalse(form.validate())
+        self.assertFalse(expected.validate())
+        self.assertEqual(form.errors, expected.errors)
+        self.assertTrue('filter_options' in form.errors)
+
+    def test_country_dependent_validators(self):
+        form = AddressForm(request=self.build_request(post={'country': u'US', 'county': u''}))
+        UKCountyValidation(form, form.county)
+        form.country.data = u'GB'
+        self.assertRaises(wtforms.validators.ValidationError, UKCountyValidation, form, form.county)
+
+        form.country.data = u'US'
+        self.assertRaises(wtforms.validators.ValidationError, USStateValidation, form, form.state)
+
+        form.state.data = u'MA'
+        USStateValidation(form, form.state)
+
+
+class TestChoiceIndex(FormTestCase):
+    GROUPED_CHOICES = (
+        (u'Fruits', ((u'apple', u'Apple'), (u'pear', u'Pear'))),
+        (u'Vegetables', [(u'potato', u'Potato')]),
+        (u'other', u'None Of The Above'),
+    )
+
+    def test_flattens_optgroups(self):
+        index = ChoiceIndex.for_choices(self.GROUPED_CHOICES)
+        self.assertEqual(index.values, frozenset([u'apple', u'pear', u'potato', u'other']))
+        self.assertFalse(u'Fruits' in index)
+        self.assertFalse([u'unhashable'] in index)
+        self.assertTrue(ChoiceIndex.for_choices(self.GROUPED_CHOICES) is index)
+        self.assertEqual(ChoiceIndex.for_choices((u'a', u'b'), coerce=unicode).values, frozenset([u'a', u'b']))
+        self.assertTrue(ChoiceIndex.for_choices(list(self.GROUPED_CHOICES)) is None)
+
+    def test_shared_across_forms(self):
+        first = AddressForm(request=self.build_request(post={'county': u'Bedfordshire', 'country': u'GB'}))
+        second = UnprototypedAddressForm(request=self.build_request(post={'county': u'Nowhere', 'country': u'XX'}))
+        self.assertTrue(first.county.choices is second.county.choices is UK_COUNTIES_TUPLE)
+
+        first.county.pre_validate(first)
+        first.country.pre_validate(first)
+        self.assertRaises(ValueError, second.county.pre_validate, second)
+        self.assertRaises(ValueError, second.country.pre_validate, second)
+        self.assertTrue(ChoiceIndex.for_choices(UK_COUNTIES_TUPLE) is ChoiceIndex.for_choices(UK_COUNTIES_TUPLE))
+
+    def test_instance_choices(self):
+        form = AddressForm(request=self.build_request(post={'county': u'Elsewhere', 'country': u'GB'}))
+        self.assertRaises(ValueError, form.county.pre_validate, form)
+
+        form.county.choices = [(u'Elsewhere', u'Elsewhere')]
+        form.county.pre_validate(form)
+        form.county.choices = self.GROUPED_CHOICES
+        self.assertRaises(ValueError, form.county.pre_validate, form)
+        self.assertTrue(AddressForm(request=self.build_request()).county.choices is UK_COUNTIES_TUPLE)
+
+    def test_flat_choices(self):
+        form = GAESortOptions(request=self.build_request(post={'sort_by': u'No Sort'}), meta={'csrf': False})
+        form.sort_by.pre_validate(form)
+        form.sort_by.data = u'username'
+        self.assertRaises(ValueError, form.sort_by.pre_validate, form)
+
+
+class TestRenderedOptions(FormTestCase):
+    def setUp(self):
+        super(TestRenderedOptions, self).setUp()
+        RenderedOptions.cache.clear()
+
+    def uncached(self, field):
+        # Render with list choices, which bypass the cache
+        choices = field.choices
+        field.choices = list(choices)
+        try:
+            return unicode(field)
+        finally:
+            field.choices = choices
+
+    def test_matches_uncached(self):
+        for post in ({}, {'county': u'Bedfordshire', 'country': u'FR', 'uid': u'1'}, {'country': u'<none>'}):
+            form = AddressForm(request=self.build_request(post=post))
+            for field in (form.county, form.country):
+                self.assertEqual(unicode(field), self.uncached(field))
+        self.assertEqual(RenderedOptions.cache.stats()['size'], 2)
+
+    def test_selected_option(self):
+        form = AddressForm(request=self.build_request(post={'country': u'FR', 'county': u'Bedfordshire'}))
+        html = unicode(form.country)
+        self.assertEqual(html.count(u'selected'), 1)
+        self.assertTrue(u'<option selected value="FR">' in html)
+        self.assertTrue(u'<option selected value="Bedfordshire">' in unicode(form.county))
+
+        hits = RenderedOptions.cache.stats()['hits']
+        other = AddressForm(request=self.build_request(post={'country': u'DE'}))
+        self.assertTrue(u'<option selected value="DE">' in unicode(other.country))
+        self.assertTrue(u'<option value="FR">' in unicode(other.country))
+        self.assertEqual(RenderedOptions.cache.stats()['hits'], hits + 2)
+
+    def test_locale(self):
+        request = self.build_request()
+        form = AddressForm(request=request)
+        unicode(form.country)
+        request.locale = 'de_DE'
+        unicode(form.country)
+        self.assertEqual(RenderedOptions.cache.stats()['size'], 2)
+
+    def test_opt_groups(self):
+        class AwardForm(BaseForm):
+            class Meta:
+                csrf = False
+
+            category = wtforms.fields.SelectField(u'Category', widget=SelectOptGroups())
+
+        choices = OrderedDict([(u'a', {'class_name': u'Best', 'awards': OrderedDict([(u'1', {'award_name': u'One'}),
+                                                                                     (u'2', {'award_name': u'Two'})])})])
+        form = AwardForm(request=self.build_request(post={'category': u'a2'}))
+        form.category.choices = choices
+        html = unicode(form.category)
+        self.assertTrue(u'<option selected value="a2">Two</option>' in html)
+        self.assertTrue(u'<option value="a1">One</option>' in html)
+        form.category.data = u'a1'
+        self.assertTrue(u'<option selected value="a1">One</option>' in unicode(form.category))
+
+
+class TestRecaptchaVerification(FormTestCase):
+    def setUp(self):
+        super(TestRecaptchaVerification, self).setUp()
+        self.server = LocalRecaptchaVerifyServer(valid_tokens=[u'token-1', u'token-2', u'token-3']).start()
+        self.client = RecaptchaVerifyClient(verify_url=self.server.url, connect_timeout=1, read_timeout=1)
+
+    def tearDown(self):
+        self.client.pool.close()
+        self.server.stop()
+        super(TestRecaptchaVerification, self).tearDown()
+
+    def test_reuses_connections(self):
+        for token in (u'token-1', u'token-2', u'token-3'):
+            self.assertTrue(self.client.verify(TEST_RECAPTCHA_SITE_SECRET, token)['success'])
+        self.assertEqual(self.server.connections, 1)
+        self.assertEqual(self.client.stats()['reused'], 2)
+
+    def test_tokens_are_not_cached(self):
+        self.assertTrue(self.client.verify(TEST_RECAPTCHA_SITE_SECRET, u'token-1')['success'])
+        result = self.client.verify(TEST_RECAPTCHA_SITE_SECRET, u'token-1')
+        self.assertEqual(result['error-codes'], [u'timeout-or-duplicate'], u'Tokens should only verify once')
+        self.assertEqual(self.server.requests, 2)
+
+        self.assertEqual(self.client.verify(TEST_RECAPTCHA_SITE_SECRET, u'')['error-codes'],
+                         ['missing-input-response'])
+        self.assertEqual(self.server.requests, 2)
+
+    def test_retries_stale_connection_once(self):
+        class StaleConnection(object):
+            def __init__(self):
+                self.requests = 0
+
+            def request(self, *args):
+                self.requests += 1
+                raise httplib.BadStatusLine('')
+
+            def close(self):
+                pass
+
+        stale = [StaleConnection() for _ in range(3)]
+        for connection in stale:
+            self.client.pool._idle.put_nowait(connection)
+
+        self.assertTrue(self.client.verify(TEST_RECAPTCHA_SITE_SECRET, u'token-1')['success'])
+        self.assertEqual([connection.requests for connection in stale], [1, 0, 0],
+                         u'The retry should use a new connection rather than the next idle one')
+        self.assertEqual(self.server.connections, 1)
+
+    def test_read_timeout(self):
+        self.server.delay = 0.5
+        self.client.pool.read_timeout = 0.05
+        self.assertRaises(RecaptchaUnavailable, self.client.verify, TEST_RECAPTCHA_SITE_SECRET, u'token-1')
+
+    def test_circuit_breaker(self):
+        now = [0]
+        self.client.breaker = CircuitBreaker(failure_threshold=2, reset_timeout=30, clock=lambda: now[0])
+        self.server.status = 503
+        for _ in range(3):
+            self.assertRaises(RecaptchaUnavailable, self.client.verify, TEST_RECAPTCHA_SITE_SECRET, u'token-1')
+        self.assertEqual(self.server.requests, 2)
+        self.assertEqual(self.client.breaker.stats(), {'state': 'open', 'failures': 2, 'rejected': 1})
+
+        now[0] = 30
+        self.server.status = 200
+        self.assertTrue(self.client.verify(TEST_RECAPTCHA_SITE_SECRET, u'token-1')['success'])
+        self.assertEqual(self.client.breaker.state, CircuitBreaker.CLOSED)
+
+    def test_unexpected_error_during_trial_call(self):
+        now = [0]
+        self.client.breaker = CircuitBreaker(failure_threshold=1, reset_timeout=30, clock=lambda: now[0])
+        self.server.status = 503
+        self.assertRaises(RecaptchaUnavailable, self.client.verify, TEST_RECAPTCHA_SITE_SECRET, u'token-1')
+        self.assertEqual(self.client.breaker.state, CircuitBreaker.OPEN)
+
+        def broken_post(body, headers=None):
+            raise TypeError(u'Unexpected')
+
+        now[0] = 30
+        post, self.client.pool.post = self.client.pool.post, broken_post
+        self.assertRaises(TypeError, self.client.verify, TEST_RECAPTCHA_SITE_SECRET, u'token-1')
+        self.assertEqual(self.client.breaker.state, CircuitBreaker.OPEN,
+                         u'A failed trial call should re-open the breaker')
+
+        now[0] = 60
+        self.client.pool.post = post
+        self.server.status = 200
+        self.assertTrue(self.client.verify(TEST_RECAPTCHA_SITE_SECRET, u'token-1')['success'])
+        self.assertEqual(self.client.breaker.state, CircuitBreaker.CLOSED)
+
+    def test_validator(self):
+        request = self.build_request(post={'g-recaptcha-response': u'token-1'})
+        request.session = {}
+        form = UserForm(request=request, csrf_secret='secret', recaptcha_site_key=TEST_RECAPTCHA_SITE_KEY,
+                        recaptcha_site_secret=TEST_RECAPTCHA_SITE_SECRET)
+        field = getattr(form, 'g-recaptcha-response')
+        validator = Recaptcha2Validator(client=self.client)
+        validator(form, field)
+        # The result is kept on the field, so validating again doesn't fail as a duplicate
+        validator(form, field)
+        self.assertEqual(self.server.requests, 1)
+
+        field.data = u'forged'
+        self.assertRaises(wtforms.validators.ValidationError, validator, form, field)
+        field.data = u'token-2'
+        self.server.status = 503
+        self.client.breaker.failure_threshold = 1
+        try:
+            validator(form, field)
+        except wtforms.validators.ValidationError, e:
+            self.assertEqual(e.args[0], validator.unavailable_message)
+        self.assertEqual(validator.message, u'Invalid reCaptcha response')
+
+    def build_form(self, token, remote_addr):
+        request = self.build_request(post={'g-recaptcha-response': token})
+        request.remote_addr = remote_addr
+        request.session = {}
+        return UserForm(request=request, csrf_secret='secret', recaptcha_site_key=TEST_RECAPTCHA_SITE_KEY,
+                        recaptcha_site_secret=TEST_RECAPTCHA_SITE_SECRET)
+
+    def test_replayed_token_is_rejected(self):
+        validator = Recaptcha2Validator(client=self.client)
+        form = self.build_form(u'token-1', '192.0.2.1')
+        validator(form, getattr(form, 'g-recaptcha-response'))
+
+        for remote_addr in ('198.51.100.7', '192.0.2.1'):
+            replayed = self.build_form(u'token-1', remote_addr)
+            self.assertRaises(wtforms.validators.ValidationError, validator, replayed,
+                              getattr(replayed, 'g-recaptcha-response'))
+        self.assertEqual(self.server.requests, 3, u'Every form should verify the token itself')
@@ -0,0 +1,348 @@
+# -*- coding: utf-8 -*-
+"""
+    jerboa.test_renderers
+    ~~~~~~~~~~~~~~~~~~~~~
+
+
+    :copyright: (c) 2015 Lighthouse
+    :license: LGPL
+"""
+import os
+import json
+import datetime
+import shutil
+import tempfile
+import unittest
+import webapp2
+from babel.support import LazyProxy
+from jerboa.app import ScratchSpace, default_post_request_hook
+from jerboa.renderers import *
+from jerboa.template_compiler import *
+from jerboa.utils import LocalMemcacheClient
+
+__author__ = 'Matt Badger'
+
+
+TEST_TEMPLATES = {
+    'listing.html': u'<h1>{{ title }}</h1><ul>{% for row in rows %}<li>{{ row }}</li>{% endfor %}</ul>',
+    'base.html': u'<title>{{ title }}</title>{% block content %}{% endblock %}',
+    'page.html': u'{% extends "base.html" %}{% block content %}{% include "listing.html" %}{% endblock %}',
+    'fragment.html': u'{% cache "sidebar", 60 %}<nav>{{ title }}</nav>{% endcache %}<p>{{ title }}</p>',
+    'macros.html': u'{% set greeting = site_greeting %}{% macro hello(name) %}{{ greeting }} {{ name }}{% endmacro %}',
+}
+
+
+class RendererTestCase(unittest.TestCase):
+    def setUp(self):
+        self.template_path = tempfile.mkdtemp()
+        for filename, source in TEST_TEMPLATES.iteritems():
+            with open(os.path.join(self.template_path, filename), 'w') as template_file:
+                template_file.write(source.encode('utf-8'))
+
+        self.renderer = Jinja2Renderer(config={
+            'theme_base_template_path': [self.template_path],
+            'enable_i18n': False,
+        })
+
+    def tearDown(self):
+        shutil.rmtree(self.template_path)
+
+    @staticmethod
+    def build_response(**context):
+        response = webapp2.Response()
+        response.raw = ScratchSpace()
+        for key, value in context.iteritems():
+            setattr(response.raw, key, value)
+        return response
+
+
+class TestStreamingRender(RendererTestCase):
+    def test_stream_matches_render(self):
+        context = {'title': u'Résultats', 'rows': range(250)}
+        expected = self.renderer.render_template('listing.html', **context).encode('utf-8')
+
+        chunks = list(self.renderer.stream_template('listing.html', _buffer_size=10, **context))
+        self.assertTrue(len(chunks) > 1, u'Template should be streamed in several chunks')
+        self.assertEqual(b''.join(chunks), expected)
+
+        unbuffered = list(self.renderer.stream_template('listing.html', _buffer_size=0, **context))
+        self.assertTrue(len(unbuffered) > len(chunks), u'Disabling buffering should yield more chunks')
+        self.assertEqual(b''.join(unbuffered), expected)
+
+    def test_render_into_response(self):
+        response = self.build_response(title=u'Users', rows=[u'a', u'b'])
+        self.renderer.render('listing.html', response=response, stream=True)
+
+        self.assertEqual(response.content_length, None, u'Streamed responses should not set a content length')
+        self.assertEqual(response.body, self.renderer.render_template('listing.html', title=u'Users',
+                                                                      rows=[u'a', u'b']).encode('utf-8'))
+
+
+class TestRenderContext(RendererTestCase):
+    def test_scratch_space_is_not_copied(self):
+        self.renderer.environment.globals['title'] = u'Global title'
+        self.renderer.environment.globals['site_name'] = u'Jerboa'
+        response = self.build_response(title=u'Users', rows=[u'a'])
+
+        context = RenderContext(response.raw, self.renderer.environment.globals)
+        self.assertEqual(context['title'], u'Users', u'Scratch space should take precedence over globals')
+        self.assertEqual(context['site_name'], u'Jerboa')
+        self.assertFalse('missing' in context)
+
+        response.raw.rows = [u'b']
+        self.assertEqual(context['rows'], [u'b'], u'Context should reflect changes to the scratch space')
+
+    def test_template_errors_are_raised(self):
+        self.renderer.environment.globals['fail'] = lambda: 1 / 0
+        with open(os.path.join(self.template_path, 'error.html'), 'w') as template_file:
+            template_file.write('{{ title }}{{ fail() }}')
+
+        response = self.build_response(title=u'Users')
+        self.assertRaises(ZeroDivisionError, self.renderer.render, 'error.html', response=response)
+        self.assertRaises(ZeroDivisionError, lambda: list(self.renderer.stream_template('error.html', title=u'Users')))
+
+    def test_render_matches_render_template(self):
+        for template_name in ['listing.html', 'page.html']:
+            response = self.build_response(title=u'Users', rows=[u'a', u'b'])
+            self.renderer.render(template_name, response=response)
+
+            self.assertEqual(response.body, self.renderer.render_template(template_name, title=u'Users',
+                                                                          rows=[u'a', u'b']).encode('utf-8'))
+
+
+class TestBytecodeCache(RendererTestCase):
+    def build_renderer(self, bytecode_cache):
+        return Jinja2Renderer(config={
+            'theme_base_template_path': [self.template_path],
+            'enable_i18n': False,
+            'bytecode_cache': bytecode_cache,
+        })
+
+    def assertSharedBetweenRenderers(self, bytecode_cache):
+        first = self.build_renderer(bytecode_cache)
+        first.render_template('listing.html', title=u'Users', rows=[])
+        self.assertEqual(first.bytecode_cache.stats(), {'hits': 0, 'misses': 1})
+
+        # A new renderer (e.g. on a new instance) should use the compiled template
+        second = self.build_renderer(first.bytecode_cache)
+        self.assertEqual(second.render_template('listing.html', title=u'Users', rows=[u'a']),
+                         u'<h1>Users</h1><ul><li>a</li></ul>')
+        self.assertEqual(second.bytecode_cache.stats(), {'hits': 1, 'misses': 1})
+
+    def test_memory_cache(self):
+        self.assertSharedBetweenRenderers({'type': 'memory'})
+
+    def test_memcache_cache(self):
+        self.assertSharedBetweenRenderers({'type': 'memcache', 'client': LocalMemcacheClient(), 'timeout': 60})
+
+    def test_filesystem_cache(self):
+        cache_directory = tempfile.mkdtemp()
+        try:
+            self.assertSharedBetweenRenderers({'type': 'filesystem', 'directory': cache_directory})
+        finally:
+            shutil.rmtree(cache_directory)
+
+    def test_changed_template_is_recompiled(self):
+        renderer = self.build_renderer({'type': 'memory'})
+        renderer.render_template('listing.html', title=u'Users', rows=[])
+
+        with open(os.path.join(self.template_path, 'listing.html'), 'w') as template_file:
+            template_file.write(u'<h2>{{ title }}</h2>')
+
+        renderer = self.build_renderer(renderer.bytecode_cache)
+        self.assertEqual(renderer.render_template('listing.html', title=u'Users'), u'<h2>Users</h2>')
+        self.assertEqual(renderer.bytecode_cache.stats()['misses'], 2, u'Changed template should be a cache miss')
+
+    def test_unknown_type(self):
+        self.assertRaises(ValueError, build_bytecode_cache, {'type': 'unknown'})
+
+
+class TestTemplateCompiler(RendererTestCase):
+    def setUp(self):
+        super(TestTemplateCompiler, self).setUp()
+        self.target = os.path.join(tempfile.mkdtemp(), 'compiled_templates')
+
+    def tearDown(self):
+        shutil.rmtree(os.path.dirname(self.target))
+        super(TestTemplateCompiler, self).tearDown()
+
+    def test_compiled_templates_are_loaded_from_modules(self):
+        manifest = compile_templates(environment=self.renderer.environment, target=self.target)
+        self.assertEqual(sorted(manifest['templates']), sorted(TEST_TEMPLATES))
+        with open(os.path.join(self.target, MANIFEST_FILENAME)) as manifest_file:
+            self.assertEqual(json.load(manifest_file)['templates'], manifest['templates'])
+
+        expected = self.renderer.render_template('page.html', title=u'Users', rows=[u'a'])
+        renderer = Jinja2Renderer(config={
+            'theme_base_template_path': [self.template_path],
+            'compiled_templates': self.target,
+            'enable_i18n': False,
+        })
+        # The source should no longer be needed
+        shutil.rmtree(self.template_path)
+        os.mkdir(self.template_path)
+
+        self.assertEqual(renderer.render_template('page.html', title=u'Users', rows=[u'a']), expected)
+
+    def test_syntax_errors_fail_the_build(self):
+        for filename in ['broken.html', 'also_broken.html']:
+            with open(os.path.join(self.template_path, filename), 'w') as template_file:
+                template_file.write('{% for row in rows %}')
+
+        with self.assertRaises(TemplateCompilationError) as context:
+            compile_templates(environment=self.renderer.environment, target=self.target)
+
+        self.assertEqual(len(context.exception.errors), 2, u'Every syntax error should be reported')
+        self.assertFalse(os.path.exists(self.target), u'Nothing should be written when the build fails')
+
+
+class TestFragmentCache(RendererTestCase):
+    def render_in_request(self, namespace=None, **context):
+        app = webapp2.WSGIApplication()
+        request = webapp2.Request.blank('/')
+        request.namespace = namespace
+        app.set_globals(app=app, request=request)
+        try:
+            return self.renderer.render_template('fragment.html', **context)
+        finally:
+            app.clear_globals()
+
+    def test_fragment_is_cached(self):
+        self.assertEqual(self.render_in_request(title=u'First'), u'<nav>First</nav><p>First</p>')
+        self.assertEqual(self.render_in_request(title=u'Second'), u'<nav>First</nav><p>Second</p>',
+                         u'Cached fragment should be reused')
+
+    def test_fragment_varies_on_namespace(self):
+        self.render_in_request(namespace='acme', title=u'Acme')
+        self.assertEqual(self.render_in_request(namespace='other', title=u'Other'), u'<nav>Other</nav><p>Other</p>',
+                         u'Each namespace should have its own fragment')
+        self.assertEqual(self.render_in_request(namespace='acme', title=u'Changed'), u'<nav>Acme</nav><p>Changed</p>')
+
+    def test_fragment_expires(self):
+        now = [0]
+        self.renderer.environment.fragment_cache = LocalMemcacheClient(clock=lambda: now[0])
+        self.render_in_request(title=u'First')
+        now[0] = 61
+        self.assertEqual(self.render_in_request(title=u'Second'), u'<nav>Second</nav><p>Second</p>')
+
+
+class TestSimpleRenderer(RendererTestCase):
+    def setUp(self):
+        super(TestSimpleRenderer, self).setUp()
+        with open(os.path.join(self.template_path, 'email.txt'), 'w') as template_file:
+            template_file.write('Hello {{ name }}, your code is {{ code }}. {{ unknown }}')
+        self.simple_renderer = SimpleRenderer(engine_config={'theme_base_template_path': self.template_path})
+
+    def test_render(self):
+        self.assertEqual(self.simple_renderer.render_template('email.txt', name='Matt', code=123, request=object()),
+                         'Hello Matt, your code is 123. {{ unknown }}')
+        self.assertEqual(SimpleRenderer.parse_simple_template('{{ a }}{{ a }}', params={'a': 1}), '11')
+
+    def test_template_is_reloaded_when_changed(self):
+        self.simple_renderer.render_template('email.txt', name='Matt', code=1)
+        template = self.simple_renderer.get_template(os.path.join(self.template_path, 'email.txt'))
+        self.simple_renderer.render_template('email.txt', name='Matt', code=1)
+        self.assertTrue(template is self.simple_renderer.get_template(os.path.join(self.template_path, 'email.txt')),
+                        u'Unchanged template should not be compiled again')
+
+        with open(os.path.join(self.template_path, 'email.txt'), 'w') as template_file:
+            template_file.write('Bye {{ name }}')
+        self.assertEqual(self.simple_renderer.render_template('email.txt', name='Matt'), 'Bye Matt')
+
+
+class TestTemplatePreload(RendererTestCase):
+    def test_referenced_templates_are_loaded(self):
+        report = self.renderer.preload_templates(['page.html'])
+
+        self.assertTrue(report.ok)
+        self.assertEqual(set(report.load_times), {'page.html', 'base.html', 'listing.html'})
+        self.assertTrue(self.renderer.environment.cache, u'Templates should be in the environment cache')
+
+    def test_errors_are_reported(self):
+        with open(os.path.join(self.template_path, 'broken.html'), 'w') as template_file:
+            template_file.write('{% if %}')
+
+        report = self.renderer.preload_templates(['broken.html', 'missing.html', 'listing.html'])
+
+        self.assertFalse(report.ok)
+        self.assertEqual(set(report.errors), {'broken.html', 'missing.html'})
+        self.assertEqual(set(report.load_times), {'listing.html'})
+
+    def test_simple_renderer(self):
+        simple_renderer = SimpleRenderer(engine_config={'theme_base_template_path': self.template_path})
+        report = simple_renderer.preload_templates(['listing.html', 'missing.txt'])
+
+        self.assertEqual(set(report.load_times), {'listing.html'})
+        self.assertEqual(set(report.errors), {'missing.txt'})
+        self.assertTrue(os.path.join(self.template_path, 'listing.html') in simple_renderer.templates)
+
+
+class TestJsonRenderer(RendererTestCase):
+    def setUp(self):
+        super(TestJsonRenderer, self).setUp()
+        self.json_renderer = JsonRenderer()
+
+    def test_serialize_scratch_space(self):
+        response = self.build_response(created=datetime.datetime(2015, 6, 1, 12, 30), day=datetime.date(2015, 6, 1),
+                                       label=LazyProxy(lambda: u'Oui'), tags={u'a'}, count=3)
+        self.json_renderer.render(response=response)
+
+        self.assertEqual(json.loads(response.body), {
+            u'created': u'2015-06-01T12:30:00',
+            u'day': u'2015-06-01',
+            u'label': u'Oui',
+            u'tags': [u'a'],
+            u'count': 3,
+        })
+
+    def test_whitelist(self):
+        response = self.build_response(user={u'name': u'Matt'}, form=object(), status_code=0)
+        self.assertEqual(json.loads(self.json_renderer.serialize(response.raw, keys=['user', 'status_code', 'x'])),
+                         {u'user': {u'name': u'Matt'}, u'status_code': 0})
+        self.assertRaises(TypeError, self.json_renderer.serialize, response.raw)
+
+    def test_post_request_hook_selects_renderer_by_content_type(self):
+        request = webapp2.Request.blank('/api/user', POST={})
+        request.route = webapp2.Route('/api/user', name='api_user')
+        request.route.method_config = {'content_type': 'application/json; charset=utf-8', 'json_keys': ['user'],
+                                       'page_template': 'missing.html'}
+        response = self.build_response(user=u'Matt', secret=u'hidden')
+
+        default_post_request_hook(None, request=request, response=response)
+        self.assertEqual(json.loads(response.body), {u'user': u'Matt'})
+
+
+class TestTemplateModuleCache(RendererTestCase):
+    def setUp(self):
+        super(TestTemplateModuleCache, self).setUp()
+        self.renderer.environment.globals['site_greeting'] = u'Hello'
+        self.loads = []
+        get_template = self.renderer.environment.get_template
+
+        def counting_get_template(name, *args, **kwargs):
+            self.loads.append(name)
+            return get_template(name, *args, **kwargs)
+        self.renderer.environment.get_template = counting_get_template
+
+    def test_module_is_cached(self):
+        for name in (u'Matt', u'Anna', u'Lee'):
+            self.assertEqual(self.renderer.get_template_attribute('macros.html', 'hello')(name), u'Hello ' + name)
+        self.assertEqual(self.loads, ['macros.html'], u'The template should only be loaded once')
+
+    def test_changed_template_is_reloaded(self):
+        hello = self.renderer.get_template_attribute('macros.html', 'hello')
+        template_path = os.path.join(self.template_path, 'macros.html')
+        with open(template_path, 'w') as template_file:
+            template_file.write('{% macro hello(name) %}Hi {{ name }}{% endmacro %}')
+        mtime = os.path.getmtime(template_path) + 10
+        os.utime(template_path, (mtime, mtime))
+
+        self.assertEqual(self.renderer.get_template_attribute('macros.html', 'hello')(u'Matt'), u'Hi Matt')
+        self.assertEqual(hello(u'Matt'), u'Hello Matt', u'Macros that are already in use should still work')
+
+    def test_clear_template_cache(self):
+        self.renderer.get_template_attribute('macros.html', 'hello')
+        self.renderer.environment.globals['site_greeting'] = u'Welcome'
+        self.renderer.clear_template_cache()
+        self.assertEqual(self.renderer.get_template_attribute('macros.html', 'hello')(u'Matt'), u'Welcome Matt')
+        self.assertEqual(len(self.loads), 2)
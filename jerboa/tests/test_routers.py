@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+"""
+    jerboa.test_routers
+    ~~~~~~~~~~~~~~~~~~~
+
+
+    :copyright: (c) 2015 Lighthouse
+    :license: LGPL
+"""
+import unittest
+import webapp2
+from webob import exc
+from webapp2_extras.routes import RedirectRoute, PathPrefixRoute
+from jerboa.routers import *
+
+__author__ = 'Matt Badger'
+
+
+def dummy_handler(request, response):
+    pass
+
+
+def build_test_routes():
+    return [
+        webapp2.Route(template='/', name='default', handler=dummy_handler),
+        PathPrefixRoute('/user', [
+            RedirectRoute('/create', handler=dummy_handler, name='user_create', strict_slash=True),
+            RedirectRoute('/read/<uid>', handler=dummy_handler, name='user_read', strict_slash=True),
+            RedirectRoute('/page/<page:\d+>', handler=dummy_handler, name='user_page', strict_slash=True),
+            RedirectRoute('/code/<code:[A-Z]{2}>', handler=dummy_handler, name='user_code', strict_slash=True),
+            RedirectRoute('/delete', handler=dummy_handler, name='user_delete', methods=['POST']),
+            RedirectRoute('/file-<name>', handler=dummy_handler, name='user_file'),
+        ]),
+        RedirectRoute('/robots.txt', handler=dummy_handler, name='robots'),
+        webapp2.Route('/static/<:.*>', handler=dummy_handler, name='static'),
+    ]
+
+
+def match_or_exception(router, request):
+    try:
+        route, args, kwargs = router.match(request)
+    except (exc.HTTPNotFound, exc.HTTPMethodNotAllowed), e:
+        return e.__class__
+    return route, args, kwargs
+
+
+class TestRadixRouter(unittest.TestCase):
+    def setUp(self):
+        routes = build_test_routes()
+        self.default_router = webapp2.Router(routes)
+        self.radix_router = RadixRouter(routes)
+
+    def assertSameMatch(self, path, method='GET'):
+        request = webapp2.Request.blank(path)
+        request.method = method
+
+        expected = match_or_exception(self.default_router, request)
+        actual = match_or_exception(self.radix_router, request)
+
+        if isinstance(expected, tuple):
+            self.assertTrue(isinstance(actual, tuple), u'Radix router failed to match `{}`'.format(path))
+            self.assertEqual(expected, actual, u'Different match for `{}`'.format(path))
+        else:
+            self.assertEqual(expected, actual, u'Different exception raised for `{}`'.format(path))
+
+    def test_static_routes(self):
+        for path in ['/', '/user/create', '/user/create/', '/robots.txt', '/robots.txt/']:
+            self.assertSameMatch(path)
+
+    def test_variable_routes(self):
+        for path in ['/user/read/abc', '/user/read/abc/', '/user/read/', '/user/page/10', '/user/page/ten',
+                     '/user/code/GB', '/user/code/gb', '/user/code/GBR']:
+            self.assertSameMatch(path)
+
+    def test_fallback_routes(self):
+        for path in ['/user/file-report', '/static/css/app.min.css', '/static/']:
+            self.assertSameMatch(path)
+
+    def test_methods(self):
+        self.assertSameMatch('/user/delete', method='POST')
+        self.assertSameMatch('/user/delete', method='GET')
+
+    def test_not_found(self):
+        for path in ['/missing', '/user', '/user/read/a/b', '']:
+            self.assertSameMatch(path)
+
+    def test_add_route_recompiles(self):
+        request = webapp2.Request.blank('/late')
+        self.assertEqual(match_or_exception(self.radix_router, request), exc.HTTPNotFound)
+
+        self.radix_router.add(webapp2.Route('/late', handler=dummy_handler, name='late'))
+        self.assertEqual(match_or_exception(self.radix_router, request)[0].name, 'late')
+
+
+class TestRouteMatchCache(unittest.TestCase):
+    def setUp(self):
+        self.router = JerboaRouter(build_test_routes())
+        self.router.match_cache = RouteMatchCache(max_size=2)
+
+    def test_cache_hits(self):
+        request = webapp2.Request.blank('/user/read/abc')
+        first = match_request(self.router, request)
+        second = match_request(self.router, request)
+
+        self.assertEqual(first, second, u'Cached match should be the same as the original')
+        self.assertEqual(self.router.match_cache.stats()['misses'], 1)
+        self.assertEqual(self.router.match_cache.stats()['hits'], 1)
+
+        second[2]['uid'] = 'modified'
+        self.assertEqual(match_request(self.router, request)[2]['uid'], 'abc', u'Cached kwargs should be copied')
+
+    def test_cache_is_bounded(self):
+        for path in ['/user/create', '/user/read/abc', '/robots.txt']:
+            match_request(self.router, webapp2.Request.blank(path))
+
+        self.assertEqual(len(self.router.match_cache), 2)
+        self.assertFalse(self.router.match_cache.request_key(webapp2.Request.blank('/user/create'))
+                         in self.router.match_cache, u'Least recently used entry should be dropped')
+
+    def test_adding_routes_clears_cache(self):
+        match_request(self.router, webapp2.Request.blank('/user/create'))
+        self.router.add(webapp2.Route('/late', handler=dummy_handler, name='late'))
+
+        self.assertEqual(len(self.router.match_cache), 0, u'Adding a route should clear the cache')
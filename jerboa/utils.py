@@ -7,12 +7,17 @@ import json
 from babel import Locale
 from webapp2_extras import i18n
 import urllib
+import time
+import threading
+from collections import OrderedDict
 from urlparse import parse_qs, urlsplit, urlunsplit
 from Crypto.Util.asn1 import DerSequence
 from binascii import a2b_base64
 
 
 I18N_LOCALES_KEY = 'i18n_locales'
+# Key that `webapp2_extras.i18n` uses to store the I18n instance in the request registry
+I18N_REGISTRY_KEY = 'webapp2_extras.i18n.I18n'
 
 
 def filter_unwanted_params(request_params, unwanted=None):
@@ -101,6 +106,206 @@ def set_url_query_parameter(url, new_query_params, keep_blank_values=0):
     return urlunsplit((scheme, netloc, path, new_query_string, fragment))
 
 
+def request_locale(request):
+    """
+    Returns the locale of the request: `request.locale` if it has been set, otherwise the locale of the
+    `webapp2_extras.i18n` store. If the store doesn't exist yet it is created, with the app's `locale_selector`, as it
+    would be when the page is rendered; cache keys that only used an existing store would share one entry between
+    locales. Returns None if the request isn't being handled by an app.
+    """
+    locale = getattr(request, 'locale', None)
+    if locale:
+        return locale
+    try:
+        return request.registry[I18N_REGISTRY_KEY].locale
+    except KeyError:
+        pass
+    except AttributeError:
+        return None
+
+    if getattr(request, 'app', None) is None:
+        return None
+    return i18n.get_i18n(request=request).locale
+
+
+def current_request_globals():
+    """
+    Returns the (app, request) that webapp2 has bound to the current thread, or (None, None). Unlike the webapp2 thread
+    local proxies, the returned objects can be used from another thread.
+    """
+    try:
+        app, request = webapp2.get_app(), webapp2.get_request()
+    except AssertionError:
+        return None, None
+    # Off App Engine these are proxies, which resolve against whichever thread uses them
+    app = getattr(app, '_get_current_object', lambda: app)()
+    request = getattr(request, '_get_current_object', lambda: request)()
+    return app, request
+
+
+class RequestContext(object):
+    """
+    Binds the webapp2 globals (and so i18n) and the namespace of a request to the current thread for the duration of a
+    `with` block, then restores whatever was bound before. Use it to run request code outside of the dispatcher e.g. on
+    another thread, or from a response `app_iter` that is consumed after the app has returned.
+
+        context = RequestContext.capture(namespace_manager=namespace_manager)
+        ...
+        with context:
+            template.render()
+
+    If the request is already bound to the thread, the globals are left as they are. The same context can be used by
+    several threads at once.
+    """
+    __slots__ = ('app', 'request', 'namespace_manager', 'namespace', '_local')
+
+    def __init__(self, app, request, namespace_manager=None, namespace=None):
+        self.app = app
+        self.request = request
+        self.namespace_manager = namespace_manager
+        self.namespace = namespace
+        # What to restore on exit, for each thread
+        self._local = threading.local()
+
+    @classmethod
+    def capture(cls, namespace_manager=None):
+        """
+        Returns the context of the current thread: its webapp2 globals and, if a namespace manager is given, its
+        namespace.
+        """
+        app, request = current_request_globals()
+        namespace = namespace_manager.get_namespace() if namespace_manager is not None else None
+        return cls(app, request, namespace_manager=namespace_manager, namespace=namespace)
+
+    def __enter__(self):
+        previous_app, previous_request = current_request_globals()
+        bind = self.app is not None and previous_request is not self.request
+        if bind:
+            self.app.set_globals(app=self.app, request=self.request)
+
+        previous_namespace = None
+        if self.namespace_manager is not None:
+            previous_namespace = self.namespace_manager.get_namespace()
+            if previous_namespace != self.namespace:
+                self.namespace_manager.set_namespace(self.namespace)
+
+        self._local.previous = bind, previous_app, previous_request, previous_namespace
+        return self
+
+    def __exit__(self, *exc_info):
+        bind, previous_app, previous_request, previous_namespace = self._local.previous
+        if self.namespace_manager is not None and self.namespace_manager.get_namespace() != previous_namespace:
+            self.namespace_manager.set_namespace(previous_namespace)
+        if bind:
+            if previous_app is not None:
+                previous_app.set_globals(app=previous_app, request=previous_request)
+            else:
+                self.app.clear_globals()
+
+
+class LRUCache(object):
+    """
+    Simple thread safe, size bounded cache. The least recently used entry is dropped once `max_size` is reached.
+
+    Hits and misses are counted so that you can check how effective the cache is via `stats()`.
+    """
+    def __init__(self, max_size=1000):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value = self._data.pop(key)
+            except KeyError:
+                self.misses += 1
+                return default
+            # Re-inserting moves the entry to the most recently used end
+            self._data[key] = value
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = value
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            return self._data.pop(key, None) is not None
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        return {
+            'size': len(self._data),
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses,
+        }
+
+
+class LocalMemcacheClient(object):
+    """
+    In process stand in for a memcache client, such as `google.appengine.api.memcache`. Use it to run a memcache backed
+    cache locally, or in tests and benchmarks. Entries are only shared within the process.
+
+    Supports the subset of the client API that Jerboa uses: `get`, `set`, `add`, `delete` and `flush_all`. `time` is
+    the number of seconds until the entry expires; 0 means it never expires.
+    """
+    def __init__(self, max_size=1000, clock=time.time):
+        self.clock = clock
+        self._cache = LRUCache(max_size=max_size)
+
+    def get(self, key):
+        entry = self._cache.get(key)
+        if entry is None:
+            return None
+
+        value, expires = entry
+        if expires and expires <= self.clock():
+            self._cache.delete(key)
+            return None
+        return value
+
+    def set(self, key, value, time=0):
+        self._cache.set(key, (value, self.clock() + time if time else 0))
+        return True
+
+    def add(self, key, value, time=0):
+        if self.get(key) is not None:
+            return False
+        return self.set(key, value, time=time)
+
+    def delete(self, key):
+        return self._cache.delete(key)
+
+    def flush_all(self):
+        self._cache.clear()
+        return True
+
+    def get_stats(self):
+        stats = self._cache.stats()
+        return {
+            'hits': stats['hits'],
+            'misses': stats['misses'],
+            'items': stats['size'],
+        }
+
+
 def convert_pem_to_rsa_string(pem):
     # Convert from PEM to DER
     lines = pem.replace(" ", '').split()
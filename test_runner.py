@@ -8,6 +8,33 @@ from jerboa.tests.test_app import TestComponentConfigParser
 from jerboa.tests.test_app import TestUIHandlerHooks
 from jerboa.tests.test_app import TestFormHandlerHooks
 from jerboa.tests.test_app import TestSearchFormHandlerHooks
+from jerboa.tests.test_app import TestHandlerDispatchTable
+from jerboa.tests.test_app import TestDispatchTiming
+from jerboa.tests.test_app import TestMatchCacheDispatch
+from jerboa.tests.test_app import TestDispatcherPipeline
+from jerboa.tests.test_app import TestNamespaceResolver
+from jerboa.tests.test_app import TestStreamedTemplate
+from jerboa.tests.test_app import TestConcurrentPreHooks
+from jerboa.tests.test_app import TestErrorReporter
+from jerboa.tests.test_app import TestOutputCache
+from jerboa.tests.test_app import TestConditionalGet
+from jerboa.tests.test_app import TestCompression
+from jerboa.tests.test_routers import TestRadixRouter
+from jerboa.tests.test_routers import TestRouteMatchCache
+from jerboa.tests.test_renderers import TestStreamingRender
+from jerboa.tests.test_renderers import TestRenderContext
+from jerboa.tests.test_renderers import TestBytecodeCache
+from jerboa.tests.test_renderers import TestTemplateCompiler
+from jerboa.tests.test_renderers import TestFragmentCache
+from jerboa.tests.test_renderers import TestSimpleRenderer
+from jerboa.tests.test_renderers import TestTemplatePreload
+from jerboa.tests.test_renderers import TestJsonRenderer
+from jerboa.tests.test_renderers import TestTemplateModuleCache
+from jerboa.tests.test_forms import TestFormPrototype
+from jerboa.tests.test_forms import TestValidationPlan
+from jerboa.tests.test_forms import TestChoiceIndex
+from jerboa.tests.test_forms import TestRenderedOptions
+from jerboa.tests.test_forms import TestRecaptchaVerification
 
 __author__ = 'Matt'
 